@@ -0,0 +1,174 @@
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+import argparse
+import csv
+import os
+import sys
+import time
+
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+# settings naming a file a run writes, one per job
+OUTPUTS = ('record', 'metrics', 'profile_out')
+
+
+class NearMisses:
+    """ Observer counting, per run, the distinct pairs of cars from
+    different approaches making conflicting movements (the crossing's
+    conflict table) that were inside the same crossing zone at the same
+    time (near misses), and the pairs whose rects actually overlapped there
+    (crashes). Cars from one approach share a lane, which --safety looks
+    after. Only intersections holding cars are looked at """
+    def __init__(self):
+        from movements import MOVEMENTS, TURNS # in the worker, like main
+        self.near = set()
+        self.crashes = set()
+        # (heading, movement, turned yet) -> (approach, movement index)
+        self.approaches = {}
+        for m, (h, kind) in enumerate(MOVEMENTS):
+            self.approaches[h, kind, False] = (h, m)
+            self.approaches[TURNS[h][kind], kind, True] = (h, m)
+
+    def __call__(self, sim):
+        approaches = self.approaches
+        for intersection in sim.busy:
+            zone = intersection.cross_zone
+            conflicts = intersection.conflicts
+            inside = [(c, approaches[c.direction, c.movement,
+                    c.movement != 'through' and c.turn_at is not intersection])
+                    for c in intersection.cars if c.colliderect(zone)]
+            for i, (a, (h, m)) in enumerate(inside):
+                for b, (k, n) in inside[i + 1:]:
+                    if h != k and conflicts[m] >> n & 1:
+                        pair = (min(a.uid, b.uid), max(a.uid, b.uid))
+                        self.near.add(pair)
+                        if a.colliderect(b):
+                            self.crashes.add(pair)
+
+
+def run_one(job):
+    """ one headless run: job is (params, seed, duration, base), base
+    being the settings params are laid over. Files the run writes (record,
+    metrics, profile_out) are named after the job, see job_path. Returns a
+    row of the results table """
+    params, seed, duration, base = job
+    import main # in the worker, so pygame is imported once per process
+    started = time.perf_counter()
+    settings = dict(base, headless=True, seed=seed)
+    settings.update(params)
+    for name in OUTPUTS:
+        if settings.get(name):
+            settings[name] = job_path(settings[name], params, seed)
+    sim = main.Simulation(**settings)
+    # run like main.py would, with its log, metrics and profiler. Crossings
+    # can only be watched tick by tick, so not with the event engine
+    misses = None if sim.use_events else NearMisses()
+    sim.execute(duration, [misses] if misses else [])
+    row = dict(params)
+    row['seed'] = seed
+    row['trips'] = sim.trips
+    row['throughput'] = sim.trips / duration * 60 # cars per minute
+    row['mean_delay'] = sim.trip_delay / sim.trips if sim.trips else 0.
+    row['near_misses'] = len(misses.near) if misses else None
+    row['crashes'] = len(misses.crashes) if misses else None
+    row['delay_saved'] = sim.delay_saved # by batch planning, seconds
+    if sim.lanes is not None: # safety=1 or follow=1 swept
+        row['lane_collisions'] = len(sim.lanes.collisions)
+        row['lane_near_misses'] = len(sim.lanes.near_misses)
+    row['wall_time'] = time.perf_counter() - started
+    return row
+
+
+def job_path(path, params, seed):
+    """ path with the job's swept parameters and seed added to its name,
+    e.g. m.csv -> m-speed_limit=20-seed=3.csv, so jobs don't write over
+    each other's files """
+    root, ext = os.path.splitext(path)
+    tags = ['%s=%s' % (name, ':'.join(map(str, value))
+            if isinstance(value, tuple) else value)
+            for name, value in params.items() if name not in OUTPUTS]
+    return '-'.join([root] + tags + ['seed=%d' % seed]) + ext
+
+
+def sweep(grid, seeds, duration, processes=None, base=None):
+    """ run every combination of grid (parameter name -> list of values)
+    for every seed, spread over a process pool, on top of the base
+    settings (e.g. a scenario's). Rows come back in job order, and each
+    run only depends on its parameters and seed """
+    names = list(grid)
+    base = base or {}
+    jobs = [(dict(zip(names, values)), seed, duration, base)
+            for values in product(*(grid[n] for n in names))
+            for seed in seeds]
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        return list(pool.map(run_one, jobs))
+
+
+def write_csv(rows, out):
+    if not rows:
+        return
+    writer = csv.DictWriter(out, fieldnames=list(rows[0]))
+    writer.writeheader()
+    for row in rows:
+        writer.writerow({k: ':'.join(map(str, v)) if isinstance(v, tuple)
+                else v for k, v in row.items()})
+
+
+def parse_value(text):
+    """ 20 -> int, .5 -> float, 20:40:80 -> tuple of numbers, true/false
+    -> bool, anything else (a path) -> the text itself """
+    if text.lower() in ('true', 'false'):
+        return text.lower() == 'true'
+    try:
+        if ':' in text:
+            return tuple(number(t) for t in text.split(':'))
+        return number(text)
+    except ValueError:
+        return text
+
+
+def number(text):
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+            description='Parameter sweep over headless simulation runs')
+    parser.add_argument('--param', action='append', default=[],
+            metavar='NAME=V1,V2', help='Simulation keyword and values to '
+            'sweep, e.g. speed_limit=15,20 or car_lengths=20:40,50:80')
+    parser.add_argument('--seeds', type=int, default=10,
+            help='seeds 0..N-1 per parameter combination')
+    parser.add_argument('--duration', type=float, default=None,
+            help='simulated seconds per run (default: the scenario\'s, '
+            'or 600)')
+    parser.add_argument('--scenario', metavar='FILE',
+            help='scenario file (.toml or .json) the swept parameters '
+            'are laid over')
+    parser.add_argument('--processes', type=int, default=None,
+            help='worker processes (default: one per core)')
+    parser.add_argument('--out', default=None,
+            help='CSV file for the results table (default: stdout)')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    grid = {}
+    for param in args.param:
+        name, values = param.split('=', 1)
+        grid[name] = [parse_value(v) for v in values.split(',')]
+    base, duration = {}, None
+    if args.scenario:
+        from scenario import load
+        base, duration = load(args.scenario)
+    rows = sweep(grid, range(args.seeds), args.duration or duration or 600,
+            args.processes, base)
+    if args.out:
+        with open(args.out, 'w', newline='') as out:
+            write_csv(rows, out)
+    else:
+        write_csv(rows, sys.stdout)
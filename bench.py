@@ -0,0 +1,302 @@
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import time
+
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+        'bench_baseline.json')
+SIZES = (10, 1000, 100000) # outstanding reservations
+# spawn intervals of the tick benchmark, from a few cars to thousands
+INTERVALS = (1., .3, .1, .03, .01)
+FLEET_SIZES = (1000, 10000, 100000) # cars loaded into the fleet store
+# most a baseline's spread may widen the tolerance by, so a baseline saved
+# on a noisy machine still catches regressions
+MAX_SPREAD = .05
+# end to end runs, (name, Simulation keywords)
+SCENARIOS = [
+    ('single', {}),
+    ('grid', {'grid': (3, 3), 'turn_mix': (.6, .2, .2)}),
+    ('tiles', {'grid': (2, 2), 'turn_mix': (.6, .2, .2), 'tiles': 4}),
+    ('plan', {'grid': (2, 2), 'plan_window': .5}),
+    ('platoon', {'grid': (2, 2), 'platoon_headway': .5, 'accel': 2000}),
+    ('follow', {'grid': (2, 2), 'follow': True}),
+]
+
+
+def result(value, unit, better, spread=0.):
+    """ better: 'lower', 'higher' or 'equal' (a count the same seed must
+    reproduce exactly). spread: how far the samples of a timing scattered
+    around value, relative to it (summary()) """
+    return {'value': value, 'unit': unit, 'better': better, 'spread': spread}
+
+
+def summary(samples):
+    """ (median, spread) of timing samples, spread being the interquartile
+    range relative to the median. Unlike the fastest or the mean, neither
+    moves much on a machine busy with something else now and then """
+    samples = sorted(samples)
+    n = len(samples)
+    median = (samples[(n - 1) // 2] + samples[n // 2]) / 2
+    return median, (samples[3 * n // 4] - samples[n // 4]) / median
+
+
+def timed(repeat, run):
+    """ summary() of repeat calls of run(), in seconds """
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - started)
+    return summary(times)
+
+
+def controller(n, rng):
+    """ a controller holding n reservations of random movements, spread
+    over time as a busy crossing would have them """
+    import main
+    sim = main.Simulation(headless=True, seed=0)
+    sim.on_init()
+    sim.object_init()
+    ctrl = sim.intersections[0].controller
+    ctrl.now = 0.
+    t = 0.
+    for owner in range(n):
+        t += rng.uniform(0., .4)
+        kind = ctrl.movements[owner] = rng.randrange(12)
+        ctrl.reservations.add(owner, t, t + rng.uniform(.2, .6), kind)
+    return ctrl, t
+
+
+def bench_reservations(ops=10000, repeat=15):
+    """ microseconds per insert, query (overlapping), remove, conflicting
+    and resolve with n reservations outstanding """
+    results = {}
+    for n in SIZES:
+        rng = random.Random(n)
+        ctrl, horizon = controller(n, rng)
+        book = ctrl.reservations
+        windows = []
+        for _ in range(ops):
+            start = rng.uniform(0., horizon)
+            windows.append((start, start + rng.uniform(.2, .6)))
+        new = [('new', i) for i in range(ops)]
+        for owner in new:
+            ctrl.movements[owner] = rng.randrange(12)
+
+        def query():
+            for window in windows:
+                book.overlapping(*window)
+
+        def conflicting():
+            for owner, window in zip(new, windows):
+                ctrl.conflicting(window, owner)
+
+        # resolve is only ever asked about requests that conflict, here
+        # by cars that can get to any slot
+        clashes = [(o, w) for o, w in zip(new, windows)
+                if ctrl.conflicting(w, o)]
+        anytime = (0., float('inf'))
+
+        def resolve():
+            for owner, window in clashes:
+                ctrl.resolve(owner, window, anytime)
+
+        # every insert is undone by a remove, so n stay outstanding
+        inserts, removes = [], []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            for owner, window in zip(new, windows):
+                book.add(owner, window[0], window[1], ctrl.movements[owner])
+            inserts.append(time.perf_counter() - started)
+            started = time.perf_counter()
+            for owner in new:
+                book.remove(owner)
+            removes.append(time.perf_counter() - started)
+        timings = {'insert': (summary(inserts), ops),
+                'remove': (summary(removes), ops),
+                'query': (timed(repeat, query), ops),
+                'conflicting': (timed(repeat, conflicting), ops),
+                'resolve': (timed(repeat, resolve), max(len(clashes), 1))}
+        for op, ((seconds, spread), count) in timings.items():
+            results['reservations/%s/%d' % (op, n)] = result(
+                    seconds / count * 1e6, 'us/op', 'lower', spread)
+    return results
+
+
+def bench_ticks(ticks=300, warmup=60., grid=(4, 4), chunk=10):
+    """ headless ticks per second on a grid, at a growing spawn rate,
+    timed chunk ticks at a time. The mean number of cars reached is
+    reported alongside """
+    import main
+    results = {}
+    for interval in INTERVALS:
+        sim = main.Simulation(headless=True, seed=0, grid=grid,
+                spawn_interval=interval, turn_mix=(.6, .2, .2))
+        sim.on_init()
+        sim.object_init()
+        sim.run(warmup)
+        cars = 0
+        times = []
+        for _ in range(ticks // chunk):
+            started = time.perf_counter()
+            for _ in range(chunk):
+                sim.step()
+                cars += len(sim.cars)
+            times.append(time.perf_counter() - started)
+        sim.close()
+        seconds, spread = summary(times)
+        name = 'ticks/interval=%g' % interval
+        results[name + '/rate'] = result(chunk / seconds, 'ticks/s',
+                'higher', spread)
+        results[name + '/cars'] = result(round(cars / ticks), 'cars', 'equal')
+    return results
+
+
+def bench_fleet(ticks=200, chunk=10, world=2000, seed=0):
+    """ ticks per second of the fleet store's per tick work (move every
+    car, find those that left the world and those that changed cells)
+    with n cars loaded at once through add_many """
+    import numpy as np
+    from fleet import Fleet
+    results = {}
+    for n in FLEET_SIZES:
+        rng = np.random.default_rng(seed)
+        fleet = Fleet(capacity=n)
+        across = rng.random(n) < .5
+        forward = np.where(rng.random(n) < .5, 1., -1.)
+        fleet.add_many(rng.uniform(0, world, n), rng.uniform(0, world, n),
+                np.where(across, forward, 0.), np.where(across, 0., forward),
+                rng.uniform(10, 20, n), rng.choice([40., 80.], n))
+        times = []
+        now = 0.
+        for _ in range(ticks // chunk):
+            started = time.perf_counter()
+            for _ in range(chunk):
+                now += 1 / 30
+                fleet.step(now)
+                fleet.outside(world, world)
+                fleet.refiled()
+            times.append(time.perf_counter() - started)
+        seconds, spread = summary(times)
+        results['fleet/%d/rate' % n] = result(chunk / seconds, 'ticks/s',
+                'higher', spread)
+    return results
+
+
+def bench_scenarios(duration=120., seed=3, repeat=9):
+    """ wall time of whole seeded runs (the median of repeat), and the
+    trips they made """
+    import main
+    results = {}
+    for name, params in SCENARIOS:
+        sim = main.Simulation(headless=True, seed=seed, **params)
+
+        def run():
+            sim.on_init()
+            sim.object_init()
+            sim.run(duration)
+            sim.close()
+
+        seconds, spread = timed(repeat, run)
+        results['scenario/%s/time' % name] = result(seconds, 's', 'lower',
+                spread)
+        results['scenario/%s/trips' % name] = result(sim.trips, 'trips',
+                'equal')
+    return results
+
+
+SUITES = {'reservations': bench_reservations, 'ticks': bench_ticks,
+        'fleet': bench_fleet, 'scenarios': bench_scenarios}
+
+
+def compare(results, baseline, tolerance):
+    """ [(name, baseline value, value, change, status)] for every result.
+    A time or rate more than tolerance (a fraction) worse than the
+    baseline's, widened by twice the baseline's spread (at most
+    MAX_SPREAD), or a count that differs at all, is a regression. A noisy
+    run now doesn't widen its own margin """
+    rows = []
+    for name, now in results.items():
+        base = baseline.get(name)
+        if base is None:
+            rows.append((name, None, now['value'], None, 'new'))
+            continue
+        old, value = base['value'], now['value']
+        if now['better'] == 'equal':
+            status = 'ok' if value == old else 'REGRESSION'
+            rows.append((name, old, value, None, status))
+            continue
+        # how many times slower than the baseline
+        slower = value / old if now['better'] == 'lower' else old / value
+        margin = 1 + tolerance + 2 * min(base.get('spread', 0.), MAX_SPREAD)
+        if slower > margin:
+            status = 'REGRESSION'
+        elif slower < 1 / margin:
+            status = 'faster'
+        else:
+            status = 'ok'
+        rows.append((name, old, value, slower - 1, status))
+    return rows
+
+
+def report(rows, out=sys.stderr):
+    width = max(len(row[0]) for row in rows)
+    for name, old, value, change, status in rows:
+        out.write('%-*s %12s %12s %8s  %s\n' % (width, name,
+                '-' if old is None else '%.4g' % old, '%.4g' % value,
+                '' if change is None else '%+.0f%%' % (100 * change),
+                status))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+            description='Benchmarks of the controller and engine hot paths')
+    parser.add_argument('--suite', action='append', choices=list(SUITES),
+            help='suite to run, can be given more than once (default: all)')
+    parser.add_argument('--out', default=None,
+            help='JSON file for the results (default: stdout)')
+    parser.add_argument('--baseline', default=BASELINE,
+            help='JSON results to compare against, saved on this machine')
+    parser.add_argument('--save', action='store_true',
+            help='store the results as the new baseline instead')
+    parser.add_argument('--tolerance', type=float, default=.25,
+            help='fraction a timing may be worse than the baseline\'s '
+            'before it counts as a regression')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    # the platoon scenario books forced conflicts every few seconds, a
+    # warning each, which would bury the report
+    logging.basicConfig(level=logging.ERROR, format='%(message)s')
+    results = {}
+    for suite in args.suite or SUITES:
+        results.update(SUITES[suite]())
+    text = json.dumps(results, indent=1, sort_keys=True)
+    if args.save:
+        with open(args.baseline, 'w') as out:
+            out.write(text + '\n')
+        sys.exit(0)
+    if args.out:
+        with open(args.out, 'w') as out:
+            out.write(text + '\n')
+    else:
+        print(text)
+    if not os.path.exists(args.baseline):
+        sys.stderr.write('no baseline at %s to compare against, save one '
+                'on this machine with --save\n' % args.baseline)
+        sys.exit(0)
+    with open(args.baseline) as f:
+        rows = compare(results, json.load(f), args.tolerance)
+    report(rows)
+    failed = [row[0] for row in rows if row[4] == 'REGRESSION']
+    if failed:
+        sys.exit('%d regressions against %s: %s' % (len(failed),
+                args.baseline, ', '.join(failed)))
@@ -1,84 +1,328 @@
-import pygame
-from pygame.locals import *
-import random
+from movements import MOVEMENTS, TURNS, ahead, crossing, movement
+from profiles import arrival, reach, segments
+from reservations import ReservationBook
+from tiles import TileBook
+from math import ceil
+import logging
+
+
+log = logging.getLogger(__name__)
+DECIDED = {'requested': 'no adjustments', 'sped up': 'speeding up',
+        'slowed': 'slowing'}
+TOP = 1.5 # cars are sped up to at most this many times their own speed
+
+
+class Platoon:
+    """ Cars with the same movement, close behind each other, sharing one
+    reservation. Followers arrive moved by the leader's shift, so one
+    decision covers them all. Formed when a second car joins a leader """
+    def __init__(self, leader, shift, start, clear):
+        self.members = {leader: None} # in arrival order
+        self.shift = shift # seconds the leader's slot moved from its request
+        self.tail = start # when the last member gets to the crossing
+        self.clear = clear # when its rear (plus 10%) is in the crossing
 
 
 class Controller():
     def __init__(self, parent_intersection):
         self.intersection = parent_intersection
         self.cars_in = set()
-        self.reservations = {} # reserved time slots for passing cars
-                               # dict ordered for 3.7 and up already.
-                               # can change to OrderedDict to be more general
+        self.reservations = ReservationBook() # reserved time slots for
+                                              # passing cars, in time order
+        self.recorder = None # replay.Recorder logging decisions, if any
+        self.metrics = None # metrics.Metrics collecting granted slots
+        self.movements = {} # car -> movement index through the crossing
+        self.tiles = TileBook() # tile claims, when the crossing is tiled
+        self.planner = None # planner.Planner batching decisions, if any
+        self.platoons = {} # car -> Platoon it crosses with
+        # movement index -> newest Platoon open to followers, or the
+        # Platoon fields of a car leading none yet
+        self.open = {}
     def reserve_spot(self, car):
-        factor = self.intersection.factor
-        width = self.intersection.cross_zone.width
-        self.now = pygame.time.get_ticks() / 1000 # simulation time in seconds
-        time_start = self.now + factor * width/car.vel # time to crossing
-        time_end = time_start + (width + 1.1* car.l) / car.vel # add 10% buffer
+        clock = self.intersection.clock
+        self.now = clock.now # simulation time in seconds
+        vel = car.vel / clock.dt # pixels per tick -> pixels per second
+        # time to crossing, getting back to its own speed on the way
+        time_start = self.now + clock.dt * arrival(self.to_go(car),
+                car.speed, car.vel, self.intersection.accel_step)
+        self.movements[car] = movement(car.direction, car.movement)
+        time_end = time_start + self.path(car) / vel
         time_request = (time_start, time_end)
-        if not self.conflicting(time_request):
-            self.reservations.update({car : time_request})
-            print('no adjustments')
+        if self.intersection.headway and self.join(car, time_request):
+            return
+        if self.planner is not None: # decided with the rest of its batch
+            self.planner.add(car, time_request)
         else:
-            #print('Crash or close call predicted')
-            self.resolve(car, time_request)
+            slot, decision = self.place(car, time_request)
+            self.commit(car, time_request, slot, decision)
 
-    def remove_reservation(self, car):
-        self.reservations.pop(car)
+    def place(self, car, time_request):
+        """ (slot, decision) the greedy rule gives car right now: the
+        request if it's free, otherwise a slot sped up or slowed to fit, as
+        far as the car can still speed up or slow down. Nothing is booked """
+        if self.intersection.tiling is not None:
+            return self.place_tiles(car, time_request)
+        if not self.conflicting(time_request, car):
+            return time_request, 'requested'
+        #print('Crash or close call predicted')
+        return self.resolve(car, time_request)
+
+    def to_go(self, car):
+        """ pixels between the front of car and the crossing """
+        rect = getattr(car, 'rect', car) # workers only hold a car's record
+        return ahead(rect, car.direction, self.intersection.cross_zone)
+
+    def path(self, car):
+        """ pixels the front of car drives from the crossing's edge until
+        it's clear of it on its movement, plus 10% of its length as buffer.
+        A turn comes on the tick the car gets to the turn line, so up to a
+        tick of driving past it is lost and counted too """
+        heading, kind = MOVEMENTS[self.movements[car]]
+        intersection = self.intersection
+        path = crossing(intersection.cross_zone, intersection.lanes, heading,
+                TURNS[heading][kind], car.l) + .1 * car.l
+        if kind != 'through':
+            path += car.vel
+        return path
 
-    def conflicting(self, request):
-        if not self.reservations: # if empty, no overlap -> reserve time
+    def reach(self, car):
+        """ (earliest, latest) simulated time car can get to the crossing
+        at from where it is, with the speed ramps it's allowed, no faster
+        than TOP times its own speed and back at that speed """
+        clock = self.intersection.clock
+        top = max(TOP * car.vel, car.speed)
+        earliest, latest = reach(self.to_go(car), car.speed, car.vel,
+                self.intersection.accel_step, top)
+        return self.now + earliest * clock.dt, self.now + latest * clock.dt
+
+    def book(self, car, time_request, slot):
+        """ hold slot for car. Tiles are claimed along the path asked for
+        in time_request, moved to the slot """
+        self.reservations.add(car, slot[0], slot[1], self.movements[car])
+        tiling = self.intersection.tiling
+        if tiling is not None:
+            clock = self.intersection.clock
+            shift = round(clock.to_ticks(slot[0] - time_request[0]))
+            self.tiles.add(car, self.claims(car, time_request), shift)
+
+    def unbook(self, car):
+        self.reservations.remove(car)
+        if car in self.tiles:
+            self.tiles.remove(car)
+
+    def commit(self, car, time_request, slot, decision):
+        """ book slot and tell the car, wherever it got to since it asked
+        for time_request """
+        self.book(car, time_request, slot)
+        log.debug(DECIDED[decision])
+        if self.recorder is not None:
+            self.recorder.reserve(self, car, slot, decision)
+        if self.metrics is not None:
+            self.metrics.grant(self, car, time_request, slot)
+        if slot != time_request:
+            self.send_instructions(car, slot)
+        if self.intersection.headway:
+            self.lead(car, time_request, slot)
+
+    def lead(self, car, time_request, slot):
+        """ let followers join car, which keeps its own reservation until
+        one does """
+        vel = self.path(car) / (slot[1] - slot[0])
+        self.open[self.movements[car]] = (car, slot[0] - time_request[0],
+                slot[0], slot[0] + 1.1 * car.l / vel)
+
+    def join(self, car, time_request):
+        """ Add car to the open platoon of its movement, if it's within
+        the headway behind the last member. It arrives moved by the
+        platoon's shift, but never before the car in front is clear, and
+        the shared slot is stretched to cover it. A car leading no platoon
+        yet forms one with it. False if there's no such platoon or the
+        stretch runs into a conflicting slot. The follower still gets its
+        own speed profile to its part of the slot, its speed and distance
+        aren't the leader's """
+        m = self.movements[car]
+        platoon = self.open.get(m)
+        if platoon is None:
+            return False
+        if isinstance(platoon, Platoon):
+            owner = platoon
+            shift, tail, clear = platoon.shift, platoon.tail, platoon.clear
+            size = len(platoon.members)
+        else: # a lone leader
+            owner, shift, tail, clear = platoon
+            size = 1
+        start = time_request[0] + shift
+        if (start - tail > self.intersection.headway
+                or size >= self.intersection.platoon_size):
             return False
-        for _, r in self.reservations.items():
-            start1, end1, start2, end2 = request[0], request[1], r[0], r[1]
-            if end1 >= start2 and end2 > start1: # if there's an overlap
-                return True
-        return False
-
-    def resolve(self, car, time_request):
-        new_request = None
+        start = max(start, clear)
+        if start <= self.now:
+            return False
+        earliest, latest = self.reach(car)
+        if not earliest <= start <= latest: # can't make it there then
+            return False
+        delta = time_request[1] - time_request[0]
+        slot = (start, start + delta)
+        first, end = self.reservations.get(owner)
+        # the shared slot itself ends where the stretch starts, so it
+        # never counts as in the way
+        if slot[1] > end and self.reservations.overlaps(end, slot[1],
+                self.mask(car)):
+            return False
+        tiling = self.intersection.tiling
+        if tiling is not None:
+            claims = self.claims(car, time_request)
+            shift = round(self.intersection.clock.to_ticks(
+                    start - time_request[0]))
+            if not self.tiles.fits(claims, shift):
+                return False
+            self.tiles.add(car, claims, shift)
+        if owner is not platoon: # the leader's slot becomes the platoon's
+            platoon = Platoon(owner, *platoon[1:])
+            self.reservations.remove(owner)
+            self.movements[platoon] = m
+            self.platoons[owner] = platoon
+            self.open[m] = platoon
+        self.reservations.add(platoon, first, max(end, slot[1]), m)
+        platoon.members[car] = None
+        platoon.tail = start
+        platoon.clear = start + 1.1 * car.l * delta / self.path(car)
+        self.platoons[car] = platoon
+        log.debug('joining platoon')
+        if self.recorder is not None:
+            self.recorder.reserve(self, car, slot, 'platooned')
+        if self.metrics is not None:
+            self.metrics.grant(self, car, time_request, slot)
+        if slot != time_request:
+            self.send_instructions(car, slot)
+        return True
+
+    def remove_reservation(self, car):
+        """ car left, or despawned inside the boundary """
+        m = self.movements.pop(car)
+        platoon = self.platoons.pop(car, None)
+        if self.planner is not None and car in self.planner.pending:
+            self.planner.forget(car) # never got a slot
+        elif platoon is None:
+            self.unbook(car)
+            leader = self.open.get(m)
+            if isinstance(leader, tuple) and leader[0] is car:
+                del self.open[m]
+        else:
+            del platoon.members[car]
+            if car in self.tiles:
+                self.tiles.remove(car)
+            if not platoon.members: # the last one out frees the slot
+                self.reservations.remove(platoon)
+                del self.movements[platoon]
+                if self.open.get(m) is platoon:
+                    del self.open[m]
+
+    def mask(self, car):
+        """ movement kinds whose reservations conflict with car's, as the
+        bits of one entry in the intersection's conflict table """
+        return self.intersection.conflicts[self.movements[car]]
+
+    def conflicting(self, request, car):
+        return self.reservations.overlaps(request[0], request[1],
+                self.mask(car))
+
+    def resolve(self, car, time_request, window=None):
+        """ slot for a request that conflicts: sped up in front of the
+        first reservation in the way, or slowed into the first gap after
+        it, starting within window, the (earliest, latest) time the car can
+        get there (reach() by default) """
+        earliest, latest = window or self.reach(car)
         delta = time_request[1] - time_request[0]
-        res = list(self.reservations.values()) # list of reserved times
-        front = (self.now, res[0][0]) # time delta range in the front
-        if (delta < front[1] - front[0]) and (time_request[1] < sum(res[0])/2):
+        pad = .1 * delta # 10% time buffer
+        book = self.reservations
+        mask = self.mask(car) # compatible movements may share slots
+        # earliest reservation in the way, and the free time in front of it
+        first = book.overlapping(time_request[0], time_request[1], mask)[0]
+        front_open = book.free_since(first[0], self.now, mask)
+        new_start = first[0] - pad - delta
+        if (new_start >= front_open and new_start > self.now
+                and new_start >= earliest
+                and time_request[1] < (first[0] + first[1])/2):
             # In this case it's better to speed up
-            print('speeding up')
-            new_end = front[1] - .1 * delta # 10% buffer
-            new_start = new_end - delta
-            new_request = (new_start, new_end)
-            self.reservations.update({car : new_request})
+            decision = 'sped up'
         else:
-            last_ranges = [(res[i][1], res[i+1][0]) for i in range(len(res)-1)]
-            if len(last_ranges) > 1:
-                for r in last_ranges:
-                    if delta < r[1]-r[0]:
-                        new_start = (r[1] - r[0] - delta)/2 + r[0]
-                        new_end = new_start + delta
-                        new_request = (new_start, new_end)
-                        print('slowing a little')
-                        self.reservations.update({car : new_request})
-            if not new_request:
-                # if the above failed, there's no room in front or between
-                # so we add it to the end
-                print('slowing')
-                new_start = res[-1][1] + .1 * delta # 10% time buffer
-                new_end = new_start + delta
-                new_request = (new_start, new_end)
-                self.reservations.update({car : new_request})
-
-        self.send_instructions(car, new_request)
+            # otherwise take the first gap after the requested time that
+            # fits, between reservations or after the last one
+            decision = 'slowed'
+            new_start = book.earliest_gap(time_request[0], delta + pad,
+                    mask) + pad
+            if new_start > latest: # can't slow down that much, so the
+                # first gap it can make, even if that means speeding up
+                new_start = book.earliest_gap(earliest - pad, delta + pad,
+                        mask) + pad
+                if new_start < time_request[0]:
+                    decision = 'sped up'
+            if new_start > latest: # nothing free it can get to
+                log.warning('no reachable slot, car %s booked into a '
+                        'conflicting one at %.2f s', car.uid, latest)
+                new_start = latest
+        return (new_start, new_start + delta), decision
+
+    def claims(self, car, time_request):
+        """ tiles car's path covers per tick, arriving as requested. The
+        movement and speed are the ones the request was made for """
+        clock = self.intersection.clock
+        heading, kind = MOVEMENTS[self.movements[car]]
+        length = 1.1 * car.l
+        vel = self.path(car) / (time_request[1] - time_request[0])
+        return self.intersection.tiling.claims(heading, kind, length, vel,
+                time_request[0], clock.dt)
+
+    def place_tiles(self, car, time_request, window=None):
+        """ Place the car's path tile by tile. If its claims collide, move
+        them to the nearest earlier tick that's free (speeding up, by at
+        most half the slot and never to before now), or else to the first
+        free tick after the request (slowing down). Only as far as window,
+        the (earliest, latest) time the car can get there (reach() by
+        default), allows """
+        earliest, latest = window or self.reach(car)
+        clock = self.intersection.clock
+        claims = self.claims(car, time_request)
+        book = self.tiles
+        shift = 0
+        decision = 'requested'
+        if not book.fits(claims):
+            delta = time_request[1] - time_request[0]
+            first = max(-int(clock.to_ticks(delta / 2)),
+                    -int(clock.to_ticks(time_request[0] - self.now)) + 1,
+                    ceil(clock.to_ticks(earliest - time_request[0])))
+            last = clock.to_ticks(latest - time_request[0])
+            for shift in range(-1, first - 1, -1):
+                if book.fits(claims, shift):
+                    decision = 'sped up'
+                    break
+            else:
+                decision = 'slowed'
+                shift = 1
+                while shift <= last and not book.fits(claims, shift):
+                    shift += 1
+                if shift > last: # nothing free it can get to
+                    shift = max(int(last), 0)
+                    log.warning('no reachable tiles, car %s booked into '
+                            'conflicting ones at %.2f s', car.uid,
+                            time_request[0] + shift * clock.dt)
+        moved = shift * clock.dt
+        return (time_request[0] + moved, time_request[1] + moved), decision
 
     def send_instructions(self, car, request):
-        factor = self.intersection.factor
-        intersection_width = self.intersection.cross_zone.w
-        t1 = request[0] - self.now
-        d1 = factor * intersection_width
-        v1 = d1/t1
+        """ plan the car's speed to the crossing so it gets there at the
+        slot's start, back at its own speed, and send the segments """
+        clock = self.intersection.clock
+        t1 = clock.to_ticks(request[0] - self.now)
+        d1 = self.to_go(car)
         #t2 = request[1] - request[0] 
         #d2 = intersection_width + car.l
         #v2 = car.vel # d2/t2 = car.vel, so this isn't necessary
-        velocity_instructions = (v1,t1)
-        car.speed_instructions.append(velocity_instructions)
+        plan = segments(d1, t1, car.speed, car.vel,
+                self.intersection.accel_step)
+        for speed, ticks in plan[:-1]:
+            car.instruct(speed, self.now + ticks * clock.dt)
+        car.instruct(plan[-1][0], request[0]) # the last ends at slot start
 
 
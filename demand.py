@@ -0,0 +1,233 @@
+from math import ceil, isfinite
+import csv
+import numpy as np
+from movements import KINDS
+
+
+class Poisson:
+    """ arrivals at random times, rate cars per hour on average """
+    def __init__(self, rate):
+        self.rate = rate / 3600.
+
+    def times(self, rng, t0, t1):
+        n = rng.poisson(self.rate * (t1 - t0))
+        return np.sort(rng.uniform(t0, t1, n))
+
+
+class Fixed:
+    """ a car every 3600 / rate seconds, the first one offset seconds in """
+    def __init__(self, rate, offset=0.):
+        self.gap = 3600. / rate
+        self.offset = offset
+
+    def times(self, rng, t0, t1):
+        # counted from the offset, so chunk edges never drop or repeat one
+        first = max(0, ceil((t0 - self.offset) / self.gap))
+        last = max(0, ceil((t1 - self.offset) / self.gap))
+        return self.offset + np.arange(first, last) * self.gap
+
+
+class Curve:
+    """ Poisson arrivals whose rate (cars per hour) follows a piecewise
+    linear curve through (time, rate) points, held flat past either end.
+    Drawn by thinning: arrivals at the chunk's peak rate, each kept with
+    the probability rate(t) / peak """
+    def __init__(self, points):
+        points = sorted(points)
+        self.t = np.array([t for t, _ in points], dtype=np.float64)
+        self.rate = np.array([r for _, r in points], dtype=np.float64) / 3600.
+
+    def times(self, rng, t0, t1):
+        inside = self.rate[(self.t > t0) & (self.t < t1)]
+        peak = max(np.interp([t0, t1], self.t, self.rate).max(),
+                inside.max() if len(inside) else 0.)
+        n = rng.poisson(peak * (t1 - t0))
+        t = np.sort(rng.uniform(t0, t1, n))
+        keep = rng.uniform(0., peak, n) < np.interp(t, self.t, self.rate)
+        return t[keep]
+
+
+PROCESSES = {'poisson': Poisson, 'fixed': Fixed, 'curve': Curve}
+
+
+def value(text, what, low=0., above=False):
+    """ float(text), which has to be finite and >= low (> low with above
+    set) """
+    try:
+        v = float(text)
+    except ValueError:
+        raise ValueError('%s %r is not a number' % (what, text)) from None
+    if not isfinite(v):
+        raise ValueError('%s has to be finite, got %s' % (what, text))
+    if v < low or above and v == low:
+        raise ValueError('%s has to be %s %g, got %s' % (what,
+                '>' if above else '>=', low, text))
+    return v
+
+
+def process(text):
+    """ poisson:RATE, fixed:RATE[:OFFSET] or curve:T@RATE,T@RATE,...
+    (rates in cars per hour, times in seconds). Rates have to be above 0,
+    a curve's only at some point, and offsets and times at least 0 """
+    name, _, args = text.partition(':')
+    if name not in PROCESSES:
+        raise ValueError('unknown arrival process %r, expected one of %s'
+                % (name, ', '.join(PROCESSES)))
+    if name == 'curve':
+        points = []
+        for point in args.split(','):
+            t, at, rate = point.partition('@')
+            if not at:
+                raise ValueError('curve point %r should be TIME@RATE' % point)
+            points.append((value(t, 'curve time'), value(rate, 'curve rate')))
+        if not any(rate for _, rate in points):
+            raise ValueError('curve rate has to be above 0 somewhere')
+        return Curve(points)
+    args = args.split(':')
+    if len(args) > (2 if name == 'fixed' else 1):
+        raise ValueError('too many values in %r' % text)
+    rate = value(args[0], name + ' rate', above=True)
+    if len(args) == 2:
+        return Fixed(rate, value(args[1], 'fixed offset'))
+    return PROCESSES[name](rate)
+
+
+def approaches(orientations):
+    """ (road index, heading) of every way into the world, given each
+    road's orientation in road order. Cars enter horizontal roads heading l
+    or r, vertical ones u or d """
+    return [(i, h) for i, orientation in enumerate(orientations)
+            for h in ('lr' if orientation == 'h' else 'ud')]
+
+
+def select(text, ways):
+    """ indices into ways picked by an approach spec: * for all of them,
+    ROAD for both headings of a road or ROAD plus heading (0r), each
+    optionally /MOVEMENT. Returns (indices, movement or None) """
+    where, _, movement = text.partition('/')
+    if movement and movement not in KINDS:
+        raise ValueError('unknown movement %r, expected one of %s'
+                % (movement, ', '.join(KINDS)))
+    if where == '*':
+        picked = list(range(len(ways)))
+    else:
+        road, heading = where, None
+        if where[-1:] in ('l', 'r', 'u', 'd'):
+            road, heading = where[:-1], where[-1]
+        try:
+            road = int(road)
+        except ValueError:
+            raise ValueError('no approach %r, expected *, a road index or '
+                    'a road and heading like 0r' % where) from None
+        picked = [n for n, way in enumerate(ways) if way[0] == road
+                and heading in (None, way[1])]
+    if not picked:
+        raise ValueError('no approach %r on this road layout' % where)
+    return picked, movement or None
+
+
+def load_arrivals(path):
+    """ arrival schedule from a CSV file with a header row and the columns
+    time (seconds), road (index), direction and optionally movement.
+    Returns [(time, road, direction, movement or None)] """
+    with open(path, newline='') as f:
+        return [(float(row['time']), int(row['road']), row['direction'],
+                row.get('movement') or None) for row in csv.DictReader(f)]
+
+
+class Demand:
+    """Where and when cars arrive, instead of the fixed spawn interval.
+
+    streams: [(approach spec, process spec)] as taken by select() and
+    process(), e.g. ('*', 'poisson:900') or ('0r/left', 'fixed:120'). A
+    spec naming several approaches gives each of them its own arrivals at
+    the full rate.
+    arrivals: [(time, road, direction, movement)] of a fixed schedule,
+    e.g. load_arrivals(path), on top of the streams.
+
+    Arrivals are drawn ahead a chunk of simulated time at a time, every
+    stream in one go, merged into time order with one stable sort and
+    handed out from the arrays, so per spawned car only a couple of list
+    lookups are left. The movement of a car is the stream's, or drawn
+    from the simulation's turn mix when the stream doesn't fix one"""
+    def __init__(self, roads, rng, streams=(), arrivals=(), chunk=60.):
+        self.ways = approaches([road.orientation for road in roads])
+        self.rng = rng
+        self.chunk = chunk # simulated seconds drawn at a time
+        self.streams = [] # (approach index, movement code, process)
+        for where, text in streams:
+            picked, movement = select(where, self.ways)
+            code = -1 if movement is None else KINDS.index(movement)
+            arrive = process(text)
+            self.streams.extend((n, code, arrive) for n in picked)
+        index = {way: n for n, way in enumerate(self.ways)}
+        schedule = sorted(arrivals)
+        for _, road, direction, movement in schedule:
+            if (road, direction) not in index:
+                raise ValueError('no approach %d%s on this road layout'
+                        % (road, direction))
+            if movement is not None and movement not in KINDS:
+                raise ValueError('unknown movement %r' % movement)
+        self.schedule = (
+                np.array([a[0] for a in schedule], dtype=np.float64),
+                np.array([index[a[1:3]] for a in schedule], dtype=np.intp),
+                np.array([-1 if a[3] is None else KINDS.index(a[3])
+                    for a in schedule], dtype=np.intp))
+        # arrivals drawn but not handed out yet, in time order
+        self.times = np.zeros(0)
+        self.which = np.zeros(0, dtype=np.intp)
+        self.moves = np.zeros(0, dtype=np.intp)
+        self.cursor = 0
+        self.until = 0. # simulated time arrivals are drawn up to
+
+    def turns(self):
+        """ does any stream or scheduled arrival fix a turning movement """
+        return (any(code > 0 for _, code, _ in self.streams)
+                or bool(np.any(self.schedule[2] > 0)))
+
+    def draw(self):
+        """ draw the next chunk of every stream, and append it """
+        t0, t1 = self.until, self.until + self.chunk
+        times = [self.times[self.cursor:]]
+        which = [self.which[self.cursor:]]
+        moves = [self.moves[self.cursor:]]
+        for n, code, arrive in self.streams:
+            t = arrive.times(self.rng, t0, t1)
+            times.append(t)
+            which.append(np.full(len(t), n, dtype=np.intp))
+            moves.append(np.full(len(t), code, dtype=np.intp))
+        at, ways, codes = self.schedule
+        lo, hi = np.searchsorted(at, [t0, t1])
+        times.append(at[lo:hi])
+        which.append(ways[lo:hi])
+        moves.append(codes[lo:hi])
+        times = np.concatenate(times)
+        order = np.argsort(times, kind='stable')
+        self.times = times[order]
+        self.which = np.concatenate(which)[order]
+        self.moves = np.concatenate(moves)[order]
+        self.cursor = 0
+        self.until = t1
+
+    def due(self, now):
+        """ [(road index, direction, movement or None)] of the cars arriving
+        by simulated time now, not handed out before """
+        while self.until <= now:
+            self.draw()
+        end = int(np.searchsorted(self.times, now, side='right'))
+        ways = self.ways
+        arrived = [(*ways[n], None if code < 0 else KINDS[code])
+                for n, code in zip(self.which[self.cursor:end].tolist(),
+                    self.moves[self.cursor:end].tolist())]
+        self.cursor = end
+        return arrived
+
+    def next_time(self, limit):
+        """ simulated time of the next arrival, None if there's none
+        before limit """
+        while self.cursor == len(self.times):
+            if self.until > limit:
+                return None
+            self.draw()
+        t = float(self.times[self.cursor])
+        return t if t <= limit else None
@@ -0,0 +1,302 @@
+from profiles import ramp_ticks
+import heapq
+from itertools import count
+
+
+# event kinds, also the order they are handled within one tick. This is
+# the order Simulation.step does the same work in: spawn, move (turning
+# at the end of the move), despawn, boundary entries, batch planning,
+# boundary exits. Expiry comes last so crossings still see the speed the
+# car drove the tick at.
+SPAWN, TURN, DESPAWN, ENTER, PLAN, EXIT, EXPIRE = range(7)
+
+STEPS = {'r': (1, 0), 'l': (-1, 0), 'd': (0, 1), 'u': (0, -1)}
+
+
+class EventEngine:
+    """Discrete event driver for headless runs.
+    Between controller instructions every car drives at a constant speed
+    along one axis, so the tick at which it enters or leaves an outer
+    boundary, leaves the world, or sees its instruction expire can be
+    solved for directly. Those predictions go into a priority queue and the
+    simulated clock jumps from one event to the next, skipping idle ticks.
+
+    Each car carries a motion anchor (tick, x, y, speed) and, when speed
+    changes are limited (accel), the ramp from there to its target speed:
+    speed + step per tick for a number of ticks. Its position at a later
+    tick is x + the distance covered since, in closed form. Crossings
+    during a ramp are found tick by tick, the constant speed after it
+    directly. Changing the speed re-anchors the car and bumps its epoch,
+    which invalidates every event predicted from the old motion. Epochs are
+    unique across cars, so a pooled car reused after despawning can't pick
+    up stale events either.
+    Positions are exact floats, like the fleet store, and are written back
+    to the car's rect at its events. A turn puts the car on a new axis, so
+    it re-anchors the car from the rect Car.turn leaves."""
+    def __init__(self, sim):
+        self.sim = sim
+        self.clock = sim.sim_clock
+        self.queue = [] # (tick, kind, seq, car, epoch)
+        self.seq = count() # keeps same tick, same kind events in push order
+        self.epochs = count()
+        # car -> [tick, x, y, speed, epoch, target, step, ramp ticks]
+        self.motion = {}
+        self.processed = 0
+        self.spawning = False # a SPAWN event is queued
+        self.limit = 0. # simulated seconds the current run goes to
+
+    def push(self, tick, kind, car=None, epoch=None):
+        heapq.heappush(self.queue, (tick, kind, next(self.seq), car, epoch))
+
+    def moved(self, motion, n):
+        """ distance covered n ticks after the anchor """
+        _, _, _, speed, _, target, step, ramp = motion
+        if n < ramp:
+            return n * speed + step * n * (n + 1) / 2
+        q = ramp - 1 # ramping ticks, the last one lands on target
+        return q * speed + step * q * (q + 1) / 2 + (n - q) * target
+
+    def current(self, motion, tick):
+        """ speed driven during tick """
+        n = tick - motion[0]
+        return motion[3] + motion[6] * n if n < motion[7] else motion[5]
+
+    def position(self, car, tick):
+        motion = self.motion[car]
+        dx, dy = STEPS[car.direction]
+        moved = self.moved(motion, tick - motion[0])
+        return motion[1] + dx * moved, motion[2] + dy * moved
+
+    def settle(self, car, tick):
+        """ move the car's rect to where it is at tick """
+        car.x, car.y = self.position(car, tick)
+        car.speed = self.current(self.motion[car], tick)
+
+    def speed(self, car, tick):
+        """ target speed from tick + 1 on, and the last tick it holds for
+        (None if it holds until the car's speed changes again) """
+        while car.speed_instructions:
+            speed, until = car.speed_instructions[0]
+            last = self.clock.last_tick_at(until)
+            if last > tick:
+                return speed, last
+            car.speed_instructions.pop(0) # already expired
+        return car.vel, None
+
+    def retime(self, car, tick, at=None):
+        """ re-anchor car at tick (at a new position `at`, after a turn)
+        and predict its next events """
+        motion = self.motion[car]
+        x, y = at if at is not None else self.position(car, tick)
+        current = self.current(motion, tick)
+        epoch = next(self.epochs)
+        target, last = self.speed(car, tick)
+        step = self.sim.accel_step
+        ramp = ramp_ticks(current, target, step)
+        if ramp:
+            step = step if target > current else -step
+            self.motion[car] = [tick, x, y, current, epoch, target, step, ramp]
+        else:
+            self.motion[car] = [tick, x, y, target, epoch, target, 0, 0]
+        if last is not None:
+            self.push(last, EXPIRE, car, epoch)
+        if target <= 0 and not ramp:
+            return
+        sim = self.sim
+        world = (0, 0, sim.WIDTH, sim.HEIGHT)
+        exit_tick = self.crossing(car, tick, world, leaving=True)
+        if exit_tick is not None:
+            self.push(exit_tick, DESPAWN, car, epoch)
+        if car.turn_at is not None:
+            k = self.reaching(car, tick, car.turn_line)
+            if k is not None:
+                self.push(k, TURN, car, epoch)
+        # only crossings on the car's own road can be reached. Exiting
+        # re-anchors the car, so only the nearest entry needs predicting
+        entry = None
+        for intersection in car.road.intersections:
+            boundary = intersection.outer_boundary
+            if car in intersection.cars:
+                k = self.crossing(car, tick, boundary, leaving=True)
+                if k is not None:
+                    self.push(k, EXIT, (car, intersection), epoch)
+            else:
+                k = self.crossing(car, tick, boundary, leaving=False)
+                if k is not None and (entry is None or k < entry[0]):
+                    entry = (k, intersection)
+        if entry is not None:
+            self.push(entry[0], ENTER, (car, entry[1]), epoch)
+
+    def path(self, car):
+        """ the car's coordinate along its axis (left or top) at a tick,
+        and which way along the axis it drives """
+        motion = self.motion[car]
+        dx, dy = STEPS[car.direction]
+        sign, p = (dx, motion[1]) if dx else (dy, motion[2])
+        k0 = motion[0]
+        return lambda k: p + sign * self.moved(motion, k - k0), sign
+
+    def first(self, car, tick, done, passed, goal):
+        """ first tick after tick at which done(p) holds for the car's
+        coordinate p along its axis. None if passed(p) comes first or the
+        car comes to a stop. goal is where done starts holding, used to
+        jump straight there at constant speed """
+        motion = self.motion[car]
+        along, sign = self.path(car)
+        k = tick
+        # through what's left of a ramp tick by tick
+        while k < motion[0] + motion[7]:
+            k += 1
+            p = along(k)
+            if done(p):
+                return k
+            if passed(p):
+                return None
+        if motion[5] <= 0:
+            return None
+        base, p0, v = k, along(k), sign * motion[5]
+        k = base + max(1, int((goal - p0) / v))
+        # step onto the exact tick, guarding against float rounding
+        while k > base + 1 and done(p0 + v * (k - 1 - base)):
+            k -= 1
+        while not done(p0 + v * (k - base)):
+            if passed(p0 + v * (k - base)):
+                return None # jumped clean over the rect in one tick
+            k += 1
+        return k
+
+    def crossing(self, car, tick, rect, leaving):
+        """ first tick after `tick` at which the car stops (leaving) or
+        starts overlapping rect, in the sense of pygame's colliderect.
+        None if that never happens at the current speed """
+        along, sign = self.path(car)
+        x, y = self.position(car, tick)
+        left, top, width, height = rect
+        if STEPS[car.direction][0]:
+            ext, lo, hi = car.width, left, left + width
+            side, side_ext, side_lo, side_hi = y, car.height, top, top + height
+        else:
+            ext, lo, hi = car.height, top, top + height
+            side, side_ext, side_lo, side_hi = x, car.width, left, left + width
+        if not (side < side_hi and side_lo < side + side_ext):
+            return None # drives past beside the rect
+        # the car overlaps the rect while lo - ext < p < hi
+        if sign > 0:
+            near, far = lo - ext, hi
+            passed = lambda p: p >= far
+        else:
+            near, far = hi, lo - ext
+            passed = lambda p: p <= far
+        if passed(along(tick)):
+            return tick if leaving else None
+        if leaving:
+            return self.first(car, tick, passed, passed, far)
+        return self.first(car, tick, lambda p: lo - ext < p < hi, passed,
+                near)
+
+    def reaching(self, car, tick, line):
+        """ first tick from `tick` on at which the front of the car has got
+        to line, like movements.reached. None if it stops short of it """
+        along, sign = self.path(car)
+        if sign > 0:
+            ext = car.width if STEPS[car.direction][0] else car.height
+            done = lambda p: p + ext >= line
+            goal = line - ext
+        else:
+            done = lambda p: p <= line
+            goal = line
+        if done(along(tick)):
+            return tick
+        return self.first(car, tick, done, lambda p: False, goal)
+
+    def schedule_spawn(self):
+        sim = self.sim
+        if sim.demand is None:
+            at = sim.next_spawn
+            sim.next_spawn += sim.spawn_interval
+        else:
+            at = sim.demand.next_time(self.limit)
+            if at is None:
+                return # nothing arrives in this run, looked for by the next
+        self.spawning = True
+        self.push(self.clock.first_tick_at(at), SPAWN)
+
+    def run(self, duration):
+        """ handle events up to `duration` simulated seconds, jumping
+        the clock straight from one event to the next """
+        sim = self.sim
+        end = self.clock.last_tick_at(duration)
+        self.limit = duration
+        if not self.spawning:
+            self.schedule_spawn()
+        while self.queue and self.queue[0][0] <= end and sim.running:
+            tick, kind, _, subject, epoch = heapq.heappop(self.queue)
+            self.clock.advance_to(tick)
+            if kind == SPAWN:
+                self.spawn(tick)
+                continue
+            if kind == PLAN:
+                self.plan(subject, tick)
+                continue
+            car = subject[0] if kind in (ENTER, EXIT) else subject
+            motion = self.motion.get(car)
+            if motion is None or motion[4] != epoch:
+                continue # predicted from a speed the car no longer has
+            self.processed += 1
+            self.settle(car, tick)
+            if kind == DESPAWN:
+                del self.motion[car]
+                car.destroy()
+                sim.despawn()
+            elif kind == TURN:
+                car.turn()
+                self.retime(car, tick, at=(car.x, car.y)) # on a new axis
+            elif kind == ENTER:
+                intersection = subject[1]
+                intersection.enter(car)
+                intersection.controller.reserve_spot(car)
+                planner = intersection.controller.planner
+                if planner is not None and planner.closes is not None:
+                    # planned on the first tick the batch is due. A stale
+                    # PLAN finds the batch not due, or gone, and does nothing
+                    self.push(self.clock.first_tick_at(planner.closes), PLAN,
+                            intersection)
+                self.retime(car, tick)
+            elif kind == EXIT:
+                intersection = subject[1]
+                intersection.controller.remove_reservation(car)
+                intersection.exit(car)
+                self.retime(car, tick)
+            elif kind == EXPIRE:
+                car.speed_instructions.pop(0)
+                self.retime(car, tick)
+        self.clock.advance_to(max(end, self.clock.ticks))
+
+    def plan(self, intersection, tick):
+        """ plan a batch that's due, and re-predict the cars that got
+        instructions from it """
+        sim = self.sim
+        cars = list(intersection.controller.planner.pending)
+        for car in cars: # planned from where they are
+            self.settle(car, tick)
+        sim.delay_saved += intersection.plan()
+        for car in cars:
+            if car.speed_instructions:
+                self.retime(car, tick)
+
+    def spawn(self, tick):
+        """ spawn like Simulation.step: new cars already drive the tick
+        they appear on """
+        sim = self.sim
+        self.spawning = False
+        before = len(sim.cars)
+        if sim.demand is None:
+            sim.random.choice(sim.roads).add_car()
+        else:
+            for road, direction, movement in sim.demand.due(self.clock.now):
+                sim.roads[road].add_car(direction, movement)
+        for car in sim.cars[before:]:
+            self.motion[car] = [tick - 1, car.x, car.y, car.vel, None,
+                    car.vel, 0, 0]
+            self.retime(car, tick)
+        self.schedule_spawn()
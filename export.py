@@ -0,0 +1,213 @@
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import os
+import sys
+
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+import pygame
+
+
+canvas = None # per worker process: (background surface, frame size)
+
+
+def start_worker(pixels, size, resolution):
+    """ pool initializer: rebuild the background from its pixels """
+    global canvas
+    canvas = (pygame.image.fromstring(pixels, size, 'RGB'), resolution)
+
+
+def encode(job):
+    """ draw a chunk of frames. job is (first frame number, [snapshot],
+    file name pattern or None). Frames go to pattern % number, or come
+    back as raw RGB bytes when there is no pattern """
+    first, snapshots, pattern = job
+    background, resolution = canvas
+    raw = []
+    for number, snapshot in enumerate(snapshots, first):
+        frame = background.copy()
+        for x, y, w, h, color in snapshot.cars: # as Car.render draws them
+            pygame.draw.rect(frame, color, (x, y, w, h))
+        if resolution != frame.get_size():
+            frame = pygame.transform.smoothscale(frame, resolution)
+        if pattern is None:
+            raw.append(pygame.image.tostring(frame, 'RGB'))
+        else:
+            pygame.image.save(frame, pattern % number)
+    return b''.join(raw)
+
+
+class Exporter:
+    """Writes snapshots (render.Snapshot) out as frames, drawn with the
+    same visuals as the live window, in a pool of worker processes.
+
+    out: a file name pattern with a frame number field
+    ('frames/%06d.png', any format pygame.image.save knows), or a file
+    (.rgb, or - for stdout) for a raw stream of RGB24 frames, one after
+    the other, as e.g. ffmpeg -f rawvideo -pix_fmt rgb24 -s WxH reads it.
+    resolution: (w, h) of the frames, the world's size by default.
+
+    Snapshots are sent in chunks, so a worker draws and encodes many
+    frames per message, and at most two chunks per worker are in flight,
+    so memory stays flat however long the run is. Frames of the raw
+    stream are written in order"""
+    def __init__(self, surface, out, resolution=None, processes=None,
+            chunk=32):
+        self.size = surface.get_size()
+        self.resolution = tuple(resolution or self.size)
+        self.raw = '%' not in out
+        self.pattern = None if self.raw else out
+        self.stream = None
+        if self.raw:
+            self.stream = (sys.stdout.buffer if out == '-'
+                    else open(out, 'wb'))
+        self.chunk = chunk
+        self.pool = ProcessPoolExecutor(max_workers=processes,
+                initializer=start_worker,
+                initargs=(pygame.image.tostring(surface, 'RGB'), self.size,
+                    self.resolution))
+        self.in_flight = 2 * (processes or os.cpu_count() or 1)
+        self.pending = [] # futures of the chunks sent, in frame order
+        self.batch = [] # snapshots not sent yet
+        self.frames = 0 # frames sent
+
+    def add(self, snapshot):
+        self.batch.append(snapshot)
+        if len(self.batch) == self.chunk:
+            self.send()
+
+    def send(self):
+        if not self.batch:
+            return
+        self.pending.append(self.pool.submit(encode,
+                (self.frames, self.batch, self.pattern)))
+        self.frames += len(self.batch)
+        self.batch = []
+        while len(self.pending) >= self.in_flight:
+            self.collect()
+
+    def collect(self):
+        """ wait for the oldest chunk, and write it if it's raw """
+        data = self.pending.pop(0).result()
+        if self.stream is not None:
+            self.stream.write(data)
+
+    def close(self):
+        self.send()
+        while self.pending:
+            self.collect()
+        self.pool.shutdown()
+        if self.stream is not None and self.stream is not sys.stdout.buffer:
+            self.stream.close()
+        self.stream = None
+
+
+def layout(sim):
+    """ the static part of sim's frames, on a new surface """
+    from render import background
+    return background(pygame.Surface(sim.size), sim.roads, sim.intersections)
+
+
+def export_log(path, out, start=0, stop=None, stride=1, **options):
+    """ frames of a recorded run, every stride ticks from start to stop.
+    The roads are laid out again from the log's parameters """
+    import main
+    from render import Snapshot
+    from replay import Replayer
+    replayer = Replayer(path)
+    grid = replayer.params.get('grid')
+    spacing = replayer.WIDTH // (grid[1] + 1) if grid else 250
+    sim = main.Simulation(headless=True, grid=grid, spacing=spacing,
+            size=(replayer.WIDTH, replayer.HEIGHT),
+            factor=replayer.params.get('factor', 5),
+            road_width=replayer.params.get('road_width', 50),
+            car_width=replayer.car_width)
+    sim.on_init()
+    sim.object_init()
+    exporter = Exporter(layout(sim), out, **options)
+    try:
+        for tick, cars in replayer.frames(start, stop, stride):
+            exporter.add(Snapshot(tick, tuple([(c.rect.x, c.rect.y,
+                    c.rect.w, c.rect.h, c.color) for c in cars.values()])))
+    finally:
+        exporter.close()
+    return exporter.frames
+
+
+def export_run(params, duration, out, stride=1, **options):
+    """ frames of a headless run of Simulation(**params), every stride
+    ticks, drawn while it runs. A log, metrics and profile asked for in
+    params are kept as well, as in Simulation.execute """
+    import main
+    from render import snapshot
+    if params.get('events'):
+        raise ValueError('frames are drawn every stride ticks, the event '
+                'engine skips ticks')
+    sim = main.Simulation(**dict(params, headless=True))
+    sim.on_init()
+    sim.object_init()
+    sim.attach_observers()
+    exporter = Exporter(layout(sim), out, **options)
+
+    def film(sim):
+        ticks = sim.sim_clock.ticks
+        if ticks % stride == 0:
+            if sim.fleet is not None:
+                sim.fleet.sync()
+            exporter.add(snapshot(ticks, sim.cars))
+
+    sim.observers.append(film)
+    try:
+        sim.run(duration)
+    finally:
+        sim.close()
+        exporter.close()
+    return exporter.frames
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+            description='Draw a recorded or headless run to files')
+    parser.add_argument('log', nargs='?',
+            help='log recorded with main.py --record (default: run one)')
+    parser.add_argument('--out', required=True,
+            help='frame file pattern (frames/%%06d.png), or a file for a '
+            'raw RGB24 stream (run.rgb, - for stdout)')
+    parser.add_argument('--stride', type=int, default=1,
+            help='ticks between frames')
+    parser.add_argument('--resolution', type=int, nargs=2,
+            metavar=('W', 'H'), help='frame size (default: the world\'s)')
+    parser.add_argument('--processes', type=int, default=None,
+            help='encoding worker processes (default: one per core)')
+    parser.add_argument('--start', type=int, default=0,
+            help='first tick of a log to draw')
+    parser.add_argument('--stop', type=int, default=None,
+            help='last tick of a log to draw (default: its end)')
+    parser.add_argument('--duration', type=float, default=None,
+            help='simulated seconds of a run (default: the scenario\'s, '
+            'or 60)')
+    parser.add_argument('--scenario', metavar='FILE',
+            help='scenario file (.toml or .json) of a run, under --param')
+    parser.add_argument('--param', action='append', default=[],
+            metavar='NAME=VALUE', help='Simulation keyword of a run, e.g. '
+            'seed=1 or grid=2:2')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    options = {'resolution': args.resolution, 'processes': args.processes}
+    if args.log:
+        frames = export_log(args.log, args.out, args.start, args.stop,
+                args.stride, **options)
+    else:
+        from batch import parse_value
+        params, duration = {}, None
+        if args.scenario:
+            from scenario import load
+            params, duration = load(args.scenario)
+        for param in args.param:
+            name, value = param.split('=', 1)
+            params[name] = parse_value(value)
+        frames = export_run(params, args.duration or duration or 60,
+                args.out, args.stride, **options)
+    print('%d frames written' % frames, file=sys.stderr)
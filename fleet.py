@@ -0,0 +1,165 @@
+import numpy as np
+
+
+# unit step per travel direction
+DIRECTIONS = {'r': (1, 0), 'l': (-1, 0), 'd': (0, 1), 'u': (0, -1)}
+# per slot arrays, moved together when a slot is freed
+FIELDS = {'x': np.float64, 'y': np.float64, 'dx': np.float64,
+        'dy': np.float64, 'l': np.float64, 'w': np.float64, 'vel': np.float64,
+        'inst_speed': np.float64, 'inst_until': np.float64, 'ex': np.float64,
+        'ey': np.float64, 'cx': np.float64, 'cy': np.float64, 'near': bool}
+
+
+class Fleet:
+    """Structure-of-arrays store for car state.
+    Every car is a slot index into flat NumPy arrays, so one tick moves the
+    whole fleet with a handful of array operations instead of a Python call
+    (and an if/elif chain on direction) per car.
+
+    Instructions are a speed held until a deadline (simulated seconds), the
+    same (speed, time) pair Car.update applies. A slot with no instruction
+    has its deadline at -inf.
+
+    The cell (of a spatial.SpatialGrid of cell pixels) every car's top left
+    corner is in is kept too, so refiled() can tell from the arrays which
+    cars moved into a new cell. Whether that cell is one given to watch()
+    is only looked up then, so watched() is a single array scan. Positions
+    only need copying back onto the owners of those cars, the rest are
+    synced when all of them are looked at."""
+    def __init__(self, capacity=1024, cell=100):
+        self.n = 0 # number of slots in use, always packed at the front
+        self.owners = [] # optional object per slot (e.g. a Car)
+        self.cell = cell
+        self.watching = set() # cells (col, row), see watch()
+        self._alloc(capacity)
+
+    def _alloc(self, capacity):
+        old = getattr(self, 'x', None)
+        for name, dtype in FIELDS.items():
+            arr = np.zeros(capacity, dtype=dtype)
+            if old is not None:
+                arr[:self.n] = getattr(self, name)[:self.n]
+            setattr(self, name, arr)
+        self.inst_until[self.n:] = -np.inf
+        self.capacity = capacity
+
+    def __len__(self):
+        return self.n
+
+    def add(self, x, y, direction, vel, length, width=15, owner=None):
+        """ add one car and return its slot """
+        if self.n == self.capacity:
+            self._alloc(2 * self.capacity)
+        i = self.n
+        self.x[i], self.y[i] = x, y
+        self.dx[i], self.dy[i] = DIRECTIONS[direction]
+        self.l[i], self.w[i] = length, width
+        # footprint along x and y
+        self.ex[i], self.ey[i] = ((length, width) if self.dx[i]
+                else (width, length))
+        self.vel[i] = vel
+        self.inst_until[i] = -np.inf
+        key = (x // self.cell, y // self.cell)
+        self.cx[i], self.cy[i] = key
+        self.near[i] = key in self.watching
+        self.owners.append(owner)
+        self.n += 1
+        return i
+
+    def add_many(self, x, y, dx, dy, vel, length, width=15):
+        """ add a batch of cars from arrays (dx, dy unit steps).
+        Returns the slice of slots they occupy """
+        k = len(x)
+        while self.n + k > self.capacity:
+            self._alloc(2 * self.capacity)
+        s = slice(self.n, self.n + k)
+        self.x[s], self.y[s], self.dx[s], self.dy[s] = x, y, dx, dy
+        self.vel[s], self.l[s], self.w[s] = vel, length, width
+        along_x = self.dx[s] != 0
+        self.ex[s] = np.where(along_x, self.l[s], self.w[s])
+        self.ey[s] = np.where(along_x, self.w[s], self.l[s])
+        self.inst_until[s] = -np.inf
+        self.cx[s], self.cy[s] = x // self.cell, y // self.cell
+        self.near[s] = [key in self.watching for key in zip(
+                self.cx[s].tolist(), self.cy[s].tolist())]
+        self.owners.extend([None] * k)
+        self.n += k
+        return s
+
+    def remove(self, slot):
+        """ free a slot by moving the last car into it, so the arrays stay
+        packed. The moved owner's slot attribute is updated """
+        last = self.n - 1
+        if slot != last:
+            for name in FIELDS:
+                arr = getattr(self, name)
+                arr[slot] = arr[last]
+            moved = self.owners[last]
+            self.owners[slot] = moved
+            if moved is not None:
+                moved.slot = slot
+        self.owners.pop()
+        self.n = last
+
+    def instruct(self, slot, speed, until):
+        """ hold speed (pixels per tick) until the simulated time until """
+        self.inst_speed[slot] = speed
+        self.inst_until[slot] = until
+
+    def step(self, now):
+        """ advance every car by one tick at simulated time now """
+        n = self.n
+        until = self.inst_until[:n]
+        held = until >= now
+        until[~held] = -np.inf # expired, back to the car's own speed
+        speed = np.where(held, self.inst_speed[:n], self.vel[:n])
+        self.x[:n] += self.dx[:n] * speed
+        self.y[:n] += self.dy[:n] * speed
+
+    def outside(self, width, height):
+        """ slots of cars that have completely left a width x height world """
+        n = self.n
+        x, y = self.x[:n], self.y[:n]
+        gone = ((x < -self.ex[:n]) | (x > width) | (y < -self.ey[:n])
+                | (y > height))
+        return np.nonzero(gone)[0].tolist()
+
+    def refiled(self):
+        """ [(slot, (col, row))] of the cars whose top left corner crossed
+        into a new cell since the last call """
+        n = self.n
+        cx, cy = self.x[:n] // self.cell, self.y[:n] // self.cell
+        moved = np.nonzero((cx != self.cx[:n]) | (cy != self.cy[:n]))[0]
+        if not len(moved):
+            return []
+        self.cx[:n], self.cy[:n] = cx, cy
+        refiled = []
+        for slot, col, row in zip(moved.tolist(), cx[moved].tolist(),
+                cy[moved].tolist()):
+            key = (int(col), int(row))
+            self.near[slot] = key in self.watching
+            refiled.append((slot, key))
+        return refiled
+
+    def watch(self, keys):
+        """ cells (col, row) whose cars watched() reports """
+        self.watching = set(keys)
+        n = self.n
+        self.near[:n] = [key in self.watching for key in zip(
+                self.cx[:n].tolist(), self.cy[:n].tolist())]
+
+    def watched(self):
+        """ slots of the cars in watched cells """
+        return np.nonzero(self.near[:self.n])[0]
+
+    def sync(self, slots=None):
+        """ copy positions back onto the owning objects (pygame rects), of
+        every car or of the given slots """
+        if slots is None:
+            owners, x, y = self.owners, self.x[:self.n], self.y[:self.n]
+        else:
+            owners = [self.owners[slot] for slot in slots]
+            x, y = self.x[slots], self.y[slots]
+        for owner, x, y in zip(owners, x.tolist(), y.tolist()):
+            if owner is not None:
+                owner.x, owner.y = x, y
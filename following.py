@@ -0,0 +1,246 @@
+import numpy as np
+
+
+# per row arrays, moved together when a row is freed
+FIELDS = {'l': np.float64, 'dx': np.float64, 'dy': np.float64,
+        'ox': np.float64, 'oy': np.float64, 'lead': np.intp, 'back': np.intp}
+
+
+class Lanes:
+    """Cars kept lane by lane (a road and a heading) in driving order.
+
+    Every car is a row of flat NumPy arrays, packed like the fleet store's
+    slots, holding what stays the same while it drives in a lane (length,
+    heading, the offset of its front from its corner) and the rows of the
+    cars in front of and behind it. Joining, leaving or turning into a lane
+    only relinks rows. Once per tick step() reads the cars' positions and
+    speeds into arrays and, in array operations, measures each car's gap to
+    its leader and counts the pairs that overlap (collisions) or come
+    closer than `near` pixels (near misses). With idm set it also applies
+    the interaction term of the intelligent driver model (IDM) to the speed
+    each car would drive anyway (its ramp toward the controller's target),
+    braking it as needed to keep at least gap + headway * speed behind its
+    leader. Cars move themselves, so positions, targets and the speeds set
+    are still read and written car by car.
+
+    Cars only change order by running into one another, so a lane is put
+    back in order only when a car in it got ahead of its leader.
+
+    accel, decel: float: IDM maximum and comfortable acceleration,
+    pixels per second squared
+    gap: float: standstill gap kept to the leader, pixels
+    headway: float: time gap kept to the leader, seconds"""
+    def __init__(self, dt, step=0., idm=False, accel=1500., decel=3000.,
+            gap=10., headway=.2, near=5., capacity=256):
+        self.dt = dt
+        self.step_size = step # ramp per tick, as Car.update applies it
+        self.idm = idm
+        # IDM parameters, in pixels and ticks
+        self.accel = accel * dt ** 2
+        self.decel = decel * dt ** 2
+        self.gap = gap
+        self.headway = headway / dt
+        self.near = near
+        self.n = 0 # rows in use, always packed at the front
+        self.cars = [] # row -> car
+        self.keys = [] # row -> lane_of the car
+        self.rows = {} # car -> row
+        self.ends = {} # lane_of(car) -> [front car, last car]
+        self.collisions = set() # (follower uid, leader uid), per run
+        self.near_misses = set()
+        self._alloc(capacity)
+
+    def _alloc(self, capacity):
+        old = getattr(self, 'l', None)
+        for name, dtype in FIELDS.items():
+            arr = np.zeros(capacity, dtype=dtype)
+            if old is not None:
+                arr[:self.n] = getattr(self, name)[:self.n]
+            setattr(self, name, arr)
+        self.capacity = capacity
+
+    def join(self, car):
+        """ a spawned car starts at the end of its road, behind the rest """
+        key = lane_of(car)
+        ends = self.ends.get(key)
+        self._link(self._add(car, key), key,
+                -1 if ends is None else self.rows[ends[1]])
+
+    def clear(self, key, front):
+        """ is there room in lane key for a car whose front is at progress
+        front, the standstill gap behind the last car in it """
+        ends = self.ends.get(key)
+        if ends is None:
+            return True
+        last = ends[1]
+        return progress(last) - last.l - front >= self.gap
+
+    def leave(self, car, key=None):
+        row = self.rows.pop(car)
+        self._unlink(row, key or lane_of(car))
+        last = self.n - 1
+        if row != last: # the last row moves into the freed one
+            for name in FIELDS:
+                arr = getattr(self, name)
+                arr[row] = arr[last]
+            moved = self.cars[last]
+            self.cars[row], self.keys[row] = moved, self.keys[last]
+            self.rows[moved] = row
+            if self.lead[row] >= 0:
+                self.back[self.lead[row]] = row
+            if self.back[row] >= 0:
+                self.lead[self.back[row]] = row
+        self.cars.pop()
+        self.keys.pop()
+        self.n = last
+
+    def move(self, car, road, direction):
+        """ car turned off road, heading direction, into its current road
+        and heading, somewhere along the new lane """
+        row = self.rows[car]
+        self._unlink(row, (id(road), direction))
+        key = self.keys[row] = lane_of(car)
+        self._shape(row, car)
+        front = progress(car)
+        ahead, behind = -1, self.rows[self.ends[key][0]] if (
+                key in self.ends) else -1
+        while behind >= 0 and progress(self.cars[behind]) > front:
+            ahead, behind = behind, self.back[behind]
+        self._link(row, key, ahead)
+
+    def lane(self, key):
+        """ the cars in lane key, front car first """
+        cars = []
+        ends = self.ends.get(key)
+        row = -1 if ends is None else self.rows[ends[0]]
+        while row >= 0:
+            cars.append(self.cars[row])
+            row = self.back[row]
+        return cars
+
+    def _add(self, car, key):
+        """ give car a row, linked to no other yet """
+        if self.n == self.capacity:
+            self._alloc(2 * self.capacity)
+        row = self.n
+        self.l[row] = car.l
+        self._shape(row, car)
+        self.cars.append(car)
+        self.keys.append(key)
+        self.rows[car] = row
+        self.n += 1
+        return row
+
+    def _shape(self, row, car):
+        """ heading and front offset of car, in row """
+        dx, dy = DX[car.direction], DY[car.direction]
+        self.dx[row], self.dy[row] = dx, dy
+        self.ox[row] = car.w if dx > 0 else 0.
+        self.oy[row] = car.h if dy > 0 else 0.
+
+    def _link(self, row, key, ahead):
+        """ put row into lane key behind row ahead, -1 for the front """
+        car = self.cars[row]
+        ends = self.ends.get(key)
+        if ends is None:
+            self.lead[row] = self.back[row] = -1
+            self.ends[key] = [car, car]
+            return
+        behind = self.rows[ends[0]] if ahead < 0 else self.back[ahead]
+        self.lead[row], self.back[row] = ahead, behind
+        if ahead >= 0:
+            self.back[ahead] = row
+        else:
+            ends[0] = car
+        if behind >= 0:
+            self.lead[behind] = row
+        else:
+            ends[1] = car
+
+    def _unlink(self, row, key):
+        """ take row out of lane key, closing the gap """
+        ahead, behind = self.lead[row], self.back[row]
+        if ahead >= 0:
+            self.back[ahead] = behind
+        if behind >= 0:
+            self.lead[behind] = ahead
+        if ahead < 0 and behind < 0:
+            del self.ends[key]
+            return
+        ends = self.ends[key]
+        if ahead < 0:
+            ends[0] = self.cars[behind]
+        if behind < 0:
+            ends[1] = self.cars[ahead]
+
+    def _order(self, key):
+        """ relink lane key front to back by progress """
+        cars = self.lane(key)
+        cars.sort(key=progress, reverse=True)
+        del self.ends[key]
+        ahead = -1
+        for car in cars:
+            row = self.rows[car]
+            self._link(row, key, ahead)
+            ahead = row
+
+    def step(self):
+        """ count this tick's collisions and near misses, and with idm set
+        the speed every car drives at this tick """
+        n, cars = self.n, self.cars
+        if not n:
+            return
+        x, y, speed = np.array([(c.x, c.y, c.speed) for c in cars],
+                dtype=np.float64).T
+        front = (self.dx[:n] * (x + self.ox[:n])
+                + self.dy[:n] * (y + self.oy[:n]))
+        lead = self.lead[:n] # relinking below updates it in place
+        led = np.nonzero(lead >= 0)[0]
+        ahead = front[led] > front[lead[led]]
+        if ahead.any(): # put the lanes with a car past its leader in order
+            for key in {self.keys[i] for i in led[ahead].tolist()}:
+                self._order(key)
+            led = np.nonzero(lead >= 0)[0]
+        gaps = np.full(n, np.inf)
+        gaps[led] = front[lead[led]] - self.l[lead[led]] - front[led]
+        for i in np.nonzero(gaps < self.near)[0].tolist():
+            pair = (cars[i].uid, cars[lead[i]].uid)
+            self.near_misses.add(pair)
+            if gaps[i] < 0:
+                self.collisions.add(pair)
+        if not self.idm:
+            return
+        target = np.array([car.target() for car in cars], dtype=np.float64)
+        if self.step_size: # where the car's own ramp would take it
+            free = np.clip(target, speed - self.step_size,
+                    speed + self.step_size)
+        else:
+            free = target
+        closing = np.zeros(n)
+        closing[led] = speed[led] - speed[lead[led]]
+        wanted = self.gap + np.maximum(0., speed * self.headway
+                + speed * closing / (2 * np.sqrt(self.accel * self.decel)))
+        brake = self.accel * (wanted / np.maximum(gaps, .1)) ** 2
+        for car, v in zip(cars, np.clip(free - brake, 0., free).tolist()):
+            car.speed = v
+
+
+# unit step per heading
+DX = {'r': 1., 'l': -1., 'd': 0., 'u': 0.}
+DY = {'r': 0., 'l': 0., 'd': 1., 'u': -1.}
+
+
+def lane_of(car):
+    """ key of the lane car drives in. Roads are rects, which don't hash """
+    return id(car.road), car.direction
+
+
+def progress(car):
+    """ how far along its heading the front of car is """
+    if car.direction == 'r':
+        return car.right
+    elif car.direction == 'l':
+        return -car.left
+    elif car.direction == 'd':
+        return car.bottom
+    return -car.top
@@ -1,62 +1,135 @@
 from collections import OrderedDict
+from itertools import count
 from controller import Controller
+from planner import Planner
+from movements import TURNS, conflict_table, lanes, reached, turn_line, turned
+from profiles import ramp
+from render import Renderer, snapshot
+from simclock import SimClock
+from spatial import SpatialGrid
+from tiles import Tiling
+import argparse
+import logging
 import pygame
 from pygame.locals import *
 import random
+import threading
+import time
+
+
+log = logging.getLogger(__name__)
+
+
+POSSIBLE_DIRECTIONS = {'h':['l','r'], 'v':['u','d']}
 
 
 class Road(pygame.Rect):
-    def __init__(self, orientation, location):
-        """orientation: str: 'h' or 'v' (horizontal/vertical)
+    def __init__(self, sim, orientation, location):
+        """sim: Simulation: the one the road is part of
+        orientation: str: 'h' or 'v' (horizontal/vertical)
         location: 0 < float < 1 (fraction of screen width/height)"""
+        self.sim = sim
         self.orientation = orientation # used for car initialzation
+        self.intersections = [] # crossings along this road
 
+        width = self.sim.road_width
+        car = self.sim.car_width
         if orientation == 'h':
-            self.w = simulation.WIDTH
-            self.h = 50
-            self.center = (simulation.WIDTH / 2 , simulation.HEIGHT * location)
-            self.buffer = (self.h - 30) // 4 # subtract 2 car widths, to get
+            self.w = self.sim.WIDTH
+            self.h = width
+            self.center = (self.sim.WIDTH / 2 , self.sim.HEIGHT * location)
+        elif orientation == 'v':
+            self.h = self.sim.HEIGHT
+            self.w = width
+            self.center = (self.sim.WIDTH * location, self.sim.HEIGHT / 2)
+        self.buffer = (width - 2 * car) // 4 # subtract 2 car widths, to get
                                              # remainder. Leave 50% that for
                                              # "center divide" & 25% to ends
-        elif orientation == 'v':
-            self.h = simulation.HEIGHT
-            self.w = 50
-            self.center = (simulation.WIDTH * location, simulation.HEIGHT / 2)
-            self.buffer = (self.w - 30) // 4
-    
+        # where cars heading each way start, worked out once per road
+        self.starts = {
+                'l': (self.right, self.top + self.buffer),
+                'r': (self.left, self.bottom - self.buffer - car),
+                'u': (self.right - self.buffer - car, self.bottom),
+                'd': (self.left + self.buffer, self.top)}
+        # how far along its heading (following.progress) the front of the
+        # longest car gets to as it spawns, where a held spawn needs room
+        longest = max(self.sim.car_lengths)
+        self.entries = {'l': -self.right, 'r': self.left + longest,
+                'u': -self.bottom, 'd': self.top + longest}
+
     def render(self, screen):
         pygame.draw.rect(screen, (100,100,100), (self.x,self.y,self.w,self.h))
 
 
-    def add_car(self):
-        """ Initializes a car going in a random direction from either end """
-        possible_directions = {'h':['l','r'], 'v':['u','d']}
-        starting_points = {
-                'l': (self.right, self.top + self.buffer),
-                'r': (self.left, self.bottom - self.buffer - 15),
-                'u': (self.right - self.buffer - 15, self.bottom),
-                'd': (self.left + self.buffer, self.top)}
-
-        direction = random.choice(possible_directions[self.orientation])
-        starting_point = starting_points[direction]
-        simulation.cars.append(Car(starting_point, direction))
+    def add_car(self, direction=None, movement=None, due=None):
+        """ Initializes a car going in direction (random by default) from
+        that end. movement: at its first crossing, drawn by default.
+        With car following, a car whose lane is backed up to the end of
+        the road is held instead, behind any held before it, until
+        Simulation.spawn_held finds room. due: tick a held car was held
+        since, its delay counts from then """
+        if direction is None:
+            direction = self.sim.random.choice(
+                    POSSIBLE_DIRECTIONS[self.orientation])
+        # safety alone only counts, it mustn't change the traffic
+        if self.sim.follow and due is None:
+            key = (id(self), direction) # following.lane_of
+            if key in self.sim.held or not self.sim.lanes.clear(key,
+                    self.entries[direction]):
+                self.sim.held.setdefault(key, []).append(
+                        (self, direction, movement, self.sim.sim_clock.ticks))
+                return
+        car = self.sim.pool.acquire(self.starts[direction], direction,
+                movement)
+        if due is not None:
+            car.spawned = due
+        car.road = self
+        self.sim.cars.append(car)
+        self.sim.grid.insert(car)
+        if self.sim.lanes is not None:
+            self.sim.lanes.join(car)
+        if self.sim.recorder is not None:
+            self.sim.recorder.spawn(car)
+        if self.sim.metrics is not None:
+            self.sim.metrics.spawn(car)
 
 
 class Car(pygame.Rect):
-    """initialized with point tuple (x,y) (INT,INT)
-    and travel direction ('u','d','l','r') STR"""
-    def __init__(self, starting_point, direction):
+    """initialized with the Simulation it drives in, point tuple (x,y)
+    (INT,INT) and travel direction ('u','d','l','r') STR"""
+    def __init__(self, sim, starting_point, direction, movement=None):
+        self.sim = sim
+        self.reset(starting_point, direction, movement)
+
+    def reset(self, starting_point, direction, movement=None):
+        """ (re)initialize, pooled cars are reset instead of rebuilt """
         self.color = (0,250,0)
-        self.l = random.choice([20, 40, 50, 80])
-        self.w = 15
+        # length along travel
+        self.l = self.sim.random.choice(self.sim.car_lengths)
         self.x = starting_point[0]
         self.y = starting_point[1]
-        self.vel = simulation.speed_limit - 5 +  random.randint(0,5)
-        self.speed_instructions = [] # special instructions (speed, time) tuple
+        self.vel = self.sim.speed_limit - 5 + self.sim.random.randint(0,5)
+        # trip record, for delay statistics: ticks the trip would have
+        # taken at the car's own speeds up to mark, where its speed changed
+        self.spawned = self.sim.sim_clock.ticks
+        self.free = 0.
+        self.mark = starting_point
+        self.speed = self.vel # actually driven, ramps toward the target
+        # at the next crossing
+        self.movement = movement or self.sim.choose_movement()
+        self.turn_at = None # intersection the car turns in, once inside
         self.direction = direction
+        # the rect itself has to carry the car's footprint, pygame 2 never
+        # reports collisions for zero sized rects
         if self.direction in ['d', 'u']:
-            self.l, self.w = self.w, self.l
+            self.size = (self.sim.car_width, self.l)
+        else:
+            self.size = (self.l, self.sim.car_width)
         self.speed_instructions = [] # special instructions (speed, time pair)
+        self.despawned = False
+        if self.sim.fleet is not None: # array backed, fleet moves the car
+            self.slot = self.sim.fleet.add(self.x, self.y, direction,
+                    self.vel, self.l, self.sim.car_width, owner=self)
         #print('new car travelling at', self.vel)
 
     def __hash__(self):
@@ -64,25 +137,27 @@ class Car(pygame.Rect):
         return hash(id(self))
 
     def render(self, screen):
-        pygame.draw.rect(screen,self.color,(self.x,self.y,self.l, self.w))
+        pygame.draw.rect(screen,self.color,self)
+
 
+    def target(self):
+        """ speed the car heads for this tick. Speed instructions (issued
+        by controller) are a queue of segments, each a target speed held
+        until a simulated time. Past the last one the car goes back to its
+        own speed """
+        instructions = self.speed_instructions
+        if instructions:
+            now = self.sim.sim_clock.now
+            while instructions and now > instructions[0][1]:
+                instructions.pop(0)
+        return instructions[0][0] if instructions else self.vel
 
     def update(self):
-        if self.speed_instructions: # issued by controller
-            now = pygame.time.get_ticks() / 1000
-            marker_time = self.speed_instructions[0][1]
-            if now > marker_time:
-                # if we're past the instruction time,
-                # remove it and return to the original speed
-                # NOTE: Strong assumption there's only one instruction
-                # To get around this I will probably have to call self.update
-                # again, but I'd just need to be careful of recursive errors
-                self.speed_instructions.pop(0)
-                vel = self.vel
-            else:
-                vel = self.speed_instructions[0][0]
-        else:
-            vel = self.vel
+        if self.sim.follow: # speed already set by the car following pass
+            vel = self.speed
+        else: # at most accel_step faster or slower per tick
+            vel = self.speed = ramp(self.speed, self.target(),
+                    self.sim.accel_step)
 
         if self.direction == 'r':
             self.x += vel
@@ -93,18 +168,71 @@ class Car(pygame.Rect):
         elif self.direction == 'u':
             self.y -= vel
 
-
-        if 0 > self.x > simulation.WIDTH or 0 > self.y > simulation.HEIGHT:
+        if self.turn_at is not None and reached(self, self.direction,
+                self.turn_line):
+            self.turn()
+        if self.out_of_bounds():
             self.destroy()
 
+    def turn(self):
+        """ swing into the exit lane of the intersection it turns in, and
+        carry on along the crossing road """
+        intersection = self.turn_at
+        came = self.road, self.direction
+        if self.sim.metrics is not None: # past the line, before the jump
+            self.sim.metrics.turn(self)
+        # the trip so far, measured up to the turn and on from the exit lane
+        self.free = self.free_ticks()
+        self.x, self.y, self.w, self.h = turned(intersection.lanes,
+                self.direction, self.turn_to, self.l, self.sim.car_width)
+        self.mark = (self.x, self.y)
+        self.direction = self.turn_to
+        road, other = intersection.roads
+        self.road = other if self.road is road else road
+        self.turn_at = None
+        if self.sim.lanes is not None:
+            self.sim.lanes.move(self, *came)
+        if self.sim.recorder is not None:
+            self.sim.recorder.turn(self)
+
+    def out_of_bounds(self):
+        """ True once the whole car has left the world """
+        return (self.right < 0 or self.left > self.sim.WIDTH
+                or self.bottom < 0 or self.top > self.sim.HEIGHT)
+
+    def instruct(self, speed, until):
+        """ queue a segment: head for speed (pixels per tick) and hold it
+        until simulated time until """
+        if self.sim.fleet is not None:
+            self.sim.fleet.instruct(self.slot, speed, until)
+        else:
+            self.speed_instructions.append((speed, until))
+        if self.sim.recorder is not None:
+            self.sim.recorder.instruct(self, speed, until)
+        if self.sim.metrics is not None:
+            self.sim.metrics.instruct(self, speed, until)
+
+    def free_ticks(self):
+        """ ticks the trip so far would have taken at the car's own speeds,
+        with no controller in the way """
+        distance = abs(self.x - self.mark[0]) + abs(self.y - self.mark[1])
+        return self.free + distance / self.vel
+
     def approach_speed_limit(self):
-        diff = self.vel - simulation.speed_limit
+        self.free, self.mark = self.free_ticks(), (self.x, self.y)
+        diff = self.vel - self.sim.speed_limit
         self.vel -= diff
+        if self.sim.fleet is not None:
+            self.sim.fleet.vel[self.slot] = self.vel
+        if self.sim.recorder is not None:
+            self.sim.recorder.speed(self)
 
     def destroy(self):
-        """ remove cars beyond boundary lines """
-        simulation.cars.remove(self)
-        simulation.intersection.cars = set(simulation.cars)
+        """ remove cars beyond boundary lines. Despawning is deferred to
+        the end of the tick so the car list isn't changed while iterated """
+        if not self.despawned:
+            self.despawned = True
+            self.sim.despawned.append(self)
 
     def change_color(self, status):
         """ color change to indicate if within boundary """
@@ -114,119 +242,753 @@ class Car(pygame.Rect):
             self.color = (0,250,0)
 
 
+class CarPool:
+    """ Recycles despawned cars so long runs stop allocating once the
+    number of cars on the road levels off """
+    def __init__(self, sim):
+        self.sim = sim
+        self.free = [] # despawned cars waiting to be reused
+        self.live = 0 # cars handed out and not released yet
+        self.spawned = 0 # cars ever handed out
+        self.uids = count() # every spawn gets a new uid, even reused cars
+
+    def acquire(self, starting_point, direction, movement=None):
+        self.live += 1
+        self.spawned += 1
+        if self.free:
+            car = self.free.pop()
+            car.reset(starting_point, direction, movement)
+        else:
+            car = Car(self.sim, starting_point, direction, movement)
+        car.uid = next(self.uids)
+        return car
+
+    def release(self, car):
+        if self.sim.fleet is not None:
+            self.sim.fleet.remove(car.slot)
+        self.live -= 1
+        self.free.append(car)
+
+    def stats(self):
+        """ cars on the road, waiting in the pool and ever handed out.
+        Only live + pooled cars were ever built """
+        return {'live': self.live, 'pooled': len(self.free),
+                'spawned': self.spawned}
+
+
 class Intersection:
-    """ Input: a list of two road (pygame rect objects)
+    """ Input: the Simulation, a list of two road (pygame rect objects)
     Establishes - crossing zone - where the road rectangles cross
                 - outer boundary - buffer zone for cars to accelerate
+    factor: outer boundary reaches factor crossing widths past the crossing
     """
-    def __init__(self, roads):
+    def __init__(self, sim, roads, factor=5):
+        self.sim = sim
+        # followers within headway seconds share their leader's slot
+        self.headway = self.sim.platoon_headway
+        self.platoon_size = self.sim.platoon_size
+        self.accel_step = self.sim.accel_step
         self.controller = Controller(self) # Init. controller to manage cars
-        self.count = 0
-        self.cars = set() # rolling set of contained cars
+        if self.sim.plan_window: # decide arrivals in batches
+            self.controller.planner = Planner(self.controller,
+                    self.sim.plan_window, self.sim.plan_budget)
+        self.clock = self.sim.sim_clock # shared simulated clock
+        self.cars = {} # contained cars, in the order they entered
         self.roads = roads
+        for road in roads:
+            road.intersections.append(self)
         # Make coordinates for crossing zone (actual intersection)
         self.cross_zone = roads[0].clip(self.roads[1]) # Overlapping area
         # Make coordinates for outer boundary (acceleration zone)
-        self.factor = 5 # factor - arbitrary. Can be int or .5
+        self.factor = factor # factor - arbitrary. Can be int or .5
         self.bndry_coords = (self.cross_zone.x - self.factor*self.cross_zone.w,
                 self.cross_zone.y - self.factor*self.cross_zone.h,
                 self.cross_zone.w*(2*self.factor + 1), # arbitrary choice 
                 self.cross_zone.h*(2*self.factor + 1))
         self.outer_boundary = pygame.Rect(self.bndry_coords)
+        # lane strips through the crossing, and which movements through
+        # them conflict (shared by every crossing of the same geometry)
+        self.lanes = lanes(self.cross_zone, roads[0].buffer,
+                self.sim.car_width)
+        self.conflicts = conflict_table(self.cross_zone, roads[0].buffer,
+                self.sim.car_width)
+        # reserve n x n tiles of the crossing instead of all of it
+        self.tiling = None
+        if self.sim.tiles:
+            self.tiling = Tiling(self.cross_zone, self.lanes, self.sim.tiles)
+        # grid cells that can hold cars touching the outer boundary
+        self.cells = self.sim.grid.cells_for(self.outer_boundary)
+        self.sim.grid.watch(self.cells, self)
 
     def render(self, screen):
         """draw cross zone (actual intersection) and outer boundary"""
         pygame.draw.rect(screen,(150,150,0),self.cross_zone,1)
         pygame.draw.rect(screen,(10,150,0),self.bndry_coords,1) 
 
-    def check_for_cars(self):
-        """ Update records of cars entering and leaving boundary"""
-        current_cars = self.outer_boundary.collidelistall(simulation.cars)
-        current_cars = set([simulation.cars[c] for c in current_cars])
-        cars_incoming = current_cars - self.cars
-        cars_outgoing = self.cars - current_cars
-        if cars_incoming:
-            for car in cars_incoming:
-                car.change_color('enter')
-                car.render(simulation.screen)
+    def check_entries(self):
+        """ Only cars filed in the grid cells around the boundary are
+        tested for entry """
+        boundary = self.outer_boundary
+        for car in self.sim.grid.query(self.cells):
+            if car not in self.cars and car.colliderect(boundary):
+                self.enter(car)
                 self.controller.reserve_spot(car)
-        if cars_outgoing:
-            for car in cars_outgoing:
-                car.change_color('exit')
-                car.render(simulation.screen)
-                self.controller.remove_reservation(car)
-                car.approach_speed_limit()
-
-        self.cars = current_cars
 
+    def check_exits(self):
+        """ Only contained cars are tested for exit """
+        boundary = self.outer_boundary
+        for car in [c for c in self.cars if not c.colliderect(boundary)]:
+            self.controller.remove_reservation(car)
+            self.exit(car)
+
+    def plan(self):
+        """ let the controller commit its batch of cars, if it plans in
+        batches and the batch is due. Returns the delay saved, seconds """
+        planner = self.controller.planner
+        return 0. if planner is None else planner.plan()
+
+    def enter(self, car):
+        self.cars[car] = None
+        car.change_color('enter')
+        if car.movement != 'through':
+            car.turn_at = self
+            car.turn_to = TURNS[car.direction][car.movement]
+            car.turn_line = turn_line(self.lanes, car.direction, car.turn_to)
+        if self.sim.recorder is not None:
+            self.sim.recorder.enter(self, car)
+        if self.sim.metrics is not None:
+            self.sim.metrics.enter(self, car)
+        self.sim.busy[self] = None # keep checking until the last car left
+
+    def exit(self, car):
+        del self.cars[car]
+        car.change_color('exit')
+        car.movement = self.sim.choose_movement() # for the next crossing
+        if self.sim.recorder is not None:
+            self.sim.recorder.exit(self, car)
+        car.approach_speed_limit()
+        if self.sim.metrics is not None: # after its own speed changed
+            self.sim.metrics.leave(self, car)
+        if not self.cars:
+            self.sim.busy.pop(self, None)
+
+
+
+def build_grid(sim, rows, cols, factor=5):
+    """ Lay out rows horizontal and cols vertical roads evenly over the world
+    with an Intersection (and its Controller) at every crossing.
+    factor is shrunk in half steps until neighbouring outer boundaries no
+    longer overlap. Returns (roads, intersections) """
+    h_roads = [Road(sim, 'h', (i + 1) / (rows + 1)) for i in range(rows)]
+    v_roads = [Road(sim, 'v', (j + 1) / (cols + 1)) for j in range(cols)]
+    # half the gap between road edges, in crossing widths
+    spacing = min(sim.HEIGHT / (rows + 1), sim.WIDTH / (cols + 1))
+    width = sim.road_width
+    room = (spacing / 2 - width / 2) / width
+    while factor > room:
+        factor -= .5
+    if factor <= 0:
+        raise ValueError('roads are too close together for a %dx%d grid'
+                % (rows, cols))
+    intersections = [Intersection(sim, [h, v], factor)
+            for h in h_roads for v in v_roads]
+    return h_roads + v_roads, intersections
 
 
 class Simulation:
-    def __init__(self):
+    """ Roads, cars and intersections stepped one fixed tick at a time.
+    They hold the Simulation they belong to as their sim, so any number
+    can run in one process. Its keywords are main.py's options, see
+    README.md and the --help of each """
+    def __init__(self, headless=False, fleet=False, events=False,
+            grid=None, spacing=250, workers=0, seed=None, speed_limit=20,
+            spawn_interval=.3, car_lengths=(20, 40, 50, 80), factor=5,
+            record=None, turn_mix=(1, 0, 0), tiles=0, plan_window=0,
+            plan_budget=200, platoon_headway=0, platoon_size=4, accel=0,
+            follow=False, safety=False, demand=None, arrivals=None,
+            metrics=None, metrics_window=60., profile=False,
+            profile_ticks=None, sampler=False, profile_out=None,
+            threaded=False, sim_rate=30, size=(1000, 1000), fps=30,
+            road_width=50, car_width=15):
         self.running = True
-        self.size = self.WIDTH, self.HEIGHT = 1000, 1000
-        self.screen = pygame.display.set_mode(self.size)
-        pygame.font.init()
-        t = pygame.font.SysFont('dejavusans',30)
-        self.message = t.render('press <space> to restart', False,(255,255,255))
+        self.headless = headless
+        self.use_fleet = fleet
+        self.use_events = events
+        self.processes = workers
+        self.workers = None
+        self.fleet = None
+        self.network = grid
+        self.seed = seed
+        self.speed_limit = speed_limit
+        self.spawn_interval = spawn_interval # simulated seconds between cars
+        self.car_lengths = car_lengths
+        self.factor = factor
+        self.fps = fps
+        self.road_width = road_width
+        self.car_width = car_width
+        self.record = record
+        self.turn_mix = turn_mix
+        self.tiles = tiles
+        self.plan_window = plan_window
+        self.plan_budget = plan_budget
+        self.platoon_headway = platoon_headway
+        self.platoon_size = platoon_size
+        self.accel = accel
+        self.follow = follow
+        self.safety = safety or follow
+        self.demand_streams = demand
+        self.arrivals = arrivals
+        self.metrics_path = metrics
+        self.metrics_window = metrics_window
+        self.profile = profile or bool(profile_ticks)
+        self.profile_ticks = profile_ticks
+        self.sampler = sampler
+        self.profile_out = profile_out
+        self.threaded = threaded
+        self.sim_rate = sim_rate
+        self.stepper = None # threading.Thread stepping, when threaded
+        if fleet and any(turn_mix[1:]):
+            raise ValueError('the fleet store only moves cars straight, '
+                    'turns need Car objects')
+        if fleet and accel:
+            raise ValueError('the fleet store holds one instruction per car, '
+                    'ramped profiles need Car objects')
+        if follow and (fleet or events or record):
+            raise ValueError('car following sets every car\'s speed each '
+                    'tick, which the fleet store, the event engine and the '
+                    'log can\'t reproduce')
+        if events and record:
+            raise ValueError('the log is replayed tick by tick from '
+                    'keyframes, the event engine skips ticks')
+        if events and fleet:
+            raise ValueError('the event engine follows each car\'s own '
+                    'instructions, the fleet store keeps them in its arrays')
+        if events and workers:
+            raise ValueError('the event engine runs the controllers itself, '
+                    'worker processes are stepped every tick')
+        if profile_ticks and not 0 < profile_ticks[0] <= profile_ticks[1]:
+            raise ValueError('profile_ticks must be ticks first <= last, '
+                    'counted from 1, got %d to %d' % tuple(profile_ticks))
+        if threaded and headless:
+            raise ValueError('the stepping thread only decouples drawing, '
+                    'a headless run has nothing to draw')
+        if (safety or metrics or self.profile) and events:
+            raise ValueError('lanes and crossings are checked every tick, '
+                    'the event engine skips ticks')
+        if grid:
+            self.size = (spacing * (grid[1] + 1), spacing * (grid[0] + 1))
+        else:
+            self.size = tuple(size)
+        if accel:
+            # a car that can't stop within the outer boundary can't wait for
+            # a slot either, and crosses through whatever holds it
+            approach = factor * road_width
+            if grid: # build_grid shrinks factor to fit the spacing
+                approach = min(approach, (spacing - road_width) / 2)
+            stop = (speed_limit * fps) ** 2 / (2 * accel)
+            if stop > approach:
+                log.warning('cars need %.0f px to stop at accel %g, the '
+                        'outer boundary leaves %.0f: raise factor or accel, '
+                        'or expect crashes', stop, accel, approach)
+        self.WIDTH, self.HEIGHT = self.size
+        # callables run after every step. With fleet, one looking at every
+        # car calls fleet.sync() first
+        self.observers = []
+        self.screen = None
+        if not headless:
+            self.screen = pygame.display.set_mode(self.size)
+            pygame.font.init()
+            t = pygame.font.SysFont('dejavusans',30)
+            self.message = t.render('press <space> to restart', False,
+                    (255,255,255))
 
     def on_init(self):
-        pygame.init()
-        pygame.mixer.init()
-        pygame.display.set_caption("Smart Intersection Simulation")
-        self.clock = pygame.time.Clock()
-        self.FPS = 30
-        self.SPAWN = pygame.USEREVENT + 1
-        self.speed_limit = 20
-        pygame.time.set_timer(self.SPAWN, 300)
+        self.FPS = self.fps
+        self.random = random.Random(self.seed)
+        self.sim_clock = SimClock(1 / self.FPS)
+        # speed change per tick, in pixels per tick
+        self.accel_step = self.accel * self.sim_clock.dt ** 2
+        self.next_spawn = self.spawn_interval
+        self.observers = []
+        self.pool = CarPool(self)
+        # cells no smaller than the longest car, which can reach that far
+        # into a region from the cell it's filed under
+        extent = max(max(self.car_lengths), self.car_width)
+        self.grid = SpatialGrid(cell=max(100, extent), margin=extent)
+        self.busy = {} # intersections that still contain cars
+        self.despawned = [] # cars that left the world this tick
+        self.trips = 0 # cars that made it out of the world
+        self.trip_delay = 0. # summed over those trips, seconds
+        self.delay_saved = 0. # by batch planning against greedy, seconds
+        self.recorder = None # replay.Recorder, when the run is logged
+        self.metrics = None # metrics.Metrics, when aggregates are streamed
+        self.profiler = None # profiler.Profiler, when ticks are timed
+        self.lanes = None # following.Lanes, for car following and safety
+        self.held = {} # lane -> [(road, direction, movement, tick)] spawns
+                       # waiting for room at the end of the road
+        if self.safety: # numpy is only needed for these modes
+            from following import Lanes
+            self.lanes = Lanes(self.sim_clock.dt, self.accel_step,
+                    idm=self.follow)
+        if self.use_fleet:
+            from fleet import Fleet # numpy is only needed for this mode
+            self.fleet = Fleet(cell=self.grid.cell)
+        if not self.headless:
+            pygame.init()
+            pygame.mixer.init()
+            pygame.display.set_caption("Smart Intersection Simulation")
+            self.clock = pygame.time.Clock()
+            self.observers.append(self.publish if self.threaded
+                    else self.render)
+        self.snapshot = None # render.Snapshot, waiting to be drawn
+        self.wanted = True # the window has drawn the last snapshot
+        self.handoff = threading.Lock() # guards snapshot and wanted
 
     def object_init(self):
-        self.roads = [Road('h',.5), Road('v',.5)]
+        self.close() # a restart drops the previous run's workers
         self.cars = []
-        self.intersection = Intersection(self.roads)
+        if self.network:
+            self.roads, self.intersections = build_grid(self,
+                    *self.network, factor=self.factor)
+        else:
+            self.roads = [Road(self, 'h',.5), Road(self, 'v',.5)]
+            self.intersections = [Intersection(self, self.roads,
+                    self.factor)]
+        self.renderer = None # render.Renderer, on screen
+        if self.screen is not None:
+            self.renderer = Renderer(self.screen, self.roads,
+                    self.intersections, self.message)
+        self.demand = None # demand.Demand, unless cars spawn at an interval
+        if self.demand_streams or self.arrivals:
+            from demand import Demand, load_arrivals # needs numpy
+            import numpy as np
+            self.demand = Demand(self.roads,
+                    np.random.default_rng(self.random.getrandbits(64)),
+                    self.demand_streams or (),
+                    load_arrivals(self.arrivals) if self.arrivals else ())
+            if self.use_fleet and self.demand.turns():
+                raise ValueError('the fleet store only moves cars straight, '
+                        'turns need Car objects')
+        if self.fleet is not None: # only cars around crossings are synced
+            self.fleet.watch(self.grid.nearby())
+        if self.processes:
+            from parallel import WorkerPool
+            self.workers = WorkerPool(self, self.processes)
+
+    def step(self):
+        """ Advance the simulation by one fixed tick """
+        profiler = self.profiler
+        now = self.sim_clock.tick()
+        self.spawn(now)
+        if profiler is not None:
+            profiler.mark('spawn')
+        if self.lanes is not None: # gaps as the last tick left them
+            self.lanes.step()
+            if profiler is not None:
+                profiler.mark('lanes')
+        fleet = self.fleet
+        if fleet is not None:
+            # cells and positions only change on the objects of cars that
+            # moved cell or are around a crossing, and of those leaving
+            fleet.step(now)
+            # in spawn order, like grid.update, which keeps the order cars
+            # are found in a cell, and so enter, the same
+            refiled = [(fleet.owners[slot], key)
+                    for slot, key in fleet.refiled()]
+            refiled.sort(key=lambda moved: moved[0].uid)
+            for car, key in refiled:
+                self.grid.move(car, key)
+            gone = fleet.outside(self.WIDTH, self.HEIGHT)
+            if self.lanes is not None: # gaps are measured between all cars
+                fleet.sync()
+            else:
+                fleet.sync(fleet.watched())
+                if gone:
+                    fleet.sync(gone)
+            for slot in gone:
+                fleet.owners[slot].destroy()
+        else:
+            for car in self.cars:
+                car.update()
+        if profiler is not None:
+            profiler.mark('move')
+        if self.despawned:
+            self.despawn()
+        if fleet is None:
+            self.grid.update(self.cars)
+        if profiler is not None:
+            profiler.mark('despawn+grid')
+        # only intersections with cars around them have anything to do.
+        # Every entry of the tick is handled before any exit, so the order
+        # intersections are visited in never matters
+        active = self.grid.watchers()
+        active.update(self.busy)
+        if self.workers is not None:
+            self.delay_saved += self.workers.check(active)
+            if profiler is not None:
+                profiler.mark('workers')
+        else:
+            for intersection in active:
+                intersection.check_entries()
+                self.delay_saved += intersection.plan()
+            if profiler is not None:
+                profiler.mark('entries')
+            for intersection in active:
+                intersection.check_exits()
+            if profiler is not None:
+                profiler.mark('exits')
+        for observer in self.observers:
+            observer(self)
+        if profiler is not None: # what the render observer left
+            profiler.mark('observers')
+            profiler.end(self.sim_clock.ticks)
+
+    def spawn(self, now):
+        """ add the cars arriving by simulated time now """
+        if self.held:
+            self.spawn_held()
+        if self.demand is not None:
+            for road, direction, movement in self.demand.due(now):
+                self.roads[road].add_car(direction, movement)
+            return
+        while now >= self.next_spawn:
+            self.random.choice(self.roads).add_car()
+            self.next_spawn += self.spawn_interval
+
+    def spawn_held(self):
+        """ spawn the first car held in every lane whose end has room
+        again. The rest wait behind it """
+        for key in list(self.held):
+            held = self.held[key]
+            road, direction, movement, due = held[0]
+            if self.lanes.clear(key, road.entries[direction]):
+                del held[0]
+                if not held:
+                    del self.held[key]
+                road.add_car(direction, movement, due)
+
+    def despawn(self):
+        """ Drop this tick's despawned cars from the road and the
+        intersection, and hand them back to the pool """
+        now = self.sim_clock.ticks
+        for car in self.despawned:
+            # delay: time taken beyond driving the same distance at the
+            # car's own speeds, which change at its first exit. Cars drive
+            # the tick they spawn on too
+            delay = (now - car.spawned + 1 - car.free_ticks()
+                    ) * self.sim_clock.dt
+            self.trips += 1
+            self.trip_delay += delay
+            if self.recorder is not None:
+                self.recorder.despawn(car)
+            for intersection in car.road.intersections:
+                if car in intersection.cars:
+                    if self.metrics is not None:
+                        self.metrics.leave(intersection, car)
+                    del intersection.cars[car]
+                    if self.workers is not None:
+                        self.workers.forget(intersection, car)
+                    elif car in intersection.controller.movements:
+                        intersection.controller.remove_reservation(car)
+            if self.metrics is not None:
+                self.metrics.despawn(car, delay)
+            self.grid.remove(car)
+            if self.lanes is not None:
+                self.lanes.leave(car)
+            self.pool.release(car)
+        self.cars = [car for car in self.cars if not car.despawned]
+        self.despawned = []
+
+    def choose_movement(self):
+        """ through, left or right, drawn from turn_mix. Without turns no
+        random number is drawn, so seeded runs stay as they were """
+        if not any(self.turn_mix[1:]):
+            return 'through'
+        return self.random.choices(('through', 'left', 'right'),
+                self.turn_mix)[0]
+
+    def render(self, sim):
+        """ Draw one frame. Registered as an observer of step() """
+        if self.profiler is not None:
+            self.profiler.mark('observers')
+        if self.fleet is not None:
+            self.fleet.sync()
+        self.renderer.draw(snapshot(self.sim_clock.ticks, self.cars),
+                self.profiler)
+
+    def publish(self, sim):
+        """ Observer of step() when stepping in a thread: hand the window
+        this tick's snapshot if it has drawn the last one. Ticks stepped
+        in between are never drawn, or copied """
+        if self.wanted: # only the window sets it again
+            if self.fleet is not None:
+                self.fleet.sync()
+            latest = snapshot(self.sim_clock.ticks, self.cars)
+            with self.handoff:
+                self.snapshot, self.wanted = latest, False
+
+    def draw_latest(self):
+        """ draw the latest snapshot, if there is a new one, and ask for
+        the next """
+        with self.handoff:
+            latest, self.snapshot = self.snapshot, None
+        if latest is not None:
+            self.renderer.draw(latest)
+            with self.handoff:
+                self.wanted = True
+
+    def start_stepping(self):
+        self.stepping = True
+        self.failure = None
+        self.stepper = threading.Thread(target=self.step_forever,
+                name='simulation', daemon=True)
+        self.stepper.start()
+
+    def stop_stepping(self):
+        if self.stepper is not None:
+            self.stepping = False
+            self.stepper.join()
+            self.stepper = None
+
+    def step_forever(self):
+        """ the stepping thread: sim_rate ticks per second of wall clock
+        time until stopped. Ticks that fall behind aren't caught up in a
+        burst """
+        period = 1 / self.sim_rate if self.sim_rate else 0
+        due = time.perf_counter()
+        try:
+            while self.stepping and self.running:
+                self.step()
+                if period:
+                    due += period
+                    wait = due - time.perf_counter()
+                    if wait > 0:
+                        time.sleep(wait)
+                    else:
+                        due = time.perf_counter()
+        except BaseException as error: # raised again in the window's loop
+            self.failure = error
 
     def on_loop(self):
+        """ Step and draw until the window is closed or space is pressed.
+        Returns whether to restart """
+        if self.threaded:
+            self.start_stepping()
+        # phases of the frame are only timed when stepping takes place in it
+        profiler = None if self.threaded else self.profiler
         while self.running:
             # keep loop running at the right speed
             self.clock.tick(self.FPS)
+            if profiler is not None:
+                profiler.mark('wait')
             # Process input (events)
             for event in pygame.event.get():
-
-                if event.type == self.SPAWN:
-                    random.choice(self.roads).add_car()
-
-                elif event.type == pygame.KEYDOWN: # Space button restarts
+                if event.type == pygame.KEYDOWN: # Space button restarts
                     if event.key == pygame.K_SPACE:
-                        self.execute()
+                        self.stop_stepping()
+                        return True
                 # check for closing window
                 elif event.type == pygame.QUIT:
                     self.running = False
-            # Update
-            for car in self.cars:
-                car.update()
-            pygame.display.update()
-            # Draw / render
-            self.screen.fill((0,0,0))
-            for road in self.roads:
-                road.render(self.screen)
-
-            self.intersection.render(self.screen)
-            self.intersection.check_for_cars()
-
-            for car in self.cars:
-                car.render(self.screen)
-
-            self.screen.blit(self.message,(0,0))
-            # *after* drawing everything, flip the display
-            #pygame.display.flip()
+            if profiler is not None:
+                profiler.mark('events')
+            if self.threaded:
+                if self.failure is not None:
+                    raise self.failure
+                self.draw_latest()
+            else:
+                self.step()
+        self.stop_stepping()
         pygame.quit()
+        return False
+
+    def run(self, duration):
+        """ Step without a frame limit until duration (simulated seconds)
+        has passed """
+        while self.running and self.sim_clock.now < duration:
+            self.step()
+
+    def execute(self, duration=None, observers=()):
+        """ Run headless for duration simulated seconds, or on screen until
+        the window is closed. A restart closes the run and starts the next
+        from scratch in this same loop, so restarts never nest. observers:
+        more callables to run after every step of every run """
+        if observers and self.use_events:
+            raise ValueError('observers run after every tick, the event '
+                    'engine skips ticks')
+        restart = True
+        while restart:
+            restart = False
+            self.on_init()
+            self.object_init()
+            self.attach_observers()
+            self.observers.extend(observers)
+            if self.headless and self.use_events:
+                from events import EventEngine
+                EventEngine(self).run(duration)
+            elif self.headless:
+                self.run(duration)
+            else:
+                restart = self.on_loop()
+            self.close()
+            log.info('%(spawned)d cars spawned from a pool of '
+                    '%(live)d live and %(pooled)d pooled', self.pool.stats())
+            if self.plan_window:
+                log.info('batch planning saved %.2f s of delay against '
+                        'greedy', self.delay_saved)
+            if self.lanes is not None:
+                log.info('%d collisions and %d near misses within lanes',
+                        len(self.lanes.collisions),
+                        len(self.lanes.near_misses))
+
+    def attach_observers(self):
+        """ start the log, metrics and profiler asked for, after
+        object_init """
+        if self.record:
+            from replay import Recorder
+            # the fleet moves cars differently, its logs carry every car's
+            # state every tick
+            Recorder(self.record, states=self.use_fleet).attach(self)
+        if self.metrics_path:
+            from metrics import Metrics # needs numpy
+            Metrics(self.metrics_path, self.metrics_window).attach(self)
+        if self.profile:
+            from profiler import Profiler
+            Profiler(window=self.profile_ticks, sampler=self.sampler,
+                    path=self.profile_out).attach(self)
+
+    def close(self):
+        """ stop worker processes and finish the log and metrics, if any """
+        self.stop_stepping()
+        if self.workers is not None:
+            self.workers.close()
+            self.workers = None
+        if self.recorder is not None:
+            self.recorder.close()
+        if self.metrics is not None:
+            self.metrics.close()
+            self.metrics = None
+        if self.profiler is not None:
+            self.profiler.close()
+            self.profiler = None
+
+
+def parse_args(argv=None, given=False):
+    """ the command line, or with given only the options it has, without
+    defaults for the rest """
+    parser = argparse.ArgumentParser(
+            description="Smart Intersection Simulation")
+    parser.add_argument('--scenario', metavar='FILE',
+            help='settings from a scenario file (.toml or .json, see '
+            'scenario.py); options given here override it')
+    parser.add_argument('--headless', action='store_true',
+            help='run without a window, as fast as possible')
+    parser.add_argument('--duration', type=float, default=3600,
+            help='simulated seconds to run in headless mode')
+    parser.add_argument('--fleet', action='store_true',
+            help='keep car state in NumPy arrays (needs numpy)')
+    parser.add_argument('--events', action='store_true',
+            help='headless only: jump between predicted events')
+    parser.add_argument('--grid', type=int, nargs=2, metavar=('ROWS', 'COLS'),
+            help='lay out a road grid with an intersection at every crossing')
+    parser.add_argument('--spacing', type=int, default=250,
+            help='pixels between neighbouring roads of a grid')
+    parser.add_argument('--workers', type=int, default=0,
+            help='run the controllers in this many worker processes')
+    parser.add_argument('--turns', type=float, nargs=3, default=(1, 0, 0),
+            metavar=('THROUGH', 'LEFT', 'RIGHT'),
+            help='weights of the movements cars make at each crossing')
+    parser.add_argument('--tiles', type=int, default=0, metavar='N',
+            help='reserve paths through N x N tiles of each crossing')
+    parser.add_argument('--plan', type=float, default=0, metavar='SECONDS',
+            help='schedule arriving cars in batches collected this long')
+    parser.add_argument('--plan-budget', type=int, default=200,
+            metavar='PLACEMENTS', help='placements the search of one batch '
+            'may try')
+    parser.add_argument('--platoon', type=float, default=0,
+            metavar='SECONDS', help='headway within which followers join '
+            'the platoon ahead and share its reservation')
+    parser.add_argument('--platoon-size', type=int, default=4,
+            help='most cars in one platoon')
+    parser.add_argument('--accel', type=float, default=0,
+            metavar='PX_PER_S2', help='limit on how fast cars change speed '
+            '(default: instantly)')
+    parser.add_argument('--follow', action='store_true',
+            help='cars brake for the car ahead in their lane (needs numpy)')
+    parser.add_argument('--safety', action='store_true',
+            help='count collisions and near misses within lanes (needs '
+            'numpy)')
+    parser.add_argument('--demand', nargs=2, action='append',
+            metavar=('APPROACH', 'PROCESS'), help='arrival stream instead '
+            'of the spawn interval, e.g. --demand "*" poisson:900 or '
+            '--demand 0r/left curve:0@300,1800@1200 (needs numpy)')
+    parser.add_argument('--arrivals', metavar='CSV',
+            help='scheduled arrivals: time, road, direction[, movement]')
+    parser.add_argument('--metrics', metavar='PATH',
+            help='stream per approach aggregates to PATH, CSV or .parquet '
+            '(needs numpy, and pyarrow for parquet)')
+    parser.add_argument('--metrics-window', type=float, default=60.,
+            metavar='SECONDS', help='simulated seconds per metrics row')
+    parser.add_argument('--profile', action='store_true',
+            help='time every phase of every tick, report percentiles')
+    parser.add_argument('--profile-ticks', type=int, nargs=2,
+            metavar=('FIRST', 'LAST'), help='also profile ticks FIRST to '
+            'LAST, both included, with cProfile')
+    parser.add_argument('--sampler', action='store_true',
+            help='profile --profile-ticks with the sampling profiler instead')
+    parser.add_argument('--profile-out', metavar='PATH',
+            help='write the profile there (pstats, or folded stacks with '
+            '--sampler) instead of logging its top')
+    parser.add_argument('--threaded', action='store_true',
+            help='step the simulation in its own thread, drawing the '
+            'latest tick at the frame rate')
+    parser.add_argument('--sim-rate', type=float, default=30,
+            metavar='TICKS', help='ticks per second stepped with '
+            '--threaded (0: as fast as possible)')
+    parser.add_argument('--log-level', default='INFO',
+            choices=('DEBUG', 'INFO', 'WARNING', 'ERROR'),
+            help='DEBUG also logs every controller decision')
+    parser.add_argument('--seed', type=int, default=None,
+            help='seed for a reproducible run')
+    parser.add_argument('--record', metavar='PATH',
+            help='log the run to PATH for replay.py')
+    if given: # even an option given at its default value counts: parse
+        # onto every option unset, argparse only fills in the missing ones
+        unset = dict.fromkeys(vars(parser.parse_args([])))
+        args = parser.parse_args(argv, argparse.Namespace(**unset))
+        return argparse.Namespace(**{k: v for k, v in vars(args).items()
+                if v is not None})
+    return parser.parse_args(argv)
+
+
+# options named differently from their Simulation keyword, and options
+# that aren't one
+KEYWORDS = {'turns': 'turn_mix', 'plan': 'plan_window',
+        'platoon': 'platoon_headway'}
+NOT_KEYWORDS = ('scenario', 'duration', 'log_level')
+
+
+def options(args):
+    """ Simulation keywords from the command line, those of the options
+    args has """
+    settings = {KEYWORDS.get(k, k): v for k, v in vars(args).items()
+            if k not in NOT_KEYWORDS}
+    if 'turn_mix' in settings:
+        settings['turn_mix'] = tuple(settings['turn_mix'])
+    if settings.get('demand'):
+        settings['demand'] = [tuple(d) for d in settings['demand']]
+    return settings
 
-    def execute(self):
-        self.on_init()
-        self.object_init()
-        self.on_loop()
-                                 
 
 if __name__ == "__main__":
-    simulation = Simulation()
-    simulation.execute()
+    args = parse_args()
+    logging.basicConfig(level=args.log_level, format='%(message)s')
+    settings, duration = options(args), args.duration
+    if args.scenario: # the file's settings, but for the options given
+        from scenario import load
+        given = parse_args(given=True)
+        settings, planned = load(args.scenario)
+        settings.update(options(given))
+        if planned and 'duration' not in given:
+            duration = planned
+    Simulation(**settings).execute(duration)
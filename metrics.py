@@ -0,0 +1,392 @@
+from array import array
+import csv
+from itertools import chain
+import numpy as np
+
+
+# event kinds
+SPAWN, ENTER, GRANT, CROSS, CROSSED, EXIT, DESPAWN = range(7)
+KINDS = 7
+HEADINGS = 'udlr' # approach <-> code, part of an event's key
+FIELDS = ['window', 'intersection', 'approach', 'arrivals', 'throughput',
+        'mean_delay', 'p95_delay', 'planned_delay', 'crossing_time', 'queue']
+
+
+class Entry:
+    """ a car inside a boundary, from entering until it leaves """
+    __slots__ = ('car', 'key', 'zone', 'entered', 'expected', 'reached',
+            'cleared', 'due', 'top')
+
+    def __init__(self, car, key, zone, entered, expected):
+        self.car = car
+        self.key = key # of the approach it came in on
+        self.zone = zone # the crossing's rect
+        self.entered = entered # tick
+        self.expected = expected # tick it would get to the crossing at
+                                 # its own speed
+        self.reached = None # tick its front got over the crossing's line
+        self.cleared = False # its rear has left the crossing
+        self.due = None # tick of its next look
+        self.top = 0. # speed it was taken to go at most, see after()
+
+
+class Metrics:
+    """Per approach throughput, delay and queue aggregates, a row per
+    window of simulated time, written to path (CSV, or Parquet if it ends
+    in .parquet). Each car's crossing is seen at the end of the first tick
+    it could have happened on, and looked for again from there"""
+    def __init__(self, path, window=60., capacity=1 << 13, flush_every=10):
+        self.path = path
+        self.window = window # simulated seconds
+        self.capacity = capacity
+        self.flush_every = flush_every
+        self.codes = array('q', bytes(8 * capacity))
+        self.values = array('d', bytes(8 * capacity))
+        self.queued = array('d', bytes(8 * capacity))
+        self.at = 0 # where the next event goes
+        self.rows = [] # aggregated, not written yet
+        self.out = None
+        self.writer = None
+
+    def attach(self, sim):
+        """ start collecting from sim, after object_init """
+        self.sim = sim
+        self.clock = sim.sim_clock
+        self.fleet = sim.fleet
+        # each intersection's key of each heading in
+        self.keys = {x: {h: 4 * i + 1 + j for j, h in enumerate(HEADINGS)}
+                for i, x in enumerate(sim.intersections)}
+        for intersection in sim.intersections:
+            intersection.controller.metrics = self
+        self.used = 4 * len(sim.intersections) + 1 # keys, world's too
+        # cars inside each boundary, by uid (ints hash faster than cars)
+        self.inside = {x: {} for x in sim.intersections}
+        self.due = {} # tick -> entries to look at then
+        # whether a car leaving a boundary can be inside another one
+        self.ahead = len(sim.intersections) > 1
+        # cars move themselves a whole pixel count a tick, fleet cars are
+        # moved in floats and rounded onto their rects
+        self.whole = sim.fleet is None
+        # and with speeds changing at once, they go the speeds they're told
+        self.instant = self.whole and not sim.follow and not sim.accel_step
+        self.start = self.clock.ticks # of the open window
+        self.per_window = round(self.window / self.clock.dt)
+        self.end = self.start + self.per_window
+        self.clear()
+        sim.metrics = self
+        sim.observers.append(self.end_tick)
+
+    def clear(self):
+        """ forget the events of the windows summarized """
+        self.events = [] # (codes, values, ticks queued) drained
+        self.drained = 0 # events in them
+        # (start tick, end tick, events up to its end, queue x ticks by key
+        # of the cars still queued at its end) of every window closed since
+        self.closed = []
+
+    def record(self, kind, key, value=0., queued=0.):
+        """ buffer an event. Its code is kind * (keys + 1) + key, keys
+        being intersection index * 4 + heading code + 1, 0 the world's """
+        i = self.at
+        self.codes[i] = kind * self.used + key
+        self.values[i] = value
+        self.queued[i] = queued
+        self.at = i = i + 1
+        if i == self.capacity:
+            self.drain()
+
+    # hooks, called where the Recorder's are
+    def spawn(self, car):
+        self.record(SPAWN, 0)
+
+    def enter(self, intersection, car):
+        """ car is inside the boundary, where it is at the end of the
+        tick """
+        ticks = self.clock.ticks
+        key = self.keys[intersection][car.direction]
+        zone = intersection.cross_zone
+        short = -FRONT[car.direction](car, zone) # of the crossing's line
+        # the first tick its front is over the line at its own speed, whole
+        # pixels a tick
+        step = int(car.vel + .5) or 1
+        expected = ticks + (short // step + 1 if short >= 0 else 0)
+        entry = Entry(car, key, zone, ticks, expected)
+        self.inside[intersection][car.uid] = entry
+        self.record(ENTER, key)
+        if short >= 0:
+            self.schedule(entry, self.after(entry, short + 1, ticks))
+        else:
+            self.look(entry, ticks)
+
+    def grant(self, controller, car, time_request, slot):
+        self.record(GRANT, self.keys[controller.intersection][car.direction],
+                slot[0] - time_request[0])
+
+    def instruct(self, car, speed, until):
+        """ car may go faster than it was taken to when it was last
+        looked at, so it's looked at again at the end of the tick """
+        for intersection in car.road.intersections:
+            entry = self.inside[intersection].get(car.uid)
+            if (entry is not None and entry.due is not None
+                    and speed > entry.top):
+                self.schedule(entry, self.clock.ticks)
+
+    def turn(self, car):
+        """ car is about to turn, jumping into its exit lane, so it's
+        looked at again at the end of the tick """
+        entry = self.inside[car.turn_at].get(car.uid)
+        if entry is not None and entry.due is not None:
+            self.schedule(entry, self.clock.ticks)
+
+    def despawn(self, car, delay):
+        """ after leave() for every intersection the car was still in """
+        self.record(DESPAWN, 0, delay)
+
+    def leave(self, intersection, car):
+        """ car is out of the boundary. EXIT is only recorded if it never
+        got to the crossing. Called once the car's own speed changed on the
+        way out, which may take it faster through the crossings it's
+        still inside the boundaries of """
+        ticks = self.clock.ticks
+        entry = self.inside[intersection].pop(car.uid, None)
+        if entry is None:
+            return
+        entry.due = None
+        if entry.reached is None:
+            self.record(EXIT, entry.key, 0., ticks - max(entry.entered,
+                    self.start))
+        elif not entry.cleared: # out of the boundary, clear of it by now
+            self.clears(entry, ticks)
+        if self.ahead:
+            for other in car.road.intersections:
+                entry = self.inside[other].get(car.uid)
+                if (entry is not None and entry.due is not None
+                        and car.vel > entry.top):
+                    self.schedule(entry, ticks)
+
+    def end_tick(self, sim):
+        """ observer of every step: the looks due this tick, which are
+        never scheduled for one gone, and the end of the window """
+        ticks = self.clock.ticks
+        due = self.due.pop(ticks, None)
+        if due is not None:
+            for entry in due:
+                if entry.due == ticks: # not gone or looked at since
+                    self.look(entry, ticks)
+        if ticks >= self.end:
+            self.close_window(self.end)
+
+    def schedule(self, entry, due):
+        """ look at entry at the end of tick due """
+        entry.due = due
+        self.due.setdefault(due, []).append(entry)
+
+    def look(self, entry, ticks):
+        """ did entry's car get to, or clear, the crossing by the end of
+        tick ticks? If not, look again on the first tick it could have """
+        car = entry.car
+        if entry.reached is None:
+            short = -FRONT[car.direction](car, entry.zone)
+            if short >= 0:
+                self.schedule(entry, self.after(entry, short + 1, ticks))
+                return
+            self.cross(entry, ticks)
+        left = AWAY[car.direction](car, entry.zone)
+        if left > 0:
+            self.schedule(entry, self.after(entry, left, ticks))
+        else:
+            entry.due = None
+            self.clears(entry, ticks)
+
+    def after(self, entry, pixels, ticks):
+        """ first tick, after tick ticks, entry's car can have moved its
+        rect pixels further, as long as it isn't told to go faster and its
+        own speed stays. Moving itself, it goes its speed rounded (half away
+        from zero, as pygame does) a tick, and with speeds changing at once
+        that's each speed it was told to hold for as long as Car.target()
+        does, then its own. Moved by the fleet, its rect is at most a pixel
+        further than its speed times the ticks """
+        car = entry.car
+        if self.instant:
+            for speed, until in car.speed_instructions:
+                last = self.clock.last_tick_at(until) # the last tick held
+                if last <= ticks:
+                    continue
+                step = int(speed + .5)
+                if step * (last - ticks) >= pixels:
+                    return ticks - (-pixels // step)
+                pixels -= step * (last - ticks)
+                ticks = last
+            entry.top = top = car.vel
+        else:
+            entry.top = top = self.top(car)
+        if self.whole:
+            return ticks - (-pixels // (int(top + .5) or 1))
+        return ticks + max(1, -int(-(pixels - 1) // top))
+
+    def top(self, car):
+        """ fastest car can go as long as it isn't told to go faster and
+        its own speed stays: the fastest of its speed, its own and those it
+        was told to hold """
+        top = car.vel
+        fleet = self.fleet
+        if fleet is not None: # the fleet keeps instructions and speeds
+            slot = car.slot
+            if fleet.inst_until[slot] >= self.clock.now:
+                top = max(top, float(fleet.inst_speed[slot]))
+            return top
+        if car.speed > top:
+            top = car.speed
+        for speed, _ in car.speed_instructions:
+            if speed > top:
+                top = speed
+        return top
+
+    def cross(self, entry, ticks):
+        """ entry's car got to the crossing at tick ticks """
+        entry.reached = ticks
+        self.record(CROSS, entry.key, (ticks - entry.expected) * self.clock.dt,
+                ticks - max(entry.entered, self.start))
+
+    def clears(self, entry, ticks):
+        """ entry's car cleared the crossing at tick ticks """
+        entry.cleared = True
+        self.record(CROSSED, entry.key,
+                (ticks - entry.reached) * self.clock.dt)
+
+    def drain(self):
+        """ move the buffered events out of the ring """
+        n = self.at
+        if not n:
+            return
+        self.events.append((np.frombuffer(self.codes, np.int64, n).copy(),
+                np.frombuffer(self.values, np.float64, n).copy(),
+                np.frombuffer(self.queued, np.float64, n).copy()))
+        self.drained += n
+        self.at = 0
+
+    def close_window(self, end):
+        """ end the open window at tick end. Its rows are worked out with
+        the other windows' when they're written """
+        waiting = [0] * self.used # queue x ticks of those still queued
+        for inside in self.inside.values():
+            for entry in inside.values():
+                if entry.reached is None:
+                    waiting[entry.key] += end - max(entry.entered, self.start)
+        self.closed.append((self.start, end, self.drained + self.at,
+                waiting))
+        self.start = end
+        self.end = end + self.per_window
+        if len(self.closed) >= self.flush_every:
+            self.flush()
+
+    def summarize(self):
+        """ the rows of the closed windows, from all of their events at
+        once: each event's code is offset by its window's index times the
+        codes of a window """
+        self.drain()
+        used, closed = self.used, self.closed
+        size = KINDS * used
+        n = len(closed) * size
+        last = closed[-1][2] # events after it are in no closed window
+        codes, values, queued = (np.concatenate(column)[:last] for column
+                in zip(*self.events, (np.zeros(0, np.int64), [], [])))
+        codes = codes + np.repeat(
+                np.arange(0, n, size), np.diff([0] + [at
+                for _, _, at, _ in closed]))
+        counts = np.bincount(codes, minlength=n)
+        means = (np.bincount(codes, values, n) / np.maximum(counts, 1)
+                ).tolist()
+        # queue: each car's ticks between entering (or its window's start)
+        # and reaching the crossing or leaving, zero for other events
+        area = np.bincount(codes, queued, n).tolist()
+        counts = counts.tolist()
+        # only delays have a 95th percentile worth sorting for, the ranked
+        # codes in order, each code's values in order
+        kinds = codes % size
+        ranked = (kinds // used == CROSS) | (kinds == DESPAWN * used)
+        ordered = values[ranked][np.lexsort((values[ranked], codes[ranked]))
+                ].tolist()
+        first = 0 # of the next ranked code's values
+        for base, (start, end, _, waiting) in zip(range(0, n, size), closed):
+            p95 = {}
+            for code in chain(range(CROSS * used, (CROSS + 1) * used),
+                    [DESPAWN * used]):
+                if counts[base + code]:
+                    p95[code] = percentile(ordered, first, counts[base + code])
+                    first += counts[base + code]
+            ticks = end - start
+            minutes = ticks * self.clock.dt / 60
+            window = start * self.clock.dt
+            for key in range(1, used):
+                at = base + key
+                arrivals = counts[at + ENTER * used]
+                crossings = counts[at + CROSS * used]
+                cleared = counts[at + CROSSED * used]
+                planned = counts[at + GRANT * used]
+                queue = (area[at + CROSS * used] + area[at + EXIT * used]
+                        + waiting[key])
+                if arrivals or crossings or cleared or queue or planned:
+                    self.rows.append([window, (key - 1) // 4,
+                            HEADINGS[(key - 1) % 4],
+                            arrivals / minutes, crossings / minutes,
+                            means[at + CROSS * used] if crossings else '',
+                            p95.get(CROSS * used + key, ''),
+                            means[at + GRANT * used] if planned else '',
+                            means[at + CROSSED * used] if cleared else '',
+                            queue / ticks])
+            trips = counts[base + DESPAWN * used]
+            self.rows.append([window, -1, '*',
+                    counts[base + SPAWN * used] / minutes, trips / minutes,
+                    means[base + DESPAWN * used] if trips else '',
+                    p95.get(DESPAWN * used, ''), '', '', ''])
+        self.clear()
+
+    def flush(self):
+        if self.closed:
+            self.summarize()
+        if not self.rows:
+            return
+        if self.path.endswith('.parquet'):
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            table = pa.table({name: [None if row[i] == '' else row[i]
+                    for row in self.rows] for i, name in enumerate(FIELDS)})
+            if self.writer is None:
+                self.writer = pq.ParquetWriter(self.path, table.schema)
+            self.writer.write_table(table)
+        else:
+            if self.out is None:
+                self.out = open(self.path, 'w', newline='')
+                self.writer = csv.writer(self.out)
+                self.writer.writerow(FIELDS)
+            self.writer.writerows(self.rows)
+        self.rows = []
+
+    def close(self):
+        """ aggregate the partial last window and write everything out """
+        if self.clock.ticks > self.start:
+            self.close_window(self.clock.ticks)
+        self.flush()
+        if self.out is not None:
+            self.out.close()
+        elif self.writer is not None:
+            self.writer.close()
+        self.out = self.writer = None
+
+
+# pixels the front of a car heading h is past the near side of a zone
+FRONT = {'r': lambda c, z: c.right - z.left, 'l': lambda c, z: z.right - c.left,
+        'd': lambda c, z: c.bottom - z.top, 'u': lambda c, z: z.bottom - c.top}
+# pixels the rear of a car heading h has to go to the far side of a zone
+AWAY = {'r': lambda c, z: z.right - c.left, 'l': lambda c, z: c.right - z.left,
+        'd': lambda c, z: z.bottom - c.top, 'u': lambda c, z: c.bottom - z.top}
+
+
+def percentile(ordered, start, n, q=.95):
+    """ q-th quantile of the n values ordered from start on, interpolated
+    between the closest ranks like np.percentile """
+    at = start + q * (n - 1)
+    lo = int(at)
+    hi = min(lo + 1, start + n - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (at - lo)
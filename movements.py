@@ -0,0 +1,143 @@
+import pygame
+
+
+# Right hand traffic: heading -> heading after each kind of turn
+TURNS = {
+    'r': {'through': 'r', 'right': 'd', 'left': 'u'},
+    'l': {'through': 'l', 'right': 'u', 'left': 'd'},
+    'd': {'through': 'd', 'right': 'l', 'left': 'r'},
+    'u': {'through': 'u', 'right': 'r', 'left': 'l'},
+}
+KINDS = ('through', 'left', 'right')
+# every (heading in, kind of turn) gets an index into the conflict table
+MOVEMENTS = [(h, kind) for h in 'udlr' for kind in KINDS]
+INDEX = {m: i for i, m in enumerate(MOVEMENTS)}
+
+_tables = {} # geometry -> conflict table, shared by identical crossings
+
+
+def movement(direction, kind):
+    """ index of a car heading `direction` making a `kind` movement """
+    return INDEX[(direction, kind)]
+
+
+def lanes(zone, buffer, width=15):
+    """ heading -> the strip of the crossing zone that lane covers """
+    return {
+        'r': pygame.Rect(zone.left, zone.bottom - buffer - width, zone.w,
+                width),
+        'l': pygame.Rect(zone.left, zone.top + buffer, zone.w, width),
+        'd': pygame.Rect(zone.left + buffer, zone.top, width, zone.h),
+        'u': pygame.Rect(zone.right - buffer - width, zone.top, width, zone.h),
+    }
+
+
+def footprint(zone, lane, h, e):
+    """ rects of the crossing zone swept going from heading h to heading e:
+    the entry lane up to the far side of the exit lane, then the exit lane
+    from the entry lane on """
+    if h == e:
+        return [lane[h]]
+    into, out = lane[h], lane[e]
+    if h == 'r':
+        entry = (zone.left, into.top, out.right - zone.left, into.h)
+    elif h == 'l':
+        entry = (out.left, into.top, zone.right - out.left, into.h)
+    elif h == 'd':
+        entry = (into.left, zone.top, into.w, out.bottom - zone.top)
+    else:
+        entry = (into.left, out.top, into.w, zone.bottom - out.top)
+    if e == 'd':
+        exit = (out.left, into.top, out.w, zone.bottom - into.top)
+    elif e == 'u':
+        exit = (out.left, zone.top, out.w, into.bottom - zone.top)
+    elif e == 'r':
+        exit = (into.left, out.top, zone.right - into.left, out.h)
+    else:
+        exit = (zone.left, out.top, into.right - zone.left, out.h)
+    return [pygame.Rect(entry), pygame.Rect(exit)]
+
+
+def conflict_table(zone, buffer, width=15):
+    """ conflicts[m] has bit n set when movements m and n sweep any common
+    part of the crossing, so they can't hold overlapping slots. Computed
+    once per crossing geometry, every same sized crossing shares it """
+    key = (zone.w, zone.h, buffer, width)
+    if key not in _tables:
+        local = pygame.Rect(0, 0, zone.w, zone.h)
+        lane = lanes(local, buffer, width)
+        swept = [footprint(local, lane, h, TURNS[h][kind])
+                for h, kind in MOVEMENTS]
+        table = []
+        for a in swept:
+            mask = 0
+            for n, b in enumerate(swept):
+                if any(r.colliderect(s) for r in a for s in b):
+                    mask |= 1 << n
+            table.append(mask)
+        _tables[key] = table
+    return _tables[key]
+
+
+def turn_line(lane, h, e):
+    """ where the front of a car heading h has to get to before it turns
+    into heading e: the far side of the exit lane """
+    return {'r': lane[e].right, 'l': lane[e].left,
+            'd': lane[e].bottom, 'u': lane[e].top}[h]
+
+
+def turned(lane, h, e, length, width=15):
+    """ (x, y, w, h) of a car of `length` once it turned from h into e. It
+    sits in the exit lane with its rear at the entry lane's edge """
+    into, out = lane[h], lane[e]
+    if e == 'd':
+        return (out.left, into.top, width, length)
+    elif e == 'u':
+        return (out.left, into.bottom - length, width, length)
+    elif e == 'r':
+        return (into.left, out.top, length, width)
+    return (into.right - length, out.top, length, width)
+
+
+def crossing(zone, lane, h, e, length):
+    """ pixels the front of a car of `length` heading h drives from the
+    side of zone it comes in by until the car is clear of zone. A turning
+    car gets to the far side of the exit lane, is turned() into it and
+    drives on until its rear is out, so its length doesn't count """
+    if h == e:
+        return (zone.w if h in 'lr' else zone.h) + length
+    line = turn_line(lane, h, e)
+    turn = {'r': line - zone.left, 'l': zone.right - line,
+            'd': line - zone.top, 'u': zone.bottom - line}[h]
+    into = lane[h]
+    if e == 'd':
+        out = zone.bottom - into.top
+    elif e == 'u':
+        out = into.bottom - zone.top
+    elif e == 'r':
+        out = zone.right - into.left
+    else:
+        out = into.right - zone.left
+    return turn + out
+
+
+def ahead(rect, h, zone):
+    """ pixels the front of rect (heading h) is short of zone """
+    if h == 'r':
+        return zone.left - rect.right
+    elif h == 'l':
+        return rect.left - zone.right
+    elif h == 'd':
+        return zone.top - rect.bottom
+    return rect.top - zone.bottom
+
+
+def reached(rect, h, line):
+    """ has the front of rect (heading h) got to line """
+    if h == 'r':
+        return rect.right >= line
+    elif h == 'l':
+        return rect.left <= line
+    elif h == 'd':
+        return rect.bottom >= line
+    return rect.top <= line
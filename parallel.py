@@ -0,0 +1,247 @@
+from controller import Controller
+from movements import conflict_table, lanes
+from planner import Planner
+from simclock import SimClock
+from tiles import Tiling
+import multiprocessing
+import pygame
+
+
+class CarRecord:
+    """ What a worker knows about a car: its footprint, own and current
+    speed, length, heading and the movement it makes at its next crossing.
+    Instructions the controller sends are queued as actions for the main
+    process to apply to the real car """
+    __slots__ = ('uid', 'rect', 'vel', 'speed', 'l', 'direction',
+            'movement', 'actions')
+
+    def __init__(self, uid, x, y, w, h, vel, speed, l, direction, movement,
+            actions):
+        self.uid = uid
+        self.rect = pygame.Rect(x, y, w, h)
+        self.vel = vel
+        self.speed = speed
+        self.l = l
+        self.direction = direction
+        self.movement = movement
+        self.actions = actions
+
+    def __hash__(self):
+        return hash(self.uid)
+
+    def __eq__(self, other):
+        return self.uid == other.uid
+
+    def instruct(self, speed, until):
+        self.actions.append(('instruct', self.uid, speed, until))
+
+
+class Forwarder:
+    """ Worker side stand-in for the Recorder: the controller's decisions
+    are queued as actions, for the main process to log """
+    def reserve(self, controller, car, slot, decision):
+        car.actions.append(('reserve', car.uid, tuple(slot), decision))
+
+
+class Region:
+    """ Worker side stand-in for an Intersection, carrying just what the
+    Controller reads: the crossing, the outer boundary, the factor, the
+    movement conflict table, the tiling, the platoon settings, the
+    acceleration limit and the clock. Contained cars are kept by uid, in
+    the order they entered. With record set, the controller's decisions
+    are sent back to be logged """
+    def __init__(self, cross_zone, outer_boundary, factor, buffer, width,
+            tiles, plan_window, plan_budget, headway, platoon_size,
+            accel_step, record, clock):
+        self.cross_zone = pygame.Rect(cross_zone)
+        self.outer_boundary = pygame.Rect(outer_boundary)
+        self.factor = factor
+        self.conflicts = conflict_table(self.cross_zone, buffer, width)
+        self.lanes = lanes(self.cross_zone, buffer, width)
+        self.tiling = None
+        if tiles:
+            self.tiling = Tiling(self.cross_zone, self.lanes, tiles)
+        self.headway = headway
+        self.platoon_size = platoon_size
+        self.accel_step = accel_step
+        self.clock = clock
+        self.controller = Controller(self)
+        if plan_window:
+            self.controller.planner = Planner(self.controller, plan_window,
+                    plan_budget)
+        if record:
+            self.controller.recorder = Forwarder()
+        self.cars = {} # uid -> CarRecord
+
+    def check_entries(self, records, actions):
+        boundary = self.outer_boundary
+        for car in records:
+            if car.uid not in self.cars and car.rect.colliderect(boundary):
+                self.cars[car.uid] = car
+                actions.append(('enter', car.uid))
+                car.actions = actions
+                self.controller.reserve_spot(car)
+
+    def check_exits(self, records, actions):
+        """ in entry order, like Intersection.check_exits """
+        boundary = self.outer_boundary
+        latest = {car.uid: car for car in records}
+        for uid in [u for u in self.cars
+                if not latest[u].rect.colliderect(boundary)]:
+            self.controller.remove_reservation(self.cars.pop(uid))
+            actions.append(('exit', uid))
+
+    def plan(self, records, actions):
+        planner = self.controller.planner
+        if planner is None:
+            return 0.
+        latest = {car.uid: car for car in records}
+        for car in planner.pending: # entered on earlier ticks
+            fresh = latest[car.uid]
+            car.actions = actions
+            car.rect, car.vel, car.speed = fresh.rect, fresh.vel, fresh.speed
+        return planner.plan()
+
+    def forget(self, uid):
+        """ a contained car despawned """
+        car = self.cars.pop(uid, None)
+        if car is not None and car in self.controller.movements:
+            self.controller.remove_reservation(car)
+
+
+def worker(conn, specs, dt):
+    """ Runs the controllers of one region of the network. Each message is
+    (tick, work, forget) where work lists (intersection index, car records)
+    and forget lists (intersection index, uid) of despawned cars. Replies
+    with the enter/instruct actions and the exit actions per intersection,
+    and the delay batch planning saved """
+    clock = SimClock(dt)
+    regions = {i: Region(*spec, clock) for i, spec in specs.items()}
+    while True:
+        message = conn.recv()
+        if message is None:
+            break
+        tick, work, forget = message
+        clock.advance_to(tick)
+        for i, uid in forget:
+            regions[i].forget(uid)
+        entries, exits = [], []
+        saved = 0.
+        records = [[CarRecord(*r, None) for r in cars] for _, cars in work]
+        for (i, _), cars in zip(work, records):
+            actions = []
+            regions[i].check_entries(cars, actions)
+            saved += regions[i].plan(cars, actions)
+            entries.append((i, actions))
+        for (i, _), cars in zip(work, records):
+            actions = []
+            regions[i].check_exits(cars, actions)
+            exits.append((i, actions))
+        conn.send((entries, exits, saved))
+    conn.close()
+
+
+class WorkerPool:
+    """Runs every intersection's controller in a pool of worker processes.
+    The network is cut into bands of neighbouring intersections (whole
+    rows of a grid), one per worker, and each worker keeps the reservation
+    state of its band. Every tick the main process sends each worker the
+    cars around its active intersections; a car that drives from one band
+    into the next simply starts showing up in the other worker's share.
+
+    All entries of a tick are applied before any exit, exactly like the
+    single process step, and the replies are applied in the order the
+    intersections would run serially, so a seeded run gives the same
+    results with or without workers. Decisions of recorded runs come back
+    with the instructions and are logged in the same order as well."""
+    def __init__(self, sim, processes):
+        self.sim = sim
+        intersections = sim.intersections
+        processes = max(1, min(processes, len(intersections)))
+        band = -(-len(intersections) // processes) # ceiling division
+        self.index = {} # intersection -> index shared with the workers
+        self.owner = {} # intersection -> worker number
+        specs = [{} for _ in range(processes)]
+        for i, intersection in enumerate(intersections):
+            self.index[intersection] = i
+            self.owner[intersection] = i // band
+            specs[i // band][i] = (tuple(intersection.cross_zone),
+                    tuple(intersection.outer_boundary), intersection.factor,
+                    intersection.roads[0].buffer, sim.car_width, sim.tiles,
+                    sim.plan_window, sim.plan_budget, intersection.headway,
+                    intersection.platoon_size, intersection.accel_step,
+                    bool(sim.record))
+        self.by_index = intersections
+        self.forgotten = [[] for _ in range(processes)]
+        self.conns, self.processes = [], []
+        for spec in specs:
+            parent, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=worker,
+                    args=(child, spec, sim.sim_clock.dt), daemon=True)
+            process.start()
+            self.conns.append(parent)
+            self.processes.append(process)
+
+    def forget(self, intersection, car):
+        """ tell the owning worker a contained car despawned """
+        self.forgotten[self.owner[intersection]].append(
+                (self.index[intersection], car.uid))
+
+    def check(self, active):
+        """ check_entries/check_exits for the active intersections.
+        Returns the delay batch planning saved """
+        sim = self.sim
+        work = [[] for _ in self.conns]
+        cars = {} # uid -> car for everything sent this tick
+        for intersection in active:
+            records = []
+            seen = set()
+            for car in sim.grid.query(intersection.cells):
+                seen.add(car)
+                records.append(car)
+            records.extend(c for c in intersection.cars if c not in seen)
+            for car in records:
+                cars[car.uid] = car
+            work[self.owner[intersection]].append((self.index[intersection],
+                    [(c.uid, c.x, c.y, c.w, c.h, c.vel, c.speed, c.l,
+                    c.direction, c.movement) for c in records]))
+        tick = sim.sim_clock.ticks
+        busy = []
+        for n, conn in enumerate(self.conns):
+            if work[n] or self.forgotten[n]:
+                conn.send((tick, work[n], self.forgotten[n]))
+                self.forgotten[n] = []
+                busy.append(conn)
+        entries, exits = {}, {}
+        saved = 0.
+        for conn in busy:
+            done_entries, done_exits, done_saved = conn.recv()
+            entries.update(done_entries)
+            exits.update(done_exits)
+            saved += done_saved
+        # exits draw the cars' next movements, so keep the serial order
+        for intersection in active:
+            self.apply(intersection, entries[self.index[intersection]], cars)
+        for intersection in active:
+            self.apply(intersection, exits[self.index[intersection]], cars)
+        return saved
+
+    def apply(self, intersection, actions, cars):
+        for action in actions:
+            car = cars[action[1]]
+            if action[0] == 'enter':
+                intersection.enter(car)
+            elif action[0] == 'instruct':
+                car.instruct(action[2], action[3])
+            elif action[0] == 'exit':
+                intersection.exit(car)
+            elif action[0] == 'reserve':
+                self.sim.recorder.reserve(intersection.controller,
+                        car, *action[2:])
+
+    def close(self):
+        for conn in self.conns:
+            conn.send(None)
+        for process in self.processes:
+            process.join()
+        self.conns, self.processes = [], []
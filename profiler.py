@@ -0,0 +1,210 @@
+from array import array
+from collections import Counter
+import cProfile
+import io
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+
+
+log = logging.getLogger(__name__)
+
+
+class Profiler:
+    """Wall clock time of every phase of every tick (mark(phase) as each
+    stage finishes, end() once per tick), the last capacity ticks kept in
+    ring buffers. window: (first, last): also profile ticks first to last,
+    both included, with cProfile, or a Sampler if sampler is set; written
+    to path, or its top logged"""
+    def __init__(self, capacity=1 << 16, window=None, sampler=False,
+            path=None, refresh=30):
+        self.capacity = capacity
+        self.window = window
+        self.sampler = sampler
+        self.path = path
+        self.refresh = refresh # ticks between overlay updates
+        self.samples = {} # phase -> seconds per tick, ring buffer
+        self.current = {} # phase -> seconds so far this tick
+        self.n = 0 # ticks recorded
+        self.capture = None # cProfile.Profile or Sampler, while running
+        self.overlay = [] # rendered lines of text
+        self.font = None
+        self.last = time.perf_counter()
+
+    def attach(self, sim):
+        """ time sim's ticks from now on """
+        self.sim = sim
+        sim.profiler = self
+        if self.window and self.window[0] <= sim.sim_clock.ticks + 1:
+            self.start()
+        self.last = time.perf_counter()
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.current[phase] = self.current.get(phase, 0.) + now - self.last
+        self.last = now
+
+    def end(self, ticks):
+        """ tick number ticks is over, file its phases' times """
+        i = self.n % self.capacity
+        for phase, seconds in self.current.items():
+            buffer = self.samples.get(phase)
+            if buffer is None:
+                buffer = self.samples[phase] = array('d',
+                        bytes(8 * self.capacity))
+            buffer[i] = seconds
+            self.current[phase] = 0. # kept, so idle phases record 0
+        self.n += 1
+        if self.window:
+            if ticks + 1 == self.window[0]:
+                self.start()
+            elif ticks == self.window[1]:
+                self.stop()
+        # a stepping thread can't render text, and its ticks aren't drawn
+        if (self.sim.screen is not None and not self.sim.threaded
+                and self.n % self.refresh == 0):
+            self.update_overlay()
+        self.last = time.perf_counter() # not charging the profiler's work
+
+    def start(self):
+        if self.capture is not None:
+            return
+        self.capture = Sampler() if self.sampler else cProfile.Profile()
+        self.capture.enable()
+
+    def stop(self):
+        """ end the capture and write or log it """
+        capture, self.capture = self.capture, None
+        if capture is None:
+            return
+        capture.disable()
+        if self.sampler:
+            if self.path:
+                capture.dump(self.path)
+            else:
+                log.info('most sampled stacks:\n%s', capture.top())
+        elif self.path:
+            capture.dump_stats(self.path)
+        else:
+            text = io.StringIO()
+            pstats.Stats(capture, stream=text).sort_stats(
+                    'cumulative').print_stats(25)
+            log.info(text.getvalue())
+        log.info('profile of ticks %d to %d captured', *self.window)
+
+    def report(self, last=None):
+        """ [(phase, mean, median, 95th and 99th percentile, max, share of
+        the tick)] over the last ticks recorded (all that are kept by
+        default), seconds. A 'tick' row totals the phases """
+        n = min(self.n, self.capacity, last or self.capacity)
+        if not n:
+            return []
+        end = self.n % self.capacity
+        columns = {}
+        for phase, buffer in self.samples.items():
+            if end >= n:
+                columns[phase] = buffer[end - n:end].tolist()
+            else: # wrapped around the end of the buffer
+                columns[phase] = (buffer[end - n:].tolist()
+                        + buffer[:end].tolist())
+        columns['tick'] = [sum(t) for t in zip(*columns.values())]
+        total = sum(columns['tick']) or 1.
+        rows = []
+        for phase, values in columns.items():
+            ranked = sorted(values)
+            rank = lambda q: ranked[min(n - 1, int(q * n))]
+            rows.append((phase, sum(values) / n, rank(.5), rank(.95),
+                    rank(.99), ranked[-1], sum(values) / total))
+        return rows
+
+    def update_overlay(self):
+        if self.font is None:
+            import pygame
+            self.font = pygame.font.SysFont('dejavusans', 14)
+        self.overlay = [self.font.render(line, True, (255, 255, 0))
+                for line in table(self.report(self.refresh * 10))]
+
+    def draw(self, screen):
+        """ the overlay, top right of the frame. Returns the rects drawn """
+        drawn = []
+        y = 0
+        for line in self.overlay:
+            drawn.append(screen.blit(line,
+                    (screen.get_width() - line.get_width() - 4, y)))
+            y += line.get_height()
+        return drawn
+
+    def close(self):
+        self.stop()
+        if self.n:
+            log.info('per tick time by phase, %d ticks:\n%s',
+                    min(self.n, self.capacity),
+                    '\n'.join(table(self.report())))
+
+
+def table(rows):
+    """ report rows as lines of text, milliseconds """
+    lines = ['%-13s %7s %7s %7s %7s %7s %5s' % ('phase', 'mean', 'p50',
+            'p95', 'p99', 'max', '%')]
+    for phase, *times, share in rows:
+        lines.append('%-13s %7.3f %7.3f %7.3f %7.3f %7.3f %5.1f' % (
+                phase, *(1000 * t for t in times), 100 * share))
+    return lines
+
+
+class Sampler:
+    """Statistical profiler: a background thread looks at the stack of the
+    thread that enabled it every interval seconds and counts the stacks
+    seen, costing the profiled thread next to nothing. Samples are only
+    taken when the interpreter switches threads, at most every
+    sys.getswitchinterval() seconds (5 ms by default)"""
+    def __init__(self, interval=.001):
+        self.interval = interval
+        self.stacks = Counter() # folded stack -> samples
+        self.running = False
+        self.thread = None
+
+    def enable(self):
+        self.target = threading.get_ident()
+        self.running = True
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+        self.thread.start()
+
+    def disable(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def sample(self):
+        while self.running:
+            frame = sys._current_frames().get(self.target)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('%s (%s:%d)' % (code.co_name,
+                        os.path.basename(code.co_filename),
+                        code.co_firstlineno))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+            time.sleep(self.interval)
+
+    def dump(self, path):
+        """ one 'outer;...;inner count' line per stack, the folded format
+        flame graph tools read """
+        with open(path, 'w') as out:
+            for stack, count in self.stacks.most_common():
+                out.write('%s %d\n' % (stack, count))
+
+    def top(self, n=20):
+        """ the innermost functions seen most, as text """
+        leaves = Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(';', 1)[-1]] += count
+        total = sum(leaves.values()) or 1
+        return '\n'.join('%6.1f%% %s' % (100 * count / total, leaf)
+                for leaf, count in leaves.most_common(n))
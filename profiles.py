@@ -0,0 +1,90 @@
+from math import ceil, sqrt
+
+
+def ramp(speed, target, step):
+    """ speed after one tick of changing toward target by at most step
+    (pixels per tick, per tick). No step means no limit """
+    if not step or abs(target - speed) <= step:
+        return target
+    return speed + step if target > speed else speed - step
+
+
+def ramp_ticks(speed, target, step):
+    """ ticks ramp() takes to get from speed to target """
+    if not step or speed == target:
+        return 0
+    return max(1, ceil(abs(target - speed) / step))
+
+
+def distance(v0, v1, v2, ticks, step):
+    """ pixels covered in ticks going v0 -> v1, holding v1, then v1 -> v2
+    at the end, changing speed by step per tick """
+    n1 = abs(v1 - v0) / step
+    n2 = abs(v2 - v1) / step
+    return (v0 + v1) / 2 * n1 + v1 * (ticks - n1 - n2) + (v1 + v2) / 2 * n2
+
+
+def segments(d, ticks, v0, v2, step):
+    """Plan a trapezoid speed profile covering d pixels in ticks, starting
+    at speed v0 and ending at v2: ramp to a cruising speed v1, hold it,
+    and ramp to v2 just in time. Returns [(v1, tick it's held until),
+    (v2, ticks)], ticks counted from the start of the profile.
+
+    v1 is found by bisection, the distance grows with it. If d can't be
+    covered in time with the ramps allowed, the closest profile is used
+    and the car arrives a little off. No step means instant changes: one
+    segment at the average speed"""
+    if not step:
+        return [(d / ticks, ticks)]
+    # v1 must leave time for both ramps: |v1 - v0| + |v1 - v2| <= step*ticks
+    lo = max(0., (v0 + v2 - step * ticks) / 2)
+    hi = (v0 + v2 + step * ticks) / 2
+    for _ in range(40):
+        v1 = (lo + hi) / 2
+        if distance(v0, v1, v2, ticks, step) < d:
+            lo = v1
+        else:
+            hi = v1
+    v1 = (lo + hi) / 2
+    down = min(ticks, ramp_ticks(v1, v2, step))
+    return [(v1, ticks - down), (v2, ticks)]
+
+
+def arrival(d, v0, v2, step):
+    """ ticks to cover d pixels left alone: ramping from v0 to v2 and
+    holding it, the way a car with no instructions goes back to its own
+    speed """
+    if not step:
+        return d / v2
+    n = abs(v2 - v0) / step
+    ramped = (v0 + v2) / 2 * n
+    if ramped >= d: # still ramping when it gets there
+        a = step if v2 > v0 else -step
+        return (sqrt(v0 * v0 + 2 * a * d) - v0) / a
+    return n + (d - ramped) / v2
+
+
+def reach(d, v0, v2, step, top=float('inf')):
+    """ (earliest, latest) ticks a profile from segments() can cover d
+    pixels in, starting at v0 and ending at v2: with one ramp up and one
+    down, or the other way round, going no faster than top (at least v0
+    and v2). latest is inf when there's room to stop and set off again.
+    No step means any time at least d / top, and a car that can't even
+    get to v2 by then only has the time it takes anyway """
+    if not step:
+        return max(0., d / top), float('inf')
+    # a triangle through v1 covers (2*v1**2 - v0**2 - v2**2) / (2*step)
+    # going up first and (v0**2 + v2**2 - 2*v1**2) / (2*step) going down
+    peak = sqrt((2 * step * d + v0 * v0 + v2 * v2) / 2)
+    if peak < max(v0, v2):
+        natural = arrival(d, v0, v2, step)
+        return natural, natural
+    if peak > top: # up to top, on at top, and down again
+        ramps = (2 * top * top - v0 * v0 - v2 * v2) / (2 * step)
+        earliest = (2 * top - v0 - v2) / step + (d - ramps) / top
+    else:
+        earliest = max(0., (2 * peak - v0 - v2) / step)
+    low = (v0 * v0 + v2 * v2 - 2 * step * d) / 2
+    if low <= 0: # can stop on the way
+        return earliest, float('inf')
+    return earliest, max(earliest, (v0 + v2 - 2 * sqrt(low)) / step)
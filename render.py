@@ -0,0 +1,78 @@
+from collections import namedtuple
+import pygame
+
+
+# what one tick looks like: its number, and every car's (x, y, w, h, color)
+Snapshot = namedtuple('Snapshot', 'tick cars')
+
+
+def snapshot(tick, cars):
+    """ an immutable copy of the cars' looks at tick, safe to hand to
+    another thread while the cars move on """
+    return Snapshot(tick, tuple([(c.x, c.y, c.w, c.h, c.color)
+            for c in cars]))
+
+
+def background(surface, roads, intersections):
+    """ draw the parts of a frame that never move onto surface """
+    surface.fill((0,0,0))
+    for road in roads:
+        road.render(surface)
+    for intersection in intersections:
+        intersection.render(surface)
+    return surface
+
+
+class Renderer:
+    """Draws frames by touching only what changed since the last one.
+
+    Roads, intersection outlines and the restart message never move, so
+    they are drawn once onto a background surface. Each frame the rects
+    drawn over it the frame before are restored from the background, every
+    car is blitted from a cached solid sprite of its size and colour in a
+    single Surface.blits() call, and only the rects erased and drawn are
+    pushed to the display. The cost per frame follows the number of cars
+    instead of the size of the window"""
+    def __init__(self, screen, roads, intersections, message):
+        self.screen = screen
+        self.background = background(screen.copy(), roads, intersections)
+        self.background.blit(message, (0,0))
+        self.sprites = {} # (w, h, color) -> solid surface
+        self.drawn = [] # rects drawn over the background last frame
+        self.full = True # the first frame shows the whole background
+
+    def sprite(self, key):
+        w, h, color = key
+        surface = pygame.Surface((w, h)).convert(self.screen)
+        surface.fill(color)
+        self.sprites[key] = surface
+        return surface
+
+    def draw(self, snapshot, profiler=None):
+        """ one frame of snapshot's cars. profiler, if given, has the
+        phases marked and its overlay drawn """
+        screen, background = self.screen, self.background
+        erased = self.drawn
+        if self.full:
+            screen.blit(background, (0,0))
+        else:
+            screen.blits([(background, r, r) for r in erased], False)
+        if profiler is not None:
+            profiler.mark('background')
+        sprites = self.sprites
+        batch = []
+        for x, y, w, h, color in snapshot.cars:
+            key = (w, h, color)
+            batch.append((sprites.get(key) or self.sprite(key), (x, y)))
+        drawn = screen.blits(batch)
+        if profiler is not None:
+            drawn.extend(profiler.draw(screen))
+            profiler.mark('cars')
+        if self.full:
+            pygame.display.update()
+            self.full = False
+        else:
+            pygame.display.update(erased + drawn)
+        if profiler is not None:
+            profiler.mark('display')
+        self.drawn = drawn
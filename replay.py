@@ -0,0 +1,304 @@
+from bisect import bisect_right
+from profiles import ramp
+import json
+import struct
+import pygame
+
+
+MAGIC = b'SIMLOG1\0'
+HEADER = struct.Struct('<dIII') # dt, width, height, params json length
+# kind, code, flags, tick, uid, six values. Every record is this wide
+RECORD = struct.Struct('<BBHII6d')
+INDEX = struct.Struct('<IQ') # keyframe tick, byte offset of its record
+
+# record kinds
+SPAWN, DESPAWN, ENTER, EXIT, RESERVE, INSTRUCT, SPEED, KEYFRAME, STATE, \
+        TURN = range(10)
+# RESERVE codes: what the controller decided
+DECISIONS = ['requested', 'sped up', 'slowed', 'platooned']
+
+DIRECTIONS = 'udlr' # direction <-> code byte
+ENTERED = 1 # STATE flag: car is inside an outer boundary (drawn red)
+
+
+class Recorder:
+    """Writes a run to an append-only log of fixed width records: spawns,
+    boundary entries and exits, controller decisions (granted slots and
+    speed instructions), speed changes, turns and despawns, in the order they
+    happen. Every keyframe_every ticks the full car state (a STATE record
+    per car, each followed by its queued instructions) follows a KEYFRAME
+    record and the keyframe's offset goes into an index file
+    (path + '.idx'), so a Replayer can seek without replaying from the
+    start. states=True also writes every car's state every tick.
+
+    Records are buffered and written out in bulk at each keyframe"""
+    def __init__(self, path, keyframe_every=300, states=False):
+        self.path = path
+        self.keyframe_every = keyframe_every
+        self.states = states
+        self.buffer = bytearray()
+        self.offset = 0
+        self.out = None
+
+    def attach(self, sim):
+        """ start recording sim, after object_init """
+        self.sim = sim
+        params = {'seed': sim.seed, 'speed_limit': sim.speed_limit,
+                'spawn_interval': sim.spawn_interval,
+                'car_lengths': list(sim.car_lengths), 'factor': sim.factor,
+                'grid': sim.network, 'fleet': sim.use_fleet,
+                'events': sim.use_events, 'accel': sim.accel,
+                'demand': sim.demand_streams, 'arrivals': sim.arrivals,
+                'road_width': sim.road_width, 'car_width': sim.car_width}
+        blob = json.dumps(params).encode()
+        self.out = open(self.path, 'wb')
+        self.index = open(self.path + '.idx', 'wb')
+        self.out.write(MAGIC + HEADER.pack(sim.sim_clock.dt, sim.WIDTH,
+                sim.HEIGHT, len(blob)) + blob)
+        self.offset = self.out.tell()
+        self.intersections = {x: i for i, x in enumerate(sim.intersections)}
+        for intersection in sim.intersections:
+            intersection.controller.recorder = self
+        sim.recorder = self
+        sim.observers.append(self.end_tick)
+
+    def write(self, kind, uid, a=0., b=0., c=0., d=0., e=0., f=0., code=0,
+            flags=0):
+        self.buffer += RECORD.pack(kind, code, flags,
+                self.sim.sim_clock.ticks, uid, a, b, c, d, e, f)
+
+    def spawn(self, car):
+        self.write(SPAWN, car.uid, car.x, car.y, car.vel, car.l,
+                code=DIRECTIONS.index(car.direction))
+
+    def despawn(self, car):
+        self.write(DESPAWN, car.uid)
+
+    def enter(self, intersection, car):
+        self.write(ENTER, car.uid, self.intersections[intersection])
+
+    def exit(self, intersection, car):
+        self.write(EXIT, car.uid, self.intersections[intersection])
+
+    def reserve(self, controller, car, request, decision):
+        self.write(RESERVE, car.uid,
+                self.intersections[controller.intersection], *request,
+                code=DECISIONS.index(decision))
+
+    def instruct(self, car, speed, until):
+        self.write(INSTRUCT, car.uid, speed, until)
+
+    def speed(self, car):
+        self.write(SPEED, car.uid, car.vel)
+
+    def turn(self, car):
+        self.write(TURN, car.uid, car.x, car.y, car.w, car.h,
+                code=DIRECTIONS.index(car.direction))
+
+    def car_state(self, car):
+        """ STATE, then the car's instruction queue as INSTRUCT records """
+        self.write(STATE, car.uid, car.x, car.y, car.vel, car.l, car.speed,
+                code=DIRECTIONS.index(car.direction),
+                flags=ENTERED if car.color == (250,0,0) else 0)
+        for speed, until in car.speed_instructions:
+            self.instruct(car, speed, until)
+
+    def end_tick(self, sim):
+        """ observer: per tick states and periodic keyframes """
+        tick = sim.sim_clock.ticks
+        keyframe = tick % self.keyframe_every == 0
+        if sim.fleet is not None and (keyframe or self.states):
+            sim.fleet.sync() # every car's position, not just those near
+        if keyframe:
+            self.flush()
+            self.index.write(INDEX.pack(tick, self.offset))
+            self.write(KEYFRAME, sum(1 + len(car.speed_instructions)
+                    for car in sim.cars))
+            for car in sim.cars:
+                self.car_state(car)
+            self.flush()
+        elif self.states:
+            for car in sim.cars:
+                self.car_state(car)
+
+    def flush(self):
+        self.out.write(self.buffer)
+        self.offset += len(self.buffer)
+        self.buffer.clear()
+
+    def close(self):
+        if self.out is not None:
+            self.flush()
+            self.out.close()
+            self.index.close()
+            self.out = None
+
+
+class ReplayCar:
+    """ A car rebuilt from the log. Kept on a pygame Rect so positions go
+    through the same rounding as a live Car """
+    __slots__ = ('uid', 'rect', 'vel', 'speed', 'l', 'direction',
+            'instructions', 'color')
+
+    def __init__(self, uid, x, y, vel, l, direction, width=15):
+        self.uid = uid
+        self.vel = vel
+        self.speed = vel
+        self.l = l
+        self.direction = direction
+        self.instructions = []
+        self.color = (0,250,0)
+        if direction in ['d', 'u']:
+            self.rect = pygame.Rect(0, 0, width, l)
+        else:
+            self.rect = pygame.Rect(0, 0, l, width)
+        self.rect.x, self.rect.y = x, y
+
+    def update(self, now, step):
+        """ the same steps Car.update takes """
+        instructions = self.instructions
+        while instructions and now > instructions[0][1]:
+            instructions.pop(0)
+        target = instructions[0][0] if instructions else self.vel
+        vel = self.speed = ramp(self.speed, target, step)
+        if self.direction == 'r':
+            self.rect.x += vel
+        elif self.direction == 'd':
+            self.rect.y += vel
+        elif self.direction == 'l':
+            self.rect.x -= vel
+        elif self.direction == 'u':
+            self.rect.y -= vel
+
+
+class Replayer:
+    """Rebuilds the cars of a recorded run at any tick.
+    seek() starts from the latest keyframe at or before the tick (found in
+    the index) and replays the records after it, moving cars the way
+    Car.update does. The fleet store moves cars differently, so fleet runs
+    are recorded with states=True, whose per tick states overwrite the
+    cars. Event runs skip ticks and can't be recorded."""
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.data = f.read()
+        if not self.data.startswith(MAGIC):
+            raise ValueError('%s is not a simulation log' % path)
+        start = len(MAGIC)
+        self.dt, self.WIDTH, self.HEIGHT, n = HEADER.unpack_from(
+                self.data, start)
+        start += HEADER.size
+        self.params = json.loads(self.data[start:start + n])
+        self.accel_step = self.params.get('accel', 0) * self.dt ** 2
+        self.car_width = self.params.get('car_width', 15)
+        self.start = start + n
+        self.keyframes = [] # (tick, offset)
+        try:
+            with open(path + '.idx', 'rb') as f:
+                self.keyframes = list(INDEX.iter_unpack(f.read()))
+        except FileNotFoundError:
+            pass # no index, every seek replays from the start
+        self.ticks = [k[0] for k in self.keyframes]
+        self.cars = {}
+        self.tick = 0
+        self.offset = self.start
+
+    def records(self, offset):
+        """ (offset of the next record, record) from offset on """
+        data, size = self.data, RECORD.size
+        for at in range(offset, len(data) - size + 1, size):
+            yield at + size, RECORD.unpack_from(data, at)
+
+    def last_tick(self):
+        if len(self.data) - self.start < RECORD.size:
+            return 0
+        return RECORD.unpack_from(self.data, len(self.data) - RECORD.size)[3]
+
+    def load_keyframe(self, offset):
+        records = self.records(offset)
+        _, (_, _, _, tick, count, *_) = next(records)
+        self.cars = {}
+        self.tick = tick
+        self.offset = offset + RECORD.size * (count + 1)
+        for _, record in records:
+            if count == 0:
+                break
+            count -= 1
+            if record[0] == STATE:
+                self.state(record)
+            else: # INSTRUCT, queued behind the car's STATE
+                self.cars[record[4]].instructions.append(record[5:7])
+
+    def state(self, record):
+        """ a car's state, its instructions follow as INSTRUCT records """
+        _, code, flags, _, uid, x, y, vel, l, speed, _ = record
+        car = self.cars.get(uid)
+        if car is None:
+            car = self.cars[uid] = ReplayCar(uid, x, y, vel, l,
+                    DIRECTIONS[code], self.car_width)
+        car.direction = DIRECTIONS[code]
+        if car.direction in ['d', 'u']:
+            car.rect.size = (self.car_width, l)
+        else:
+            car.rect.size = (l, self.car_width)
+        car.rect.x, car.rect.y = x, y
+        car.vel = vel
+        car.speed = speed
+        car.instructions = []
+        car.color = (250,0,0) if flags & ENTERED else (0,250,0)
+
+    def seek(self, tick):
+        """ cars (uid -> ReplayCar) as they were at the end of tick """
+        if tick < self.tick:
+            self.cars, self.tick, self.offset = {}, 0, self.start
+        i = bisect_right(self.ticks, tick) - 1
+        if i >= 0 and self.ticks[i] > self.tick:
+            self.load_keyframe(self.keyframes[i][1])
+        while self.tick < tick:
+            self.step()
+        return self.cars
+
+    def step(self):
+        """ replay one tick """
+        self.tick += 1
+        now = self.tick * self.dt
+        pending = []
+        offset = self.offset
+        for offset, record in self.records(self.offset):
+            if record[3] > self.tick:
+                offset -= RECORD.size
+                break
+            if record[0] == SPAWN: # spawned cars drive their first tick
+                _, code, _, _, uid, x, y, vel, l, _, _ = record
+                self.cars[uid] = ReplayCar(uid, x, y, vel, l,
+                        DIRECTIONS[code], self.car_width)
+            elif record[0] == KEYFRAME:
+                continue
+            else:
+                pending.append(record)
+        self.offset = offset
+        for car in self.cars.values():
+            car.update(now, self.accel_step)
+        for record in pending:
+            kind, uid = record[0], record[4]
+            if kind == DESPAWN:
+                del self.cars[uid]
+            elif kind == ENTER:
+                self.cars[uid].color = (250,0,0)
+            elif kind == EXIT:
+                self.cars[uid].color = (0,250,0)
+            elif kind == INSTRUCT:
+                self.cars[uid].instructions.append(record[5:7])
+            elif kind == SPEED:
+                self.cars[uid].vel = record[5]
+            elif kind == TURN:
+                car = self.cars[uid]
+                car.rect = pygame.Rect(record[5:9])
+                car.direction = DIRECTIONS[record[1]]
+            elif kind == STATE:
+                self.state(record)
+
+    def frames(self, start=0, stop=None, stride=1):
+        """ yield (tick, cars) every stride ticks from start to stop """
+        stop = self.last_tick() if stop is None else stop
+        for tick in range(start, stop + 1, stride):
+            yield tick, self.seek(tick)
@@ -0,0 +1,213 @@
+from bisect import bisect_left, bisect_right
+from itertools import count
+
+
+INF = float('inf')
+ALL = -1 # mask picking every movement kind
+LOAD = 32 # slots per block; a block past twice this splits in two
+
+
+class ReservationBook:
+    """Time slots (start, end) reserved by owners (cars) for a movement
+    kind, kept sorted by start time in blocks of a few dozen, so every query
+    is located by bisection over the blocks instead of a scan.
+
+    Two slots conflict when end1 >= start2 and end2 > start1, the same test
+    the controller always used. Queries take a mask of the kinds that count
+    (bit k for kind k, all of them by default). Each block keeps its latest
+    end, the latest end of it and every block before (so a query starts at
+    the first block reaching into its window, however long the slots are),
+    and per mask the first start, latest end and widest free gap of the
+    slots it picks, so busy stretches are skipped a block at a time."""
+    def __init__(self):
+        self._blocks = [] # lists of (start, seq, end, owner, kind) in order
+        self._firsts = [] # (start, seq) of each block's first slot
+        self._ends = [] # latest end in each block
+        self._reach = [] # latest end in each block or any before it
+        self._summaries = [] # per block, mask -> (first, latest, widest)
+        self._owners = {} # owner -> (start, seq, end, owner, kind)
+        self._seq = count() # tie breaker for equal start times
+
+    def __len__(self):
+        return len(self._owners)
+
+    def __contains__(self, owner):
+        return owner in self._owners
+
+    def __iter__(self):
+        """ (start, end, owner) in time order """
+        for block in self._blocks:
+            for start, _, end, owner, _ in block:
+                yield start, end, owner
+
+    def get(self, owner, default=None):
+        entry = self._owners.get(owner)
+        if entry is None:
+            return default
+        return entry[0], entry[2]
+
+    def add(self, owner, start, end, kind=0):
+        """ book [start, end] for owner's movement kind, replacing any
+        previous booking """
+        if owner in self._owners:
+            self.remove(owner)
+        entry = (start, next(self._seq), end, owner, kind)
+        self._owners[owner] = entry
+        if not self._blocks:
+            self._blocks.append([entry])
+            self._firsts.append(entry[:2])
+            self._ends.append(end)
+            self._reach.append(end)
+            self._summaries.append({})
+            return
+        b = max(bisect_right(self._firsts, entry[:2]) - 1, 0)
+        block = self._blocks[b]
+        block.insert(bisect_right(block, entry[:2]), entry)
+        self._firsts[b] = block[0][:2]
+        self._ends[b] = max(self._ends[b], end)
+        self._summaries[b] = {}
+        if len(block) > 2 * LOAD:
+            self._split(b)
+        self._spread(b)
+
+    def remove(self, owner):
+        """ drop owner's booking and return its (start, end).
+        Raises KeyError if owner has none """
+        entry = self._owners.pop(owner)
+        b = bisect_right(self._firsts, entry[:2]) - 1
+        block = self._blocks[b]
+        del block[bisect_left(block, entry[:2])]
+        if not block:
+            for column in (self._blocks, self._firsts, self._ends,
+                    self._reach, self._summaries):
+                del column[b]
+        else:
+            self._firsts[b] = block[0][:2]
+            if entry[2] == self._ends[b]:
+                self._ends[b] = max(e[2] for e in block)
+            self._summaries[b] = {}
+        if b < len(self._blocks):
+            self._spread(b)
+        return entry[0], entry[2]
+
+    def _split(self, b):
+        """ cut block b in two halves """
+        block = self._blocks[b]
+        half = block[LOAD:]
+        del block[LOAD:]
+        self._blocks.insert(b + 1, half)
+        self._firsts.insert(b + 1, half[0][:2])
+        self._ends[b] = max(e[2] for e in block)
+        self._ends.insert(b + 1, max(e[2] for e in half))
+        self._reach.insert(b + 1, None) # filled in by _spread
+        self._summaries[b] = {}
+        self._summaries.insert(b + 1, {})
+
+    def _spread(self, b):
+        """ bring the running latest end up to date from block b on, as
+        far as it changed """
+        reach = self._reach[b - 1] if b else -INF
+        for i in range(b, len(self._ends)):
+            reach = max(reach, self._ends[i])
+            if i > b and self._reach[i] == reach:
+                break
+            self._reach[i] = reach
+
+    def _summary(self, b, mask):
+        """ first start, latest end and widest free gap between the slots
+        of block b that mask picks, worked out once per change of the
+        block. The gap only counts from the block's own slots, so an
+        earlier one reaching into the block can only narrow it """
+        summaries = self._summaries[b]
+        summary = summaries.get(mask)
+        if summary is None:
+            first = None
+            latest = widest = -INF
+            for s, _, e, _, kind in self._blocks[b]:
+                if not mask >> kind & 1:
+                    continue
+                if first is None:
+                    first = s
+                elif s - latest > widest:
+                    widest = s - latest
+                if e > latest:
+                    latest = e
+            summary = summaries[mask] = (INF if first is None else first,
+                    latest, widest)
+        return summary
+
+    def _window(self, start, end):
+        """ indices of the blocks that could hold slots touching
+        [start, end]: from the first reaching past start to the last
+        starting by end """
+        lo = bisect_right(self._reach, start)
+        hi = bisect_right(self._firsts, (end, INF))
+        return range(lo, hi)
+
+    def overlapping(self, start, end, mask=ALL):
+        """ (start, end, owner) of every slot mask picks conflicting with
+        [start, end], in time order """
+        found = []
+        for b in self._window(start, end):
+            if self._ends[b] <= start:
+                continue
+            for s, _, e, owner, kind in self._blocks[b]:
+                if s > end:
+                    break
+                if e > start and mask >> kind & 1:
+                    found.append((s, e, owner))
+        return found
+
+    def overlaps(self, start, end, mask=ALL):
+        for b in self._window(start, end):
+            if self._ends[b] <= start:
+                continue
+            for s, _, e, _, kind in self._blocks[b]:
+                if s > end:
+                    break
+                if e > start and mask >> kind & 1:
+                    return True
+        return False
+
+    def free_since(self, t, default, mask=ALL):
+        """ latest end among the slots mask picks starting before t, i.e.
+        where the free time directly in front of t begins. default if none
+        of them ends later """
+        latest = default
+        last = bisect_left(self._firsts, (t,)) # blocks starting before t
+        for b in range(last - 1, -1, -1): # back from t
+            if self._reach[b] <= latest: # nothing this early ends later
+                break
+            if self._ends[b] <= latest:
+                continue
+            if b < last - 1: # the whole block starts before t
+                latest = max(latest, self._summary(b, mask)[1])
+                continue
+            for s, _, e, _, kind in self._blocks[b]:
+                if s >= t:
+                    break
+                if e > latest and mask >> kind & 1:
+                    latest = e
+        return latest
+
+    def earliest_gap(self, after, length, mask=ALL):
+        """ earliest t >= after with [t, t + length] free of the slots mask
+        picks. Bisects to the first block reaching past `after`, skips the
+        blocks of the busy run that have no gap wide enough, and walks the
+        one that has """
+        t = after
+        for b in range(bisect_right(self._reach, t), len(self._blocks)):
+            first, latest, widest = self._summary(b, mask)
+            if first == INF: # none of its slots count
+                continue
+            if first > t + length: # every later slot starts later still
+                break
+            if widest <= length: # no room between its slots
+                t = max(t, latest)
+                continue
+            for s, _, e, _, kind in self._blocks[b]:
+                if s > t + length:
+                    return t
+                if e > t and mask >> kind & 1:
+                    t = e # slot reaches into the candidate, move past it
+        return t
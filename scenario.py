@@ -0,0 +1,182 @@
+import json
+import os
+
+
+def number(low=0., integer=False, above=False):
+    """ check for a number >= low (> low with above set) """
+    def check(value):
+        kinds = int if integer else (int, float)
+        if (isinstance(value, bool) or not isinstance(value, kinds)
+                or value < low or above and value == low):
+            raise ValueError('expected %s %s %g' % (
+                    'an integer' if integer else 'a number',
+                    '>' if above else '>=', low))
+        return value
+    return check
+
+
+def numbers(count=None, item=number()):
+    """ check for a list of count (any, by default) items, as a tuple """
+    def check(value):
+        if not isinstance(value, list) or count and len(value) != count:
+            raise ValueError('expected a list of %s' % (count or 'numbers'))
+        return tuple(item(v) for v in value)
+    return check
+
+
+def flag(value):
+    if not isinstance(value, bool):
+        raise ValueError('expected true or false')
+    return value
+
+
+def text(value):
+    if not isinstance(value, str):
+        raise ValueError('expected a string')
+    return value
+
+
+def streams(value):
+    """ [[approach, process]], the approaches checked against the road
+    layout by load() """
+    from demand import process # needs numpy, as demand does anyway
+    if not isinstance(value, list) or not all(isinstance(v, list)
+            and len(v) == 2 and all(isinstance(s, str) for s in v)
+            for v in value):
+        raise ValueError('expected a list of [approach, process] pairs')
+    for n, (_, spec) in enumerate(value, 1):
+        try:
+            process(spec)
+        except ValueError as error:
+            raise ValueError('entry %d (%r): %s' % (n, spec, error)) from None
+    return [tuple(v) for v in value]
+
+
+# section -> key -> (Simulation keyword, check). Run lengths aren't a
+# Simulation keyword, 'duration' is kept apart
+SCHEMA = {
+    'world': {
+        'size': ('size', numbers(2, number(1, integer=True))),
+        'fps': ('fps', number(1, integer=True)),
+    },
+    'network': {
+        'grid': ('grid', numbers(2, number(1, integer=True))),
+        'spacing': ('spacing', number(1, integer=True)),
+        'road_width': ('road_width', number(1, integer=True)),
+        'factor': ('factor', number(.5)),
+    },
+    'cars': {
+        'width': ('car_width', number(1, integer=True)),
+        'lengths': ('car_lengths', numbers(item=number(1, integer=True))),
+        'speed_limit': ('speed_limit', number(6, integer=True)),
+        'accel': ('accel', number()),
+        'follow': ('follow', flag),
+        'safety': ('safety', flag),
+    },
+    'demand': {
+        'spawn_interval': ('spawn_interval', number(above=True)),
+        'turns': ('turn_mix', numbers(3)),
+        'streams': ('demand', streams),
+        'arrivals': ('arrivals', text),
+    },
+    'controller': {
+        'tiles': ('tiles', number(integer=True)),
+        'plan_window': ('plan_window', number()),
+        'plan_budget': ('plan_budget', number(1, integer=True)),
+        'platoon_headway': ('platoon_headway', number()),
+        'platoon_size': ('platoon_size', number(1, integer=True)),
+    },
+    'run': {
+        'seed': ('seed', number(integer=True)),
+        'duration': ('duration', number(above=True)),
+        'headless': ('headless', flag),
+        'fleet': ('fleet', flag),
+        'events': ('events', flag),
+        'workers': ('workers', number(integer=True)),
+        'record': ('record', text),
+        'metrics': ('metrics', text),
+        'metrics_window': ('metrics_window', number(above=True)),
+    },
+}
+
+
+def read(path):
+    """ the raw tables of a .toml or .json file """
+    if path.endswith('.toml'):
+        try:
+            import tomllib # python 3.11
+        except ImportError:
+            try:
+                import tomli as tomllib
+            except ImportError:
+                raise ImportError('%s: reading TOML before python 3.11 '
+                        'needs tomli (pip install tomli), or use JSON'
+                        % path) from None
+        with open(path, 'rb') as f:
+            return tomllib.load(f)
+    with open(path) as f:
+        return json.load(f)
+
+
+def load(path):
+    """ (Simulation keywords, duration or None) a scenario file describes,
+    every value checked. Unknown sections or keys and bad values raise a
+    ValueError naming them. Paths in the file (arrivals, record,
+    metrics) are taken relative to the file
+
+    e.g. (TOML; JSON has the same tables as objects)
+        [network]
+        grid = [2, 2]
+        [cars]
+        lengths = [20, 40]
+        [demand]
+        streams = [["*", "poisson:900"]]
+        [run]
+        seed = 1
+        duration = 600
+    """
+    tables = read(path)
+    if not isinstance(tables, dict):
+        raise ValueError('%s: expected tables of settings' % path)
+    here = os.path.dirname(os.path.abspath(path))
+    options = {}
+    for section, table in tables.items():
+        keys = SCHEMA.get(section)
+        if keys is None:
+            raise ValueError('%s: unknown section [%s], expected one of %s'
+                    % (path, section, ', '.join(SCHEMA)))
+        if not isinstance(table, dict):
+            raise ValueError('%s: [%s] should be a table' % (path, section))
+        for key, value in table.items():
+            if key not in keys:
+                raise ValueError('%s: unknown key %r in [%s], expected one '
+                        'of %s' % (path, key, section, ', '.join(keys)))
+            name, check = keys[key]
+            try:
+                options[name] = check(value)
+            except ValueError as error:
+                raise ValueError('%s: [%s] %s: %s' % (path, section, key,
+                        error)) from None
+    for name in ('arrivals', 'record', 'metrics'):
+        if name in options:
+            options[name] = os.path.join(here, options[name])
+    lengths = options.get('car_lengths')
+    if lengths is not None and not lengths:
+        raise ValueError('%s: [cars] lengths: expected at least one' % path)
+    if 'demand' in options:
+        from demand import approaches, select
+        # roads as object_init lays them out: a grid's rows, horizontal,
+        # then its columns, or one of each
+        rows, cols = options.get('grid', (1, 1))
+        ways = approaches('h' * rows + 'v' * cols)
+        for n, (where, _) in enumerate(options['demand'], 1):
+            try:
+                select(where, ways)
+            except ValueError as error:
+                raise ValueError('%s: [demand] streams: entry %d (%r): %s'
+                        % (path, n, where, error)) from None
+    width = options.get('car_width', 15)
+    if (options.get('road_width', 50) - 2 * width) // 4 < 0:
+        raise ValueError('%s: [network] road_width: two cars of width %d '
+                'don\'t fit side by side' % (path, width))
+    return options, options.pop('duration', None)
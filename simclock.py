@@ -0,0 +1,45 @@
+class SimClock:
+    """Fixed timestep simulation clock.
+    Time only moves when tick() is called, so a headless run advances as
+    fast as the CPU allows and an on-screen run advances once per frame.
+    dt: float: seconds of simulated time per tick"""
+    def __init__(self, dt):
+        self.dt = dt
+        self.ticks = 0
+        self.now = 0.0 # simulated time in seconds
+
+    def tick(self, n=1):
+        """ advance n ticks and return the new simulated time """
+        self.ticks += n
+        self.now = self.ticks * self.dt # avoid float drift from summing dt
+        return self.now
+
+    def advance_to(self, tick):
+        """ jump straight to a later tick """
+        return self.tick(tick - self.ticks)
+
+    def to_ticks(self, seconds):
+        """ number of ticks covering a span of simulated seconds """
+        return seconds / self.dt
+
+    def reset(self):
+        self.ticks = 0
+        self.now = 0.0
+
+    def first_tick_at(self, t):
+        """ earliest tick whose time is >= t """
+        k = int(t // self.dt)
+        while k * self.dt < t:
+            k += 1
+        while k > 0 and (k - 1) * self.dt >= t:
+            k -= 1
+        return k
+
+    def last_tick_at(self, t):
+        """ latest tick whose time is <= t """
+        k = int(t // self.dt)
+        while (k + 1) * self.dt <= t:
+            k += 1
+        while k * self.dt > t:
+            k -= 1
+        return k
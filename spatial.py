@@ -0,0 +1,90 @@
+class SpatialGrid:
+    """Uniform grid over the world. Every car is filed under the cell of
+    its top left corner and moves between cells as it drives, so a region
+    only has to look at the cars filed in the cells it covers.
+
+    cell: int: cell size in pixels, at least the longest car
+    margin: int: largest car extent. A car filed up to margin pixels up or
+    left of a region can still reach into it"""
+    def __init__(self, cell=100, margin=80):
+        self.cell = cell
+        self.margin = margin
+        self.cells = {} # (col, row) -> {car: None}, dicts keep spawn order
+        self.where = {} # car -> (col, row)
+        self.watching = {} # (col, row) -> regions (intersections) watching
+
+    def key(self, x, y):
+        return (int(x // self.cell), int(y // self.cell))
+
+    def insert(self, car):
+        key = self.key(car.x, car.y)
+        self.where[car] = key
+        self.cells.setdefault(key, {})[car] = None
+
+    def remove(self, car):
+        key = self.where.pop(car)
+        cell = self.cells[key]
+        del cell[car]
+        if not cell:
+            del self.cells[key]
+
+    def update(self, cars):
+        """ refile the cars whose top left corner crossed into a new cell """
+        cell, where, cells = self.cell, self.where, self.cells
+        for car in cars:
+            key = (int(car.x // cell), int(car.y // cell))
+            old = where[car]
+            if key != old:
+                old_cell = cells[old]
+                del old_cell[car]
+                if not old_cell:
+                    del cells[old]
+                where[car] = key
+                cells.setdefault(key, {})[car] = None
+
+    def move(self, car, key):
+        """ refile one car, whose new cell is known """
+        old = self.where[car]
+        if key != old:
+            old_cell = self.cells[old]
+            del old_cell[car]
+            if not old_cell:
+                del self.cells[old]
+            self.where[car] = key
+            self.cells.setdefault(key, {})[car] = None
+
+    def nearby(self):
+        """ every watched cell and the ring of cells around them, which
+        holds any car that has just left a watching region """
+        return {(c + i, r + j) for c, r in self.watching
+                for i in (-1, 0, 1) for j in (-1, 0, 1)}
+
+    def cells_for(self, rect):
+        """ keys of every cell that can hold a car touching rect """
+        left, top = self.key(rect.left - self.margin, rect.top - self.margin)
+        right, bottom = self.key(rect.right, rect.bottom)
+        return [(c, r) for c in range(left, right + 1)
+                for r in range(top, bottom + 1)]
+
+    def watch(self, keys, region):
+        """ register region as interested in the cars filed in keys """
+        for key in keys:
+            self.watching.setdefault(key, []).append(region)
+
+    def watchers(self):
+        """ regions watching at least one occupied cell, in a stable order.
+        Costs one lookup per occupied cell, however many regions exist """
+        found = {}
+        watching = self.watching
+        for key in self.cells:
+            for region in watching.get(key, ()):
+                found[region] = None
+        return found
+
+    def query(self, keys):
+        """ cars filed in the given cells (see cells_for) """
+        cells = self.cells
+        for key in keys:
+            cell = cells.get(key)
+            if cell:
+                yield from cell
@@ -0,0 +1,54 @@
+from types import SimpleNamespace
+
+import pygame
+import pytest
+
+from batch import NearMisses, parse_value, run_one
+from movements import conflict_table
+
+
+def test_params_take_paths_and_flags():
+    assert parse_value('20') == 20
+    assert parse_value('20:40') == (20, 40)
+    assert parse_value('false') is False
+    assert parse_value('/tmp/run.log') == '/tmp/run.log'
+
+
+def test_events_run_on_the_event_engine():
+    ticked = run_one(({}, 0, 60., {}))
+    jumped = run_one(({'events': True}, 0, 60., {}))
+    assert jumped['trips'] == ticked['trips']
+    assert jumped['crashes'] is None # can't be watched between events
+
+
+def test_runs_write_their_metrics(tmp_path):
+    pytest.importorskip('numpy')
+    base = {'metrics': str(tmp_path / 'metrics.csv')}
+    for seed in (0, 1):
+        run_one(({'speed_limit': 20}, seed, 60., base))
+    # one file per job
+    for seed in (0, 1):
+        path = tmp_path / ('metrics-speed_limit=20-seed=%d.csv' % seed)
+        assert len(path.read_text().splitlines()) > 1
+
+
+class Car(pygame.Rect):
+    __hash__ = object.__hash__ # as main.Car, kept in dicts
+    def __init__(self, uid, rect, direction, movement='through'):
+        super().__init__(rect)
+        self.uid, self.direction, self.movement = uid, direction, movement
+        self.turn_at = None
+
+
+def test_near_misses_only_count_conflicting_movements():
+    zone = pygame.Rect(0, 0, 50, 50)
+    # opposite through traffic passes side by side. A left turner from
+    # the right of it, already turned into heading u, cuts across the
+    # oncoming car, but not the one in its own lane
+    cars = [Car(0, (10, 30, 20, 15), 'r'), Car(1, (20, 5, 20, 15), 'l'),
+            Car(2, (30, 10, 15, 20), 'u', 'left')]
+    crossing = SimpleNamespace(cross_zone=zone,
+            conflicts=conflict_table(zone, 5), cars=dict.fromkeys(cars))
+    misses = NearMisses()
+    misses(SimpleNamespace(busy=[crossing]))
+    assert misses.near == misses.crashes == {(1, 2)}
@@ -0,0 +1,26 @@
+import pytest
+
+from bench import compare, result, summary
+
+
+def test_summary_is_robust_to_one_slow_sample():
+    median, spread = summary([1., 1.1, .9, 1., 5.])
+    assert median == 1.
+    assert spread == pytest.approx(.1)
+
+
+def test_compare_widens_the_tolerance_by_the_baselines_spread():
+    baseline = {'steady': result(1., 's', 'lower'),
+            'noisy': result(1., 's', 'lower', .05),
+            'wild': result(1., 's', 'lower', .4),
+            'rate': result(1., 'ticks/s', 'higher'),
+            'trips': result(394, 'trips', 'equal')}
+    now = {'steady': result(1.3, 's', 'lower', .5), # its own noise
+            'noisy': result(1.3, 's', 'lower'),
+            'wild': result(1.42, 's', 'lower'), # capped at MAX_SPREAD
+            'rate': result(.72, 'ticks/s', 'higher'),
+            'trips': result(395, 'trips', 'equal')}
+    status = {row[0]: row[4] for row in compare(now, baseline, .25)}
+    assert status == {'steady': 'REGRESSION', 'noisy': 'ok',
+            'wild': 'REGRESSION', 'rate': 'REGRESSION',
+            'trips': 'REGRESSION'}
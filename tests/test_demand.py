@@ -0,0 +1,56 @@
+import json
+
+import pytest
+
+pytest.importorskip('numpy')
+from demand import Curve, Fixed, approaches, process, select
+from scenario import load
+
+
+@pytest.mark.parametrize('text', ['fixed:0', 'poisson:-5', 'poisson:inf',
+        'poisson:x', 'fixed:60:-1', 'poisson:60:5', 'curve:0@0,60@0',
+        'curve:0@-60', 'curve:60'])
+def test_bad_processes_are_refused(text):
+    with pytest.raises(ValueError):
+        process(text)
+
+
+def test_good_processes():
+    assert process('fixed:120:5').gap == 30.
+    assert isinstance(process('curve:0@0,600@900'), Curve)
+    assert isinstance(process('fixed:1'), Fixed)
+
+
+@pytest.mark.parametrize('text', ['abc', 'xr', '', '0r/sideways', '9'])
+def test_bad_approaches_are_refused(text):
+    with pytest.raises(ValueError, match='approach|movement'):
+        select(text, approaches('hv'))
+
+
+def test_approaches_pick_roads_and_headings():
+    ways = approaches('hv') # 0l 0r 1u 1d
+    assert select('*', ways) == ([0, 1, 2, 3], None)
+    assert select('1', ways) == ([2, 3], None)
+    assert select('0r/left', ways) == ([1], 'left')
+
+
+def test_scenario_names_the_bad_stream(tmp_path):
+    path = tmp_path / 'demand.json'
+    path.write_text(json.dumps({'demand': {'streams': [
+            ['*', 'poisson:900'], ['0r', 'fixed:0']]}}))
+    with pytest.raises(ValueError, match=r"\[demand\] streams: entry 2 "
+            r"\('fixed:0'\): fixed rate has to be > 0"):
+        load(str(path))
+
+
+def test_scenario_checks_approaches_against_its_roads(tmp_path):
+    path = tmp_path / 'demand.json'
+    # a 2 x 3 grid: roads 0 and 1 horizontal, 2 to 4 vertical
+    tables = {'network': {'grid': [2, 3]},
+            'demand': {'streams': [['4d', 'poisson:900']]}}
+    path.write_text(json.dumps(tables))
+    assert load(str(path))[0]['demand'] == [('4d', 'poisson:900')]
+    tables['demand']['streams'].append(['4r', 'poisson:900'])
+    path.write_text(json.dumps(tables))
+    with pytest.raises(ValueError, match=r"entry 2 \('4r'\): no approach"):
+        load(str(path))
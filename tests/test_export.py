@@ -0,0 +1,16 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_a_run_exports_and_records_from_the_command_line(tmp_path):
+    log = tmp_path / 'run.log'
+    env = dict(os.environ, SDL_VIDEODRIVER='dummy')
+    subprocess.run([sys.executable, 'export.py', '--param',
+            'record=%s' % log, '--param', 'follow=false', '--duration', '2',
+            '--stride', '30', '--processes', '1', '--out',
+            str(tmp_path / '%03d.png')], cwd=ROOT, env=env, check=True)
+    assert log.stat().st_size
+    assert list(tmp_path.glob('*.png'))
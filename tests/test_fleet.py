@@ -0,0 +1,43 @@
+import random
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('numpy')
+import main
+from fleet import Fleet
+
+
+def test_the_fleet_moves_cars_like_car_update():
+    # whole pixel speeds, so Car objects lose nothing rounding onto rects
+    sim = main.Simulation(headless=True, seed=0, size=(4000, 4000))
+    sim.on_init()
+    sim.object_init()
+    rng = random.Random(1)
+    fleet = Fleet(capacity=4, cell=100) # grown as cars are added
+    cars = [] # (slot holder, Car)
+    for road in sim.roads:
+        for heading, start in road.starts.items():
+            car = sim.pool.acquire(start, heading)
+            holder = SimpleNamespace(slot=None)
+            holder.slot = fleet.add(car.x, car.y, heading, car.vel, car.l,
+                    owner=holder)
+            cars.append((holder, car))
+    for tick in range(1, 301):
+        now = sim.sim_clock.tick()
+        for holder, car in cars:
+            # the fleet holds one instruction, so a new one once it's over
+            if rng.random() < .05 and fleet.inst_until[holder.slot] < now:
+                speed = rng.randint(0, 12)
+                until = now + rng.randint(1, 60) * sim.sim_clock.dt
+                car.instruct(speed, until)
+                fleet.instruct(holder.slot, speed, until)
+            car.update()
+        fleet.step(now)
+        if tick % 100 == 0: # drop a car, the last slot moves into its place
+            holder, _ = cars.pop(0)
+            fleet.remove(holder.slot)
+        assert len(fleet) == len(cars)
+        for holder, car in cars:
+            assert (fleet.x[holder.slot], fleet.y[holder.slot]) == (car.x,
+                    car.y)
@@ -0,0 +1,49 @@
+import pytest
+
+pytest.importorskip('numpy')
+import main
+
+
+def test_spawns_wait_for_room_behind_a_queue():
+    # cars slowed at the crossing take long to speed up again, so lanes
+    # back up to the end of the road
+    sim = main.Simulation(headless=True, seed=0, accel=50, follow=True)
+    sim.on_init()
+    sim.object_init()
+    sim.run(120)
+    assert sim.held
+    assert not sim.lanes.collisions
+
+
+def test_safety_only_counts():
+    # without car following, counting collisions leaves the traffic alone
+    runs = []
+    for safety in (False, True):
+        sim = main.Simulation(headless=True, seed=2, spawn_interval=.1,
+                safety=safety)
+        sim.on_init()
+        sim.object_init()
+        sim.run(120)
+        runs.append((sim.trips, sim.trip_delay))
+    assert runs[0] == runs[1]
+
+
+def test_linked_lanes_hold_every_car_once():
+    from following import lane_of
+    sim = main.Simulation(headless=True, seed=1, grid=(2, 2), follow=True,
+            spawn_interval=.1, turn_mix=(.6, .2, .2))
+    checked = []
+
+    def check(sim):
+        lanes = sim.lanes
+        assert lanes.n == len(sim.cars)
+        keys = {lane_of(car) for car in sim.cars}
+        assert set(lanes.ends) == keys
+        for key in keys:
+            lane = lanes.lane(key)
+            assert sorted(map(id, lane)) == sorted(id(car)
+                    for car in sim.cars if lane_of(car) == key)
+        checked.append(len(keys))
+
+    sim.execute(40, [check])
+    assert max(checked) > 4
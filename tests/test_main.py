@@ -0,0 +1,64 @@
+import logging
+
+from main import Simulation, options, parse_args
+
+
+def test_only_given_options_override_a_scenario():
+    given = options(parse_args(['--scenario', 'x.toml', '--plan', '0',
+            '--headless'], given=True))
+    assert given == {'plan_window': 0, 'headless': True}
+    assert options(parse_args([]))['plan_window'] == 0
+    assert options(parse_args(['--demand', '*', 'poisson:900'],
+            given=True)) == {'demand': [('*', 'poisson:900')]}
+
+
+def test_the_pool_reuses_cars_and_stays_bounded(caplog):
+    sim = Simulation(headless=True, seed=1)
+    seen = set()
+    most = [0]
+
+    def watch(sim):
+        seen.update(map(id, sim.cars))
+        stats = sim.pool.stats()
+        assert stats['live'] == len(sim.cars)
+        most[0] = max(most[0], stats['live'] + stats['pooled'])
+
+    with caplog.at_level(logging.INFO, logger='main'):
+        sim.execute(600, [watch])
+    stats = sim.pool.stats()
+    assert stats['spawned'] == sim.trips + len(sim.cars) > 1000
+    # every car object ever built is live or pooled, and few were built
+    assert len(seen) == most[0] == stats['live'] + stats['pooled'] < 30
+    assert '%d cars spawned from a pool' % stats['spawned'] in caplog.text
+
+
+def test_simulations_stepped_in_turn_keep_to_themselves():
+    alone = {}
+    for seed in (2, 5):
+        sim = Simulation(headless=True, seed=seed, grid=(2, 2))
+        sim.execute(60)
+        alone[seed] = (sim.trips, sim.trip_delay)
+    sims = [Simulation(headless=True, seed=seed, grid=(2, 2))
+            for seed in (2, 5)]
+    steps = {}
+
+    def watch(sim):
+        # observers get the simulation stepped, whose cars and
+        # intersections are its own
+        steps[id(sim)] = steps.get(id(sim), 0) + 1
+        assert all(car.sim is sim for car in sim.cars)
+        assert all(x.sim is sim for x in sim.intersections)
+
+    for sim in sims:
+        sim.on_init()
+        sim.object_init()
+        sim.attach_observers()
+        sim.observers.append(watch)
+    for _ in range(1800):
+        for sim in sims:
+            sim.step()
+    for sim in sims:
+        sim.close()
+    assert steps == {id(sim): 1800 for sim in sims}
+    assert [(sim.trips, sim.trip_delay) for sim in sims] == [alone[2],
+            alone[5]]
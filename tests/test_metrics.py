@@ -0,0 +1,46 @@
+import csv
+
+import pytest
+
+pytest.importorskip('numpy')
+import main
+from metrics import FRONT
+
+
+@pytest.mark.parametrize('settings', [{}, {'follow': True}, {'fleet': True},
+        {'grid': (2, 2), 'accel': 500, 'turn_mix': (.6, .2, .2)}])
+def test_crossings_match_a_tick_by_tick_look(tmp_path, settings):
+    path = tmp_path / 'metrics.csv'
+    sim = main.Simulation(headless=True, seed=3, metrics=str(path),
+            metrics_window=120, **settings)
+    sim.on_init()
+    sim.object_init()
+    sim.attach_observers()
+    approach, reached, cleared = {}, {}, {}
+
+    def look(sim):
+        # the first tick each car's front is over the crossing's line, and
+        # the first its rect is clear of the crossing again
+        for i, x in enumerate(sim.intersections):
+            for car in x.cars:
+                key = (x, car.uid, car.spawned)
+                approach.setdefault(key, (str(i), car.direction))
+                if key not in reached:
+                    if FRONT[car.direction](car, x.cross_zone) > 0:
+                        reached[key] = sim.sim_clock.ticks
+                elif key not in cleared and not car.colliderect(x.cross_zone):
+                    cleared[key] = sim.sim_clock.ticks
+
+    sim.observers.append(look)
+    sim.run(120) # a single window
+    sim.close()
+    rows = {(r['intersection'], r['approach']): r
+            for r in csv.DictReader(path.open()) if r['intersection'] != '-1'}
+    assert len(rows) > 1
+    for at, row in rows.items():
+        mine = [k for k in reached if approach[k] == at]
+        assert float(row['throughput']) * 2 == len(mine)
+        times = [cleared[k] - reached[k] for k in mine if k in cleared]
+        if times:
+            assert float(row['crossing_time']) / sim.sim_clock.dt == (
+                    pytest.approx(sum(times) / len(times)))
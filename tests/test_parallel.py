@@ -0,0 +1,19 @@
+import main
+
+
+def run(workers):
+    sim = main.Simulation(headless=True, seed=4, grid=(2, 2), workers=workers,
+            turn_mix=(.6, .2, .2), plan_window=.5, platoon_headway=.5,
+            tiles=4, accel=2000)
+    cars = {}
+
+    def snapshot(sim):
+        cars[sim.sim_clock.ticks] = [(car.uid, tuple(car), car.speed)
+                for car in sim.cars]
+
+    sim.execute(30, [snapshot])
+    return sim.trips, sim.trip_delay, sim.delay_saved, cars
+
+
+def test_workers_match_a_serial_run():
+    assert run(2) == run(0)
@@ -0,0 +1,42 @@
+from batch import NearMisses
+from controller import TOP
+import main
+
+
+def planned(**settings):
+    sim = main.Simulation(headless=True, seed=0, grid=(2, 2),
+            plan_window=.5, **settings)
+    sim.on_init()
+    sim.object_init()
+    fastest = [0.] # most times its own speed any car went
+    def check(sim):
+        for car in sim.cars:
+            fastest[0] = max(fastest[0], car.speed / car.vel)
+    sim.observers.append(check)
+    sim.run(300)
+    return sim, fastest[0]
+
+
+def test_plans_repeat_whatever_the_budget():
+    # a budget this small cuts most searches short
+    first, _ = planned(plan_budget=3)
+    second, _ = planned(plan_budget=3)
+    assert first.delay_saved == second.delay_saved
+    assert first.trips == second.trips
+
+
+def test_speed_ups_stay_feasible():
+    sim, fastest = planned()
+    assert sim.delay_saved > 0
+    assert fastest <= TOP + 1e-9
+
+
+def test_batches_close_with_room_to_slow_down():
+    sim = main.Simulation(headless=True, seed=0, plan_window=.5, accel=2000)
+    sim.on_init()
+    sim.object_init()
+    misses = NearMisses()
+    sim.observers.append(misses)
+    sim.run(300)
+    assert sim.trips > 900
+    assert not misses.crashes
@@ -0,0 +1,50 @@
+import main
+
+
+def arrive(sim, x, gap=0):
+    """ a car heading r, booked, gap pixels behind car x, or with x None
+    just inside the outer boundary """
+    intersection = sim.intersections[0]
+    road = sim.roads[0]
+    car = sim.pool.acquire(road.starts['r'], 'r')
+    car.vel = car.speed = 18
+    car.right = (x.left if x else intersection.outer_boundary.left) - gap
+    intersection.enter(car)
+    intersection.controller.reserve_spot(car)
+    return car
+
+
+def test_followers_share_the_leaders_slot_until_the_last_leaves():
+    sim = main.Simulation(headless=True, seed=0, platoon_headway=.5)
+    sim.on_init()
+    sim.object_init()
+    controller = sim.intersections[0].controller
+    book = controller.reservations
+    leader = arrive(sim, None)
+    slot = book.get(leader)
+    # a lone car keeps its own slot, no platoon is formed
+    assert slot and not controller.platoons
+    follower = arrive(sim, leader, gap=10)
+    platoon = controller.platoons[leader]
+    assert controller.platoons[follower] is platoon
+    assert leader not in book and len(book) == 1
+    start, end = book.get(platoon)
+    assert start == slot[0] and end > slot[1]
+    controller.remove_reservation(leader)
+    assert book.get(platoon) == (start, end)
+    controller.remove_reservation(follower)
+    assert not book and not controller.open and not controller.platoons
+
+
+def test_a_lone_leader_leaving_closes_its_movement():
+    sim = main.Simulation(headless=True, seed=0, platoon_headway=.5)
+    sim.on_init()
+    sim.object_init()
+    controller = sim.intersections[0].controller
+    leader = arrive(sim, None)
+    assert controller.open
+    controller.remove_reservation(leader)
+    assert not controller.reservations and not controller.open
+    # far behind, a new car leads again instead of joining a gone one
+    car = arrive(sim, None)
+    assert car in controller.reservations and not controller.platoons
@@ -0,0 +1,20 @@
+import pstats
+
+import pytest
+
+import main
+
+
+def test_profile_ticks_include_both_ends(tmp_path):
+    path = tmp_path / 'ticks.pstats'
+    sim = main.Simulation(headless=True, seed=0, profile_ticks=(3, 5),
+            profile_out=str(path))
+    sim.execute(10 / sim.fps) # 10 ticks
+    spawns = [calls[0] for (_, _, name), calls
+            in pstats.Stats(str(path)).stats.items() if name == 'spawn']
+    assert spawns == [3] # once a tick
+
+
+def test_profile_ticks_must_be_in_order():
+    with pytest.raises(ValueError):
+        main.Simulation(headless=True, profile_ticks=(5, 3))
@@ -0,0 +1,57 @@
+import pytest
+
+from batch import NearMisses
+import main
+from profiles import arrival, distance, reach, segments
+
+
+@pytest.mark.parametrize('d, v0, v2, step', [
+        (250., 17., 17., .56), (250., 12., 19., .6), (400., 20., 15., .3)])
+def test_reach_ends_are_driven_exactly(d, v0, v2, step):
+    earliest, latest = reach(d, v0, v2, step)
+    assert earliest < arrival(d, v0, v2, step) < latest
+    for ticks in (earliest, latest):
+        (v1, _), _ = segments(d, ticks, v0, v2, step)
+        assert distance(v0, v1, v2, ticks, step) == pytest.approx(d)
+
+
+def test_reach_holds_the_top_speed():
+    earliest, _ = reach(400., 17., 17., .6, top=20.)
+    assert earliest > reach(400., 17., 17., .6)[0]
+    (v1, _), _ = segments(400., earliest, 17., 17., .6)
+    assert v1 == pytest.approx(20.)
+    assert distance(17., v1, 17., earliest, .6) == pytest.approx(400.)
+    assert reach(400., 17., 17., 0., top=20.)[0] == 20.
+
+
+def test_reach_is_open_ended_with_room_to_stop():
+    assert reach(600., 17., 17., 1.1)[1] == float('inf')
+
+
+def test_reach_without_room_to_get_to_speed():
+    # 12 -> 19 px/tick takes longer than the 100 px there are
+    natural = arrival(100., 12., 19., .3)
+    assert 100. / 19. < natural < 100. / 12.
+    assert reach(100., 12., 19., .3) == (natural, natural)
+
+
+def test_no_crashes_at_low_accel():
+    # half the platoon benchmark's acceleration, with an outer boundary
+    # long enough to stop in
+    sim = main.Simulation(headless=True, seed=0, accel=1000, factor=9)
+    sim.on_init()
+    sim.object_init()
+    misses = NearMisses()
+    sim.observers.append(misses)
+    sim.run(300)
+    assert sim.trips > 900
+    assert not misses.crashes
+
+
+def test_warns_without_room_to_stop(caplog):
+    # 600 px/s needs 360 px to stop at 500 px/s^2, factor 5 leaves 250
+    main.Simulation(headless=True, accel=500)
+    assert 'need 360 px to stop' in caplog.text
+    caplog.clear()
+    main.Simulation(headless=True, accel=1000, factor=9)
+    assert not caplog.text
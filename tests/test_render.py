@@ -0,0 +1,57 @@
+import os
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+import pygame
+
+import main
+from render import Renderer, Snapshot, snapshot
+
+
+def test_a_snapshot_keeps_the_cars_as_they_were():
+    sim = main.Simulation(headless=True, seed=0)
+    sim.on_init()
+    sim.object_init()
+    sim.run(5)
+    cars = list(sim.cars)
+    taken = snapshot(sim.sim_clock.ticks, cars)
+    assert taken.tick == sim.sim_clock.ticks
+    assert taken.cars == tuple((c.x, c.y, c.w, c.h, c.color) for c in cars)
+    sim.step()
+    assert taken.cars != tuple((c.x, c.y, c.w, c.h, c.color) for c in cars)
+
+
+def test_the_window_only_gets_a_snapshot_once_it_drew_the_last():
+    sim = main.Simulation(headless=True, seed=0)
+    sim.on_init()
+    sim.object_init()
+    drawn = []
+    sim.renderer = type('Drawn', (), {'draw': staticmethod(drawn.append)})()
+    sim.step()
+    sim.publish(sim)
+    first = sim.snapshot
+    sim.step()
+    sim.publish(sim) # not drawn yet, so this tick is skipped
+    assert sim.snapshot is first and first.tick == 1
+    sim.draw_latest()
+    sim.draw_latest() # nothing new
+    assert drawn == [first] and sim.wanted
+    sim.step()
+    sim.publish(sim)
+    assert sim.snapshot.tick == 3
+
+
+def test_frames_restore_what_cars_left_and_draw_where_they_are():
+    pygame.display.init()
+    try:
+        screen = pygame.display.set_mode((200, 200))
+        message = pygame.Surface((1, 1))
+        renderer = Renderer(screen, [], [], message)
+        red, green = (255, 0, 0), (0, 255, 0)
+        renderer.draw(Snapshot(1, ((10, 10, 20, 15, red),)))
+        assert screen.get_at((15, 15))[:3] == red
+        renderer.draw(Snapshot(2, ((50, 50, 20, 15, green),)))
+        assert screen.get_at((15, 15))[:3] == (0, 0, 0)
+        assert screen.get_at((55, 55))[:3] == green
+        assert renderer.drawn == [pygame.Rect(50, 50, 20, 15)]
+    finally:
+        pygame.display.quit()
@@ -0,0 +1,32 @@
+import pytest
+
+import main
+from replay import Replayer
+
+# around the keyframes (every 300 ticks), in an order that seeks both
+# forwards and backwards
+TICKS = [901, 300, 1799, 299, 600, 1, 301, 899, 900, 1500]
+
+
+@pytest.mark.parametrize('settings', [{}, {'turn_mix': (.6, .2, .2)},
+        {'accel': 2000}, {'tiles': 4, 'turn_mix': (.6, .2, .2)},
+        {'grid': (2, 2), 'plan_window': .5, 'platoon_headway': .5},
+        {'fleet': True}])
+def test_seeks_rebuild_the_live_cars(tmp_path, settings):
+    if settings.get('fleet'):
+        pytest.importorskip('numpy')
+    path = str(tmp_path / 'run.log')
+    live = {}
+
+    def snapshot(sim):
+        if sim.sim_clock.ticks in TICKS:
+            live[sim.sim_clock.ticks] = {car.uid: (tuple(car), car.color)
+                    for car in sim.cars}
+
+    sim = main.Simulation(headless=True, seed=1, record=path, **settings)
+    sim.execute(60, [snapshot])
+    replayer = Replayer(path)
+    for tick in TICKS:
+        cars = replayer.seek(tick)
+        assert {uid: (tuple(car.rect), car.color)
+                for uid, car in cars.items()} == live[tick], tick
@@ -0,0 +1,66 @@
+import random
+
+import reservations
+from reservations import ReservationBook
+
+
+def gap(slots, after, length, mask):
+    """ earliest_gap worked out by trying every candidate """
+    slots = [(s, e) for s, e, kind in slots if mask >> kind & 1]
+    for t in sorted({after} | {e for _, e in slots if e >= after}):
+        if not any(s <= t + length and e > t for s, e in slots):
+            return t
+
+
+def test_free_since_sees_long_slot_ending_before_start():
+    book = ReservationBook()
+    book.add('long', 0., 9.5)
+    book.add('short', 9.6, 9.8)
+    book.add('first', 10., 10.5)
+    book.remove('short')
+    # the long slot starts far before 10, yet ends after now
+    assert book.free_since(10., 1.) == 9.5
+    assert book.free_since(10., 1., mask=0b10) == 1.
+
+
+def test_earliest_gap_only_counts_masked_kinds():
+    book = ReservationBook()
+    book.add('a', 1., 2., kind=0)
+    book.add('b', 2.5, 4., kind=1)
+    book.add('c', 4.2, 5., kind=0)
+    assert book.earliest_gap(1., .6) == 5.
+    assert book.earliest_gap(1., .6, mask=0b1) == 2.
+    assert book.earliest_gap(1., .6, mask=0b10) == 1.
+
+
+def test_queries_match_a_scan(monkeypatch):
+    monkeypatch.setattr(reservations, 'LOAD', 2) # many small blocks
+    rng = random.Random(0)
+    book = ReservationBook()
+    slots = {}
+    for _ in range(2000):
+        if slots and rng.random() < .4:
+            owner = rng.choice(list(slots))
+            assert book.remove(owner) == slots.pop(owner)[:2]
+        else:
+            owner = rng.randrange(60)
+            start = rng.uniform(0., 50.)
+            end = start + rng.choice((rng.uniform(0., 2.),
+                    rng.uniform(0., 30.))) # some much longer than most
+            kind = rng.randrange(12)
+            book.add(owner, start, end, kind)
+            slots[owner] = (start, end, kind)
+        mask = rng.choice((-1, rng.randrange(1 << 12)))
+        start = rng.uniform(-5., 55.)
+        end = start + rng.uniform(0., 3.)
+        found = sorted((s, e, owner) for owner, (s, e, kind) in slots.items()
+                if s <= end and e > start and mask >> kind & 1)
+        assert sorted(book.overlapping(start, end, mask)) == found
+        assert book.overlaps(start, end, mask) == bool(found)
+        default = rng.uniform(-5., 55.)
+        assert book.free_since(start, default, mask) == max([default] + [
+                e for s, e, kind in slots.values()
+                if s < start and mask >> kind & 1])
+        length = rng.uniform(0., 3.)
+        assert book.earliest_gap(start, length, mask) == gap(
+                slots.values(), start, length, mask)
@@ -0,0 +1,24 @@
+from simclock import SimClock
+
+
+def test_time_is_ticks_times_dt_without_drift():
+    clock = SimClock(1 / 30)
+    for _ in range(108000): # an hour of ticks, one at a time
+        clock.tick()
+    assert clock.ticks == 108000
+    assert clock.now == 3600.
+    assert clock.advance_to(108030) == 3601.
+    assert clock.to_ticks(2.) == 60.
+    clock.reset()
+    assert (clock.ticks, clock.now) == (0, 0.)
+
+
+def test_first_and_last_tick_at_a_time():
+    clock = SimClock(1 / 30)
+    for k in range(3000):
+        t = k * clock.dt # on a tick, however it rounds
+        assert clock.first_tick_at(t) == clock.last_tick_at(t) == k
+        # between ticks
+        assert clock.first_tick_at(t + clock.dt / 2) == k + 1
+        assert clock.last_tick_at(t + clock.dt / 2) == k
+    assert clock.first_tick_at(0.) == clock.last_tick_at(0.) == 0
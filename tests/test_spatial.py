@@ -0,0 +1,41 @@
+import random
+
+import pygame
+
+from spatial import SpatialGrid
+
+
+class Box(pygame.Rect):
+    __hash__ = object.__hash__
+
+
+def test_queries_find_what_a_brute_force_scan_does():
+    rng = random.Random(0)
+    grid = SpatialGrid(cell=100, margin=80)
+    boxes = []
+    for _ in range(300):
+        w, h = rng.choice([(80, 15), (15, 80), (20, 15), (15, 20)])
+        box = Box(rng.randrange(-80, 1000), rng.randrange(-80, 1000), w, h)
+        grid.insert(box)
+        boxes.append(box)
+    regions = [pygame.Rect(rng.randrange(0, 900), rng.randrange(0, 900),
+            rng.randrange(1, 300), rng.randrange(1, 300)) for _ in range(20)]
+    for i, region in enumerate(regions):
+        grid.watch(grid.cells_for(region), i)
+    for _ in range(50):
+        for box in boxes: # drive a bit, across cells now and then
+            box.move_ip(rng.randint(-30, 30), rng.randint(-30, 30))
+        grid.update(boxes)
+        for _ in range(5): # some leave, others spawn
+            grid.remove(boxes.pop(rng.randrange(len(boxes))))
+            box = Box(rng.randrange(0, 1000), rng.randrange(0, 1000), 15, 80)
+            grid.insert(box)
+            boxes.append(box)
+        for i, region in enumerate(regions):
+            found = list(grid.query(grid.cells_for(region)))
+            assert len(found) == len(set(found))
+            touching = {box for box in boxes if box.colliderect(region)}
+            assert touching <= set(found)
+            if touching:
+                assert i in grid.watchers()
+    assert sorted(map(id, grid.where)) == sorted(map(id, boxes))
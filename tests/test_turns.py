@@ -0,0 +1,67 @@
+import pygame
+
+from controller import Controller
+import main
+from movements import crossing, lanes
+
+
+def test_crossing_follows_the_turn():
+    zone = pygame.Rect(0, 0, 50, 50)
+    lane = lanes(zone, 5)
+    assert crossing(zone, lane, 'r', 'r', 30) == 80
+    # to the near side lane and out, to the far side one and out
+    assert crossing(zone, lane, 'r', 'd', 30) == 20 + 20
+    assert crossing(zone, lane, 'r', 'u', 30) == 45 + 45
+
+
+def test_turning_cars_leave_within_their_slot(monkeypatch):
+    ends = {} # car -> end of its latest slot
+    granted = []
+    commit = Controller.commit
+    def recording(self, car, time_request, slot, decision):
+        ends[car] = slot[1]
+        granted.append(car.uid)
+        commit(self, car, time_request, slot, decision)
+    monkeypatch.setattr(Controller, 'commit', recording)
+    sim = main.Simulation(headless=True, seed=0, turn_mix=(.6, .2, .2))
+    sim.on_init()
+    sim.object_init()
+    late = []
+    def check(sim):
+        # a tick of slack, as cars are only seen where each tick left them
+        now = sim.sim_clock.now - sim.sim_clock.dt
+        for intersection in sim.intersections:
+            for car in intersection.cars:
+                if (car.movement != 'through' and car in ends
+                        and now > ends[car]
+                        and car.colliderect(intersection.cross_zone)):
+                    late.append(car.uid)
+    sim.observers.append(check)
+    sim.run(120)
+    assert len(granted) > 300
+    assert not late
+
+
+def test_turns_cost_no_delay_at_own_speed(monkeypatch):
+    delays = {}
+    despawn = main.Simulation.despawn
+    def recording(sim):
+        now = sim.sim_clock.ticks
+        for car in sim.despawned:
+            delays[car.uid] = now - car.spawned + 1 - car.free_ticks()
+        despawn(sim)
+    monkeypatch.setattr(main.Simulation, 'despawn', recording)
+    sim = main.Simulation(headless=True, seed=0, turn_mix=(0, .5, .5))
+    sim.on_init()
+    sim.object_init()
+    steady = {} # uid -> never told to change speed so far
+    def check(sim):
+        for car in sim.cars:
+            steady[car.uid] = (steady.get(car.uid, True)
+                    and not car.speed_instructions)
+    sim.observers.append(check)
+    sim.run(60)
+    undelayed = [delays[uid] for uid, ok in steady.items()
+            if ok and uid in delays]
+    assert len(undelayed) > 50
+    assert max(map(abs, undelayed)) < 1e-6
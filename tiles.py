@@ -0,0 +1,148 @@
+from math import floor
+from movements import TURNS
+
+
+def along(zone, h):
+    """ path distance along heading h of a coordinate, measured from the
+    side of the zone a car heading h drives in through """
+    if h == 'r':
+        return lambda p: p - zone.left
+    elif h == 'l':
+        return lambda p: zone.right - p
+    elif h == 'd':
+        return lambda p: p - zone.top
+    return lambda p: zone.bottom - p
+
+
+class Tiling:
+    """The crossing zone cut into n x n tiles, for reservations at tile
+    level in the manner of AIM (autonomous intersection management).
+    A car's path through the crossing is rasterized into claims: for every
+    tick the car covers any part of a tile, a bitset of those tiles (bit
+    row * n + col). Two cars conflict only when they claim the same tile
+    in the same tick, one AND per tick.
+
+    Cars follow their lanes the way Car.turn moves them: along the entry
+    lane until the front gets to the far side of the exit lane, then along
+    the exit lane starting with the rear at the entry lane's edge.
+    Finer tiles waste less of the crossing per claim but cost more bits
+    and more tiles per path"""
+    def __init__(self, zone, lanes, n):
+        self.zone = zone
+        self.lanes = lanes
+        self.n = n
+        self._paths = {} # (heading in, heading out, length) -> windows
+
+    def tiles(self, strip):
+        """ (bit, rect edges) of every tile overlapping strip """
+        zone, n = self.zone, self.n
+        tw, th = zone.w / n, zone.h / n
+        for row in range(n):
+            y0, y1 = zone.top + row * th, zone.top + (row + 1) * th
+            if not (y0 < strip.bottom and strip.top < y1):
+                continue
+            for col in range(n):
+                x0, x1 = zone.left + col * tw, zone.left + (col + 1) * tw
+                if x0 < strip.right and strip.left < x1:
+                    yield row * n + col, (x0, y0, x1, y1)
+
+    def span(self, h, edges, to_path):
+        """ path distances of the near and far edge of a tile along h """
+        x0, y0, x1, y1 = edges
+        if h in 'lr':
+            a, b = to_path(x0), to_path(x1)
+        else:
+            a, b = to_path(y0), to_path(y1)
+        return min(a, b), max(a, b)
+
+    def windows(self, h, e, length):
+        """ (bit, lo, hi): the tile is covered while the front of the car
+        is between lo and hi pixels past the zone's entry side """
+        key = (h, e, length)
+        if key not in self._paths:
+            into, out = self.lanes[h], self.lanes[e]
+            to_path = along(self.zone, h)
+            windows = []
+            if h == e:
+                for bit, edges in self.tiles(into):
+                    a, b = self.span(h, edges, to_path)
+                    windows.append((bit, a, b + length))
+            else:
+                # the front gets to the far side of the exit lane
+                line = {'r': out.right, 'l': out.left,
+                        'd': out.bottom, 'u': out.top}[h]
+                turn = to_path(line)
+                for bit, edges in self.tiles(into):
+                    a, b = self.span(h, edges, to_path)
+                    if a < turn:
+                        windows.append((bit, a, min(b + length, turn)))
+                # then the rear sits at the entry lane's edge
+                rear = {'d': into.top, 'u': into.bottom,
+                        'r': into.left, 'l': into.right}[e]
+                to_exit = along(self.zone, e)
+                offset = to_exit(rear)
+                for bit, edges in self.tiles(out):
+                    a, b = self.span(e, edges, to_exit)
+                    a, b = a - offset, b - offset # from the rear's start
+                    if b > 0:
+                        windows.append((bit, max(turn, turn + a - length),
+                                turn + b))
+            self._paths[key] = windows
+        return self._paths[key]
+
+    def claims(self, h, kind, length, speed, start, dt):
+        """ [(tick, tile bits)] in tick order for a car heading h making a
+        `kind` movement at speed (pixels per second) whose front reaches
+        the crossing at simulated time start. Padded by a tick each side """
+        claimed = {}
+        for bit, lo, hi in self.windows(h, TURNS[h][kind], length):
+            first = floor((start + lo / speed) / dt)
+            last = floor((start + hi / speed) / dt) + 1
+            for tick in range(first, last + 1):
+                claimed[tick] = claimed.get(tick, 0) | 1 << bit
+        return sorted(claimed.items())
+
+
+class TileBook:
+    """ Tiles claimed per tick, as bitsets. Claims of different owners
+    never share a bit, so booking and releasing are plain OR and XOR """
+    def __init__(self):
+        self.busy = {} # tick -> claimed tile bits
+        self._owners = {} # owner -> [(tick, bits)]
+
+    def __contains__(self, owner):
+        return owner in self._owners
+
+    def __len__(self):
+        return len(self._owners)
+
+    def fits(self, claims, shift=0):
+        """ are all claims free, moved by shift ticks """
+        busy = self.busy
+        for tick, bits in claims:
+            if busy.get(tick + shift, 0) & bits:
+                return False
+        return True
+
+    def add(self, owner, claims, shift=0):
+        """ book claims (moved by shift ticks) for owner. They should fit,
+        tiles held already stay with their owner if they don't """
+        busy = self.busy
+        booked = []
+        for tick, bits in claims:
+            tick += shift
+            held = busy.get(tick, 0)
+            if bits & ~held:
+                busy[tick] = held | bits
+                booked.append((tick, bits & ~held))
+        self._owners[owner] = booked
+
+    def remove(self, owner):
+        """ release owner's claims. Raises KeyError if owner has none """
+        busy = self.busy
+        for tick, bits in self._owners.pop(owner):
+            left = busy[tick] ^ bits
+            if left:
+                busy[tick] = left
+            else:
+                del busy[tick]